@@ -0,0 +1,205 @@
+"""
+Answer Cache Module
+Caches RAG answers in front of the LLM step: exact match on the normalized
+question, and optionally nearest-neighbour match over past query embeddings.
+"""
+
+import itertools
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+import numpy as np
+
+
+_TRAILING_PUNCTUATION = "?？!！。.，,;；:：~～ "
+
+
+def normalize_query(query: str) -> str:
+    """
+    Normalize a question for exact-match lookups.
+    
+    Applies NFKC (full-width to half-width), lowercases, collapses
+    whitespace and strips trailing punctuation.
+    """
+    text = unicodedata.normalize("NFKC", query).lower()
+    text = re.sub(r"\s+", " ", text).strip()
+    return text.rstrip(_TRAILING_PUNCTUATION)
+
+
+# Process-unique store ids; unlike id(), never reused after a store is freed
+_store_ids = itertools.count()
+
+
+def mark_store_changed(vectorstore):
+    """
+    Bump the content version of a vector store after changing it in place.
+    
+    Called for every add, removal and metadata change (such as a source
+    detached from a shared chunk), so answers cached before it miss.
+    """
+    vectorstore.content_version = getattr(vectorstore, "content_version", 0) + 1
+
+
+def store_fingerprint(vectorstore):
+    """
+    Identify the current contents of a vector store.
+    
+    Combines a process-unique id of the store object with its content
+    version (see mark_store_changed), so cached answers never outlive the
+    documents they came from. The chunk count and last chunk id also catch
+    chunks added directly through the FAISS API.
+    """
+    store_id = getattr(vectorstore, "store_id", None)
+    if store_id is None:
+        store_id = vectorstore.store_id = next(_store_ids)
+    count = vectorstore.index.ntotal
+    last_id = vectorstore.index_to_docstore_id.get(count - 1) if count else None
+    return (store_id, getattr(vectorstore, "content_version", 0), count, last_id)
+
+
+class AnswerCache:
+    """
+    In-memory LRU cache of answers with TTL and optional semantic lookup.
+    
+    Entries are only returned for the vector store contents they were
+    computed from (see store_fingerprint). Hit counts and the LLM time saved
+    by hits are tracked for metrics.
+    """
+    
+    def __init__(self, similarity_threshold: float = None, ttl_seconds: float = 3600,
+                 max_entries: int = 1000):
+        """
+        Args:
+            similarity_threshold (float): Minimum cosine similarity between
+                query embeddings for a semantic hit; None (default) disables
+                semantic lookup, so only exact matches hit
+            ttl_seconds (float): Entry lifetime in seconds
+            max_entries (int): Maximum number of entries (LRU eviction)
+        """
+        self.similarity_threshold = similarity_threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.latency_saved = 0.0
+
+    def _expire(self, now):
+        expired = [
+            key for key, entry in self._entries.items()
+            if now - entry["created"] > self.ttl_seconds
+        ]
+        for key in expired:
+            del self._entries[key]
+
+    def _hit(self, key, entry):
+        self._entries.move_to_end(key)
+        self.latency_saved += entry["latency"]
+        return entry["answer"], entry["docs"]
+
+    def get_exact(self, query: str, fingerprint):
+        """
+        Look up an answer by normalized question text.
+        
+        Returns:
+            tuple: (answer, docs), or None on a miss
+        """
+        key = (fingerprint, normalize_query(query))
+        with self._lock:
+            self._expire(time.time())
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self.exact_hits += 1
+            return self._hit(key, entry)
+
+    def get_similar(self, query_embedding, fingerprint):
+        """
+        Look up the answer of the most similar past question.
+        
+        Counts a miss when nothing is similar enough (always, when
+        semantic lookup is disabled), so call this after get_exact() has
+        missed.
+        
+        Returns:
+            tuple: (answer, docs), or None on a miss
+        """
+        if self.similarity_threshold is None:
+            with self._lock:
+                self.misses += 1
+            return None
+        
+        query = np.asarray(query_embedding, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1.0)
+        
+        with self._lock:
+            self._expire(time.time())
+            candidates = [
+                (key, entry) for key, entry in self._entries.items()
+                if key[0] == fingerprint
+            ]
+            if candidates:
+                matrix = np.stack([entry["embedding"] for _, entry in candidates])
+                similarities = matrix @ query
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.similarity_threshold:
+                    self.semantic_hits += 1
+                    return self._hit(*candidates[best])
+            self.misses += 1
+            return None
+
+    def put(self, query: str, query_embedding, fingerprint, answer, docs, latency: float):
+        """
+        Store an answer.
+        
+        Args:
+            query (str): Original question
+            query_embedding (list): Embedding of the question
+            fingerprint: store_fingerprint() of the store used for retrieval
+            answer (str): Generated answer
+            docs (list): Documents used as context
+            latency (float): Seconds it took to produce the answer
+        """
+        embedding = np.asarray(query_embedding, dtype=np.float32)
+        embedding = embedding / (np.linalg.norm(embedding) or 1.0)
+        key = (fingerprint, normalize_query(query))
+        
+        with self._lock:
+            self._entries[key] = {
+                "answer": answer,
+                "docs": docs,
+                "embedding": embedding,
+                "created": time.time(),
+                "latency": latency,
+            }
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """Drop all entries (metrics are kept)."""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """
+        Get cache metrics.
+        
+        Returns:
+            dict: Hit counts, hit rate, LLM seconds saved and entry count
+        """
+        hits = self.exact_hits + self.semantic_hits
+        lookups = hits + self.misses
+        return {
+            "exact_hits": self.exact_hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "latency_saved_seconds": self.latency_saved,
+            "entries": len(self._entries),
+        }
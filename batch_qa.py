@@ -0,0 +1,81 @@
+"""
+Batch Question Answering Script
+Answers questions from a JSONL file against a saved vector database and
+writes answers with their sources to another JSONL file.
+
+Each input line is a JSON object with a "question" field (and optionally an
+"id"). Each output line repeats the input fields and adds "answer" and
+"sources".
+
+Usage:
+    python batch_qa.py questions.jsonl answers.jsonl [--db faiss_db] [--concurrency 8]
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+import time
+
+from config import FAISS_DB_PATH, GOOGLE_API_KEY, LLM_CONCURRENCY
+from rag_chain import query_rag_batch
+from vector_store import load_vectorstore
+
+
+def read_questions(path: str):
+    """Read question records from a JSONL file, skipping blank lines."""
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def write_answers(path: str, records, results):
+    """Write question records with their answers and sources as JSONL."""
+    with open(path, "w", encoding="utf-8") as f:
+        for record, (answer, docs) in zip(records, results):
+            output = dict(record)
+            output["answer"] = answer
+            output["sources"] = [
+                {
+                    "source": doc.metadata.get("source"),
+                    "page": doc.metadata.get("page"),
+                    "content": doc.page_content,
+                }
+                for doc in docs
+            ]
+            f.write(json.dumps(output, ensure_ascii=False) + "\n")
+
+
+def main():
+    """Run batch question answering from the command line."""
+    parser = argparse.ArgumentParser(description="Answer questions from a JSONL file")
+    parser.add_argument("questions", help="input JSONL with a 'question' field per line")
+    parser.add_argument("answers", help="output JSONL path")
+    parser.add_argument("--db", default=FAISS_DB_PATH, help="saved vector database")
+    parser.add_argument("--concurrency", type=int, default=LLM_CONCURRENCY)
+    args = parser.parse_args()
+    
+    if not GOOGLE_API_KEY:
+        print("❌ 請在 .env 中設定 GOOGLE_API_KEY")
+        return False
+    
+    records = read_questions(args.questions)
+    vectorstore = load_vectorstore(args.db)
+    
+    start = time.perf_counter()
+    results = asyncio.run(query_rag_batch(
+        vectorstore,
+        [record["question"] for record in records],
+        GOOGLE_API_KEY,
+        concurrency=args.concurrency
+    ))
+    elapsed = time.perf_counter() - start
+    
+    write_answers(args.answers, records, results)
+    failed = sum(1 for answer, _ in results if answer.startswith("錯誤："))
+    print(f"✅ 已回答 {len(records) - failed}/{len(records)} 個問題，耗時 {elapsed:.1f} 秒")
+    return failed == 0
+
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,821 @@
+"""
+Benchmark Script for RAG Application
+Measures ingestion and retrieval performance on synthetic data, without
+requiring the EmbeddingGemma model or a Google API key.
+
+Usage:
+    python benchmark.py ingest-memory
+    python benchmark.py ingest-uploads [--files 8] [--sentences 60000]
+    python benchmark.py index-recall [--n 20000]
+    python benchmark.py db-load [--n 100000]
+    python benchmark.py llm-overhead [--n 200]
+    python benchmark.py hybrid-latency [--n 20000]
+    python benchmark.py quantization [--n 50000] [--vectors embeddings.npy]
+    python benchmark.py matryoshka [--n 100000] [--vectors embeddings.npy]
+    python benchmark.py embed-throughput [--n 512] [--threads 4]
+    python benchmark.py splitter [--mb 5]
+    python benchmark.py dedup [--versions 5]
+
+embed-throughput needs the real models (sentence-transformers, and for the
+ONNX backends `python onnx_embeddings.py export --quantize`).
+"""
+
+import argparse
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+
+# ============================================================================
+# Helpers
+# ============================================================================
+
+class HashEmbeddings(Embeddings):
+    """Fast deterministic stand-in for EmbeddingGemma (768-dim, normalized)."""
+    
+    def __init__(self, dim=768):
+        self.dim = dim
+    
+    def _vector(self, text):
+        rng = np.random.default_rng(zlib.crc32(text.encode("utf-8")))
+        vector = rng.standard_normal(self.dim).astype(np.float32)
+        return (vector / np.linalg.norm(vector)).tolist()
+    
+    def embed_documents(self, texts):
+        return [self._vector(text) for text in texts]
+    
+    def embed_query(self, text):
+        return self._vector(text)
+
+
+class InMemoryUploadedFile(io.BytesIO):
+    """Stand-in for Streamlit's UploadedFile, which is also a BytesIO."""
+    
+    def __init__(self, name, content):
+        super().__init__(content)
+        self.name = name
+        self.size = len(content)
+
+
+SAMPLE_SENTENCES = [
+    "本公司的退貨政策規定商品須於收到後七日內申請退貨。",
+    "產品型號 AX-2045 支援雙頻無線網路與藍牙 5.3。",
+    "員工請假須事先於系統中提出申請並經主管核准。",
+    "資料備份每日凌晨兩點自動執行並保留三十天。",
+    "The warranty covers manufacturing defects for two years.",
+]
+
+
+def synthetic_corpus(n_files, sentences_per_file=400, seed=0):
+    """Generate n_files synthetic .txt uploads of mixed Chinese/English text."""
+    rng = np.random.default_rng(seed)
+    files = []
+    for i in range(n_files):
+        picks = rng.integers(0, len(SAMPLE_SENTENCES), sentences_per_file)
+        lines = [f"{SAMPLE_SENTENCES[p]} (第 {i}-{j} 條)" for j, p in enumerate(picks)]
+        content = "\n".join(lines).encode("utf-8")
+        files.append(InMemoryUploadedFile(f"doc_{i:05d}.txt", content))
+    return files
+
+
+def start_fake_gemini_server():
+    """
+    Start a local HTTP server that answers Gemini REST generateContent calls
+    instantly, so client-side per-call overhead can be measured.
+    
+    Returns:
+        tuple: (endpoint URL, set of client (host, port) connections seen)
+    """
+    import threading
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    
+    connections = set()
+    body = json.dumps({
+        "candidates": [{
+            "content": {"parts": [{"text": "根據提供的資料，這是測試答案。"}], "role": "model"},
+            "finishReason": "STOP",
+            "index": 0,
+        }]
+    }).encode("utf-8")
+    
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive
+        disable_nagle_algorithm = True  # avoid delayed-ACK stalls on reused connections
+        
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            connections.add(self.client_address)
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        
+        def log_message(self, *args):
+            pass
+    
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_address[1]}", connections
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB (Unix only)."""
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+# ============================================================================
+# Benchmarks
+# ============================================================================
+
+def _ingest_memory_worker(n_files):
+    """Ingest a synthetic corpus in this process and print a JSON result."""
+    import vector_store
+    
+    vector_store.get_embeddings = lambda: HashEmbeddings()
+    files = synthetic_corpus(n_files)
+    baseline_mb = peak_rss_mb()
+    
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        start = time.perf_counter()
+        vectorstore = vector_store.create_vector_store(
+            files, "", temp_dir=os.path.join(tmp_dir, "uploads")
+        )
+        elapsed = time.perf_counter() - start
+    
+    chunks = vectorstore.index.ntotal
+    index_mb = chunks * vectorstore.index.d * 4 / (1024 * 1024)
+    keyword_mb = vectorstore.keyword_index.memory_bytes() / (1024 * 1024)
+    peak_mb = peak_rss_mb()
+    print(json.dumps({
+        "files": n_files,
+        "chunks": chunks,
+        "seconds": elapsed,
+        "peak_rss_mb": peak_mb,
+        "index_mb": index_mb,
+        "keyword_mb": keyword_mb,
+        "working_set_mb": peak_mb - baseline_mb - index_mb - keyword_mb,
+    }))
+
+
+def benchmark_ingest_memory(sizes=(10, 40, 160)):
+    """
+    Show that ingestion memory stays flat as the corpus grows.
+    
+    Each corpus size runs in a fresh process so peak RSS is not shared.
+    The working set is the peak RSS growth minus the FAISS vectors and the
+    BM25 keyword index, which must grow with the corpus. What remains is
+    the docstore text, which grows too, plus the chunk dedup state, which
+    grows until CHUNK_DEDUP_WINDOW chunks are kept and then stays flat.
+    """
+    print("\n📏 Ingestion peak memory vs corpus size\n")
+    print(
+        f"{'files':>6} {'chunks':>8} {'sec':>7} {'peak MB':>9} {'index MB':>9} "
+        f"{'keyword MB':>11} {'working MB':>11}"
+    )
+    
+    for n_files in sizes:
+        output = subprocess.run(
+            [sys.executable, __file__, "_ingest-memory-worker", str(n_files)],
+            capture_output=True, text=True, check=True
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print(
+            f"{result['files']:>6} {result['chunks']:>8} {result['seconds']:>7.2f} "
+            f"{result['peak_rss_mb']:>9.1f} {result['index_mb']:>9.1f} "
+            f"{result['keyword_mb']:>11.1f} {result['working_set_mb']:>11.1f}"
+        )
+
+
+def _ingest_uploads_worker(n_files, sentences_per_file, stage):
+    """Run one ingest stage on large uploads in this process and print JSON."""
+    import vector_store
+    
+    vector_store.get_embeddings = lambda: HashEmbeddings()
+    files = synthetic_corpus(n_files, sentences_per_file)
+    baseline_mb = peak_rss_mb()
+    
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        start = time.perf_counter()
+        if stage == "split":
+            chunks = sum(
+                len(documents) for _, documents in vector_store._iter_split_files(
+                    files, os.path.join(tmp_dir, "uploads"), vector_store.INGEST_WORKERS, []
+                )
+            )
+        else:
+            chunks = vector_store.create_vector_store(
+                files, "", temp_dir=os.path.join(tmp_dir, "uploads")
+            ).index.ntotal
+        elapsed = time.perf_counter() - start
+    
+    print(json.dumps({
+        "chunks": chunks,
+        "seconds": elapsed,
+        "peak_growth_mb": peak_rss_mb() - baseline_mb,
+    }))
+
+
+def benchmark_ingest_uploads(n_files=8, sentences_per_file=60000, workers=(1, 4)):
+    """
+    Measure wall time and peak memory for a few large uploads.
+    
+    "split" covers upload handling, parsing and splitting only (where the
+    upload bytes are copied, spilled and re-read); "full" is the whole
+    create_vector_store() with hash embeddings. Each run uses a fresh
+    process with INGEST_WORKERS set as listed; peak growth is measured
+    after the uploads are already in memory.
+    """
+    total_mb = sum(f.size for f in synthetic_corpus(n_files, sentences_per_file)) / 2**20
+    print(f"\n📥 Ingesting {n_files} uploads ({total_mb:.0f} MB in total)\n")
+    print(f"{'stage':>6} {'workers':>8} {'chunks':>8} {'sec':>7} {'peak +MB':>9}")
+    
+    for stage in ("split", "full"):
+        for n_workers in workers:
+            output = subprocess.run(
+                [sys.executable, __file__, "_ingest-uploads-worker", str(n_files),
+                 str(sentences_per_file), stage],
+                capture_output=True, text=True, check=True,
+                env={**os.environ, "INGEST_WORKERS": str(n_workers)}
+            ).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            print(
+                f"{stage:>6} {n_workers:>8} {result['chunks']:>8} "
+                f"{result['seconds']:>7.2f} {result['peak_growth_mb']:>9.1f}"
+            )
+
+
+def clustered_vectors(n, dim=768, n_clusters=200, seed=0):
+    """Generate normalized vectors around random centers, like real embeddings."""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((n_clusters, dim)).astype(np.float32)
+    labels = rng.integers(0, n_clusters, n)
+    vectors = centers[labels] + 0.6 * rng.standard_normal((n, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def benchmark_index_recall(n=20000, n_queries=500, k=4):
+    """
+    Report recall@k and per-query latency of each index type against the
+    exact flat index, sweeping the query-time parameters.
+    """
+    import faiss
+    from faiss_index import build_index, set_search_params
+    
+    print(f"\n🎯 Recall@{k} vs latency ({n} vectors, {n_queries} queries)\n")
+    
+    vectors = clustered_vectors(n)
+    queries = clustered_vectors(n_queries, seed=1)
+    
+    def run(index):
+        start = time.perf_counter()
+        _, ids = index.search(queries, k)
+        return ids, (time.perf_counter() - start) * 1000 / n_queries
+    
+    flat, _ = build_index(vectors, "flat")
+    flat.add(vectors)
+    truth, flat_ms = run(flat)
+    
+    def recall(ids):
+        hits = sum(len(set(row) & set(true_row)) for row, true_row in zip(ids, truth))
+        return hits / truth.size
+    
+    print(f"{'index':<10} {'setting':<14} {'recall':>7} {'ms/query':>9} {'MB':>8}")
+    print(f"{'flat':<10} {'-':<14} {1.0:>7.3f} {flat_ms:>9.3f} {vectors.nbytes / 2**20:>8.1f}")
+    
+    sweeps = {
+        "ivf_flat": ("nprobe", [1, 4, 16, 64]),
+        "ivf_pq": ("nprobe", [1, 4, 16, 64]),
+        "hnsw": ("efSearch", [16, 64, 256]),
+    }
+    for index_type, (param, values) in sweeps.items():
+        start = time.perf_counter()
+        index, _ = build_index(vectors, index_type)
+        index.add(vectors)
+        build_seconds = time.perf_counter() - start
+        size_mb = faiss.serialize_index(index).nbytes / 2**20
+        
+        for value in values:
+            if param == "nprobe":
+                set_search_params(index, nprobe=value)
+            else:
+                set_search_params(index, ef_search=value)
+            ids, ms = run(index)
+            setting = f"{param}={value}"
+            print(f"{index_type:<10} {setting:<14} {recall(ids):>7.3f} {ms:>9.3f} {size_mb:>8.1f}")
+        print(f"{'':<10} (build {build_seconds:.1f}s)")
+
+
+def benchmark_db_load(n=100000, dim=768):
+    """
+    Compare load time of the pickle-based faiss_db format, its memory-mapped
+    SQLite mode and the columnar format, with the time of the first dense
+    query and of the first hybrid (BM25 + dense) query after loading.
+    """
+    from langchain.vectorstores import FAISS
+    from keyword_index import KeywordIndex
+    import vector_store
+    
+    print(f"\n⏱️ Database load time ({n} chunks, {dim} dims)\n")
+    
+    vector_store.get_embeddings = lambda: HashEmbeddings(dim)
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((n, dim)).astype(np.float32)
+    texts = [f"{SAMPLE_SENTENCES[i % len(SAMPLE_SENTENCES)]} #{i}" for i in range(n)]
+    metadatas = [{"source": f"doc_{i // 500:05d}.txt", "file_hash": "0" * 64} for i in range(n)]
+    vectorstore = FAISS.from_embeddings(
+        zip(texts, vectors), HashEmbeddings(dim), metadatas=metadatas
+    )
+    vectorstore.keyword_index = KeywordIndex.from_vectorstore(vectorstore)
+    query = HashEmbeddings(dim).embed_query("退貨政策")
+    
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        faiss_path = os.path.join(tmp_dir, "faiss_db")
+        columnar_path = os.path.join(tmp_dir, "columnar_db")
+        vector_store.save_vectorstore(vectorstore, faiss_path, db_format="faiss")
+        vector_store.save_vectorstore(vectorstore, columnar_path, db_format="columnar")
+        del vectorstore
+        
+        def load_pickle(path):
+            # What FAISS.load_local does: read the index and unpickle the docstore
+            import pickle
+            import faiss
+            index = faiss.read_index(os.path.join(path, "index.faiss"))
+            with open(os.path.join(path, "index.pkl"), "rb") as f:
+                docstore, index_to_docstore_id = pickle.load(f)
+            return FAISS(HashEmbeddings(dim), index, docstore, index_to_docstore_id)
+        
+        print(f"{'format':<18} {'load ms':>9} {'first query ms':>15} {'first hybrid ms':>16}")
+        for name, load in [
+            ("faiss (pickle)", lambda: load_pickle(faiss_path)),
+            ("faiss + sqlite", lambda: vector_store.load_vectorstore(faiss_path, mmap=True)),
+            ("columnar", lambda: vector_store.load_vectorstore(columnar_path)),
+        ]:
+            start = time.perf_counter()
+            loaded = load()
+            load_ms = (time.perf_counter() - start) * 1000
+            
+            start = time.perf_counter()
+            loaded.similarity_search_by_vector(query, k=4)
+            query_ms = (time.perf_counter() - start) * 1000
+            
+            # The pickle loader has no keyword index, like FAISS.load_local
+            hybrid = "-"
+            if getattr(loaded, "keyword_index", None) is not None:
+                start = time.perf_counter()
+                vector_store.hybrid_search_batch_by_vector(loaded, ["退貨政策"], [query], k=4)
+                hybrid = f"{(time.perf_counter() - start) * 1000:.1f}"
+            print(f"{name:<18} {load_ms:>9.1f} {query_ms:>15.1f} {hybrid:>16}")
+
+
+def benchmark_llm_overhead(n=200):
+    """
+    Measure per-question overhead of building a new Gemini client and chain
+    on every call versus the pooled chain, against a local fake endpoint.
+    """
+    from langchain_core.documents import Document
+    from langchain_google_genai import ChatGoogleGenerativeAI
+    import rag_chain
+    
+    endpoint, connections = start_fake_gemini_server()
+    rag_chain.LLM_TRANSPORT = "rest"
+    rag_chain.LLM_API_ENDPOINT = endpoint
+    
+    inputs = {
+        "context": [Document(page_content=sentence) for sentence in SAMPLE_SENTENCES[:4]],
+        "question": "退貨政策是什麼？",
+    }
+    
+    def fresh_call():
+        llm = ChatGoogleGenerativeAI(
+            model=rag_chain.LLM_MODEL_NAME,
+            temperature=rag_chain.LLM_TEMPERATURE,
+            google_api_key="fake-key",
+            transport="rest",
+            client_options={"api_endpoint": endpoint}
+        )
+        return rag_chain.build_answer_chain(llm).invoke(inputs)
+    
+    def pooled_call():
+        return rag_chain.get_answer_chain("fake-key").invoke(inputs)
+    
+    print(f"\n🔌 LLM call overhead against a local fake endpoint ({n} calls)\n")
+    print(f"{'mode':<8} {'ms/call':>8} {'connections':>12}")
+    
+    for name, call in [("fresh", fresh_call), ("pooled", pooled_call)]:
+        call()  # warm up imports and the pool
+        connections.clear()
+        start = time.perf_counter()
+        for _ in range(n):
+            call()
+        ms = (time.perf_counter() - start) * 1000 / n
+        print(f"{name:<8} {ms:>8.2f} {len(connections):>12}")
+
+
+def benchmark_hybrid_latency(n=20000, n_queries=200, dim=768, k=4):
+    """
+    Measure the per-query overhead of hybrid BM25 + dense retrieval over
+    dense-only retrieval (query embedding excluded), plus the keyword
+    index build time and size on disk.
+    """
+    from langchain.vectorstores import FAISS
+    from keyword_index import KeywordIndex
+    import vector_store
+    
+    print(f"\n🔎 Hybrid retrieval overhead ({n} chunks, {n_queries} queries)\n")
+    
+    rng = np.random.default_rng(0)
+    texts = []
+    for i in range(n):
+        picks = rng.integers(0, len(SAMPLE_SENTENCES), 8)
+        texts.append(" ".join(SAMPLE_SENTENCES[p] for p in picks) + f" 編號 KB-{i:06d}")
+    vectors = rng.standard_normal((n, dim)).astype(np.float32)
+    vectorstore = FAISS.from_embeddings(zip(texts, vectors), HashEmbeddings(dim))
+    
+    start = time.perf_counter()
+    vectorstore.keyword_index = KeywordIndex.from_vectorstore(vectorstore)
+    build_seconds = time.perf_counter() - start
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "keyword_index.npz")
+        vectorstore.keyword_index.save(path)
+        size_mb = os.path.getsize(path) / 1e6
+        start = time.perf_counter()
+        KeywordIndex.load(path)
+        load_seconds = time.perf_counter() - start
+    print(f"keyword index: build {build_seconds:.1f}s, load {load_seconds:.2f}s, {size_mb:.1f} MB")
+    
+    queries = [
+        f"{SAMPLE_SENTENCES[i % len(SAMPLE_SENTENCES)][:12]} KB-{int(rng.integers(n)):06d}"
+        for i in range(n_queries)
+    ]
+    query_embeddings = rng.standard_normal((n_queries, dim)).astype(np.float32)
+    
+    print(f"\n{'mode':<8} {'ms/query':>9}")
+    for name, search in [
+        ("dense", lambda q, e: vector_store.similarity_search_batch_by_vector(vectorstore, [e], k)),
+        ("hybrid", lambda q, e: vector_store.hybrid_search_batch_by_vector(vectorstore, [q], [e], k)),
+    ]:
+        start = time.perf_counter()
+        for query, embedding in zip(queries, query_embeddings):
+            search(query, embedding)
+        ms = (time.perf_counter() - start) * 1000 / n_queries
+        print(f"{name:<8} {ms:>9.2f}")
+
+
+def benchmark_quantization(n=50000, n_queries=500, k=10, vectors_path=None):
+    """
+    Compare float32, float16 and int8 vector storage: memory and on-disk
+    footprint, and recall@k against exact float32 search on held-out
+    queries. With vectors_path, real embeddings (an (n, d) .npy array) are
+    used and the last n_queries rows are held out as queries.
+    """
+    from langchain.vectorstores import FAISS
+    from langchain_community.docstore.in_memory import InMemoryDocstore
+    from faiss_index import build_index, index_footprint
+    import vector_store
+    
+    if vectors_path:
+        data = np.load(vectors_path).astype(np.float32)
+        vectors, queries = data[:-n_queries], data[-n_queries:]
+    else:
+        vectors = clustered_vectors(n)
+        queries = clustered_vectors(n_queries, seed=1)
+    n, dim = vectors.shape
+    
+    print(f"\n🗜️ Vector quantization ({n} vectors, {dim} dims, {n_queries} held-out queries)\n")
+    
+    flat, _ = build_index(vectors, "flat")
+    flat.add(vectors)
+    _, truth = flat.search(queries, k)
+    
+    def recall(index):
+        start = time.perf_counter()
+        _, ids = index.search(queries, k)
+        ms = (time.perf_counter() - start) * 1000 / n_queries
+        hits = sum(len(set(row) & set(true_row)) for row, true_row in zip(ids, truth))
+        return hits / truth.size, ms
+    
+    def disk_mb(path):
+        return sum(
+            os.path.getsize(os.path.join(path, name)) for name in os.listdir(path)
+            if name in ("index.faiss", "vectors.bin")
+        ) / 2**20
+    
+    vector_store.get_embeddings = lambda: HashEmbeddings(dim)
+    texts = [str(i) for i in range(n)]
+    
+    print(f"{'storage':<18} {'B/vector':>9} {'memory MB':>10} {'disk MB':>8} "
+          f"{'recall@' + str(k):>10} {'ms/query':>9}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for name, index_type, db_format, dtype in [
+            ("float32 flat", "flat", "faiss", "float32"),
+            ("float16 sq_fp16", "sq_fp16", "faiss", "float32"),
+            ("int8 sq8", "sq8", "faiss", "float32"),
+            ("float16 columnar", "flat", "columnar", "float16"),
+        ]:
+            index, _ = build_index(vectors, index_type)
+            vectorstore = FAISS(HashEmbeddings(dim), index, InMemoryDocstore(), {})
+            vectorstore.add_embeddings(zip(texts, vectors))
+            
+            path = os.path.join(tmp_dir, name.replace(" ", "_"))
+            vector_store.DB_VECTOR_DTYPE = dtype
+            vector_store.save_vectorstore(vectorstore, path, db_format=db_format)
+            if db_format == "columnar":
+                index = vector_store.load_vectorstore(path).index
+            
+            footprint = index_footprint(index)
+            value, ms = recall(index)
+            print(f"{name:<18} {footprint['bytes_per_vector']:>9.0f} "
+                  f"{footprint['bytes'] / 2**20:>10.1f} {disk_mb(path):>8.1f} "
+                  f"{value:>10.3f} {ms:>9.2f}")
+
+
+def benchmark_matryoshka(n=100000, n_queries=200, k=10, vectors_path=None):
+    """
+    Report flat-search latency, index size and recall@k against the full
+    768 dims for each Matryoshka output dimension. Recall is only
+    meaningful with real EmbeddingGemma vectors (vectors_path); the last
+    n_queries rows are held out as queries.
+    """
+    from embeddings import SUPPORTED_DIMENSIONS, truncate_embeddings
+    from faiss_index import build_index
+    
+    if vectors_path:
+        data = np.load(vectors_path).astype(np.float32)
+        vectors, queries = data[:-n_queries], data[-n_queries:]
+    else:
+        vectors = clustered_vectors(n)
+        queries = clustered_vectors(n_queries, seed=1)
+    
+    print(f"\n📐 Matryoshka dimensions ({len(vectors)} vectors, {n_queries} queries)\n")
+    print(f"{'dim':>5} {'MB':>8} {'ms/query':>9} {'recall@' + str(k):>10}")
+    
+    truth = None
+    for dim in SUPPORTED_DIMENSIONS:
+        index_vectors = truncate_embeddings(vectors, dim)
+        index, _ = build_index(index_vectors, "flat")
+        index.add(index_vectors)
+        start = time.perf_counter()
+        _, ids = index.search(truncate_embeddings(queries, dim), k)
+        ms = (time.perf_counter() - start) * 1000 / n_queries
+        if truth is None:
+            truth = ids
+        recall = sum(len(set(a) & set(b)) for a, b in zip(ids, truth)) / truth.size
+        print(f"{dim:>5} {index_vectors.nbytes / 2**20:>8.1f} {ms:>9.3f} {recall:>10.3f}")
+
+
+def benchmark_embed_throughput(n=512, threads=None, batch_size=32):
+    """
+    Measure document embedding throughput (chunks/sec) of the PyTorch
+    backend and the fp32 / int8 ONNX Runtime backends on ~500-character
+    chunks.
+    """
+    from config import EMBEDDING_ONNX_PATH, EMBEDDING_ONNX_THREADS
+    from embeddings import EmbeddingGemmaEmbeddings
+    from onnx_embeddings import OnnxSentenceEncoder
+    
+    threads = threads or EMBEDDING_ONNX_THREADS
+    rng = np.random.default_rng(0)
+    chunks = [
+        "".join(SAMPLE_SENTENCES[p] for p in rng.integers(0, len(SAMPLE_SENTENCES), 16))[:500]
+        for _ in range(n)
+    ]
+    encode_kwargs = {"normalize_embeddings": True, "batch_size": batch_size}
+    
+    def load_torch():
+        import torch
+        torch.set_num_threads(threads)
+        return EmbeddingGemmaEmbeddings(
+            model_kwargs={"device": "cpu"}, encode_kwargs=encode_kwargs, show_progress=False
+        )
+    
+    def load_onnx(quantized):
+        return EmbeddingGemmaEmbeddings.construct(
+            client=OnnxSentenceEncoder.from_pretrained(
+                EMBEDDING_ONNX_PATH, quantized=quantized, intra_op_threads=threads
+            ),
+            encode_kwargs=encode_kwargs,
+            show_progress=False
+        )
+    
+    print(f"\n🚀 Embedding throughput ({n} chunks, {threads} threads, batch {batch_size})\n")
+    print(f"{'backend':<10} {'chunks/sec':>11}")
+    for name, load in [
+        ("torch", load_torch),
+        ("onnx", lambda: load_onnx(False)),
+        ("onnx-int8", lambda: load_onnx(True)),
+    ]:
+        try:
+            embeddings = load()
+        except (ImportError, FileNotFoundError) as e:
+            print(f"{name:<10} {'skipped':>11}  ({e})")
+            continue
+        embeddings.embed_documents(chunks[:batch_size])  # warm up
+        start = time.perf_counter()
+        embeddings.embed_documents(chunks)
+        print(f"{name:<10} {n / (time.perf_counter() - start):>11.1f}")
+
+
+def benchmark_splitter(mb=5, chunk_size=500, chunk_overlap=100, repeat=3):
+    """
+    Compare the CJK splitter with RecursiveCharacterTextSplitter.
+    
+    Three layouts of the same mostly-Chinese text are split: paragraphs
+    separated by blank lines, PDF-style hard-wrapped lines, and one block
+    without any whitespace (where the recursive splitter falls through to
+    per-character splitting). Reports throughput (best of repeat runs),
+    the chunk size distribution in characters and estimated tokens, and
+    the share of chunks that end at a sentence boundary.
+    """
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+    
+    from cjk_splitter import CJKTextSplitter
+    from context_builder import estimate_tokens
+    
+    rng = np.random.default_rng(0)
+    chinese = [sentence.replace(" ", "") for sentence in SAMPLE_SENTENCES if not sentence.isascii()]
+    paragraphs = []
+    size = 0
+    while size < mb * 2**20:
+        picks = rng.integers(0, len(chinese), 20)
+        paragraph = "".join(chinese[p] for p in picks)
+        paragraphs.append(paragraph)
+        size += len(paragraph.encode("utf-8")) + 2
+    block = "".join(paragraphs)
+    layouts = {
+        "paragraphs": "\n\n".join(paragraphs),
+        "pdf lines": "\n".join(block[i:i + 38] for i in range(0, len(block), 38)),
+        "no breaks": block,
+    }
+    
+    splitters = {
+        "recursive": RecursiveCharacterTextSplitter(
+            chunk_size=chunk_size, chunk_overlap=chunk_overlap,
+            separators=["\n\n", "\n", " ", ""]
+        ),
+        "cjk": CJKTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap),
+    }
+    
+    print(f"\n✂️  Splitting {len(block.encode('utf-8')) / 2**20:.1f} MB of Chinese text "
+          f"(chunk_size={chunk_size}, chunk_overlap={chunk_overlap})\n")
+    print(f"{'layout':>10} {'splitter':>10} {'MB/s':>7} {'chunks':>7} {'chars p5/p50/p95':>18} "
+          f"{'tokens p5/p50/p95':>18} {'sentence end':>13}")
+    for layout, text in layouts.items():
+        size_mb = len(text.encode("utf-8")) / 2**20
+        for name, splitter in splitters.items():
+            elapsed = float("inf")
+            for _ in range(repeat):
+                start = time.perf_counter()
+                chunks = splitter.split_text(text)
+                elapsed = min(elapsed, time.perf_counter() - start)
+            
+            chars = np.percentile([len(chunk) for chunk in chunks], [5, 50, 95])
+            tokens = np.percentile([estimate_tokens(chunk) for chunk in chunks], [5, 50, 95])
+            sentence_ends = np.mean([chunk.endswith(("。", "！", "？", "；")) for chunk in chunks])
+            print(
+                f"{layout:>10} {name:>10} {size_mb / elapsed:>7.1f} {len(chunks):>7} "
+                f"{'/'.join(f'{value:.0f}' for value in chars):>18} "
+                f"{'/'.join(f'{value:.0f}' for value in tokens):>18} "
+                f"{sentence_ends:>12.0%}"
+            )
+
+
+def benchmark_dedup(n_versions=5, sentences_per_file=4000, edit_rate=0.01):
+    """
+    Measure chunk deduplication on several versions of the same documents.
+    
+    Each version changes edit_rate of the sentences of the first one, like
+    yearly revisions of a policy PDF. Reports the chunks split, embedded
+    and removed, the time spent deduplicating and the end-to-end ingest
+    time with hash embeddings, with deduplication off and on.
+    """
+    import chunk_dedup
+    import vector_store
+    
+    vector_store.get_embeddings = lambda: HashEmbeddings()
+    base = synthetic_corpus(4, sentences_per_file)
+    rng = np.random.default_rng(1)
+    files = []
+    for version in range(n_versions):
+        for uploaded_file in base:
+            lines = uploaded_file.getvalue().decode("utf-8").split("\n")
+            if version:
+                for j in rng.choice(len(lines), int(len(lines) * edit_rate), replace=False):
+                    lines[j] = f"第 {version} 版修訂：{lines[j]}"
+            files.append(InMemoryUploadedFile(
+                f"v{version}_{uploaded_file.name}", "\n".join(lines).encode("utf-8")
+            ))
+    
+    filter_seconds = []
+    original_filter = chunk_dedup.ChunkDeduplicator.filter
+    
+    def timed_filter(self, documents):
+        start = time.perf_counter()
+        kept = original_filter(self, documents)
+        filter_seconds.append(time.perf_counter() - start)
+        return kept
+    
+    chunk_dedup.ChunkDeduplicator.filter = timed_filter
+    print(f"\n🧹 Ingesting {len(base)} documents x {n_versions} versions\n")
+    print(f"{'dedup':>6} {'split':>7} {'embedded':>9} {'removed':>8} {'dedup sec':>10} {'ingest sec':>11}")
+    for enabled in (False, True):
+        vector_store.CHUNK_DEDUP_ENABLED = enabled
+        filter_seconds.clear()
+        counts = {}
+        
+        def progress(stage, count):
+            counts[stage] = counts.get(stage, 0) + count
+        
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            start = time.perf_counter()
+            vectorstore = vector_store.create_vector_store(
+                files, "", temp_dir=os.path.join(tmp_dir, "uploads"), progress=progress
+            )
+            elapsed = time.perf_counter() - start
+        print(
+            f"{'on' if enabled else 'off':>6} {counts['split']:>7} {vectorstore.index.ntotal:>9} "
+            f"{counts.get('deduplicated', 0):>8} {sum(filter_seconds):>10.2f} {elapsed:>11.2f}"
+        )
+    chunk_dedup.ChunkDeduplicator.filter = original_filter
+
+
+def main():
+    """Run the selected benchmark."""
+    parser = argparse.ArgumentParser(description="RAG performance benchmarks")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+    
+    subparsers.add_parser("ingest-memory", help="peak RSS vs corpus size")
+    uploads_parser = subparsers.add_parser("ingest-uploads", help="wall time and peak RSS for large uploads")
+    uploads_parser.add_argument("--files", type=int, default=8)
+    uploads_parser.add_argument("--sentences", type=int, default=60000)
+    recall_parser = subparsers.add_parser("index-recall", help="index recall vs latency")
+    recall_parser.add_argument("--n", type=int, default=20000)
+    load_parser = subparsers.add_parser("db-load", help="database load time by format")
+    load_parser.add_argument("--n", type=int, default=100000)
+    llm_parser = subparsers.add_parser("llm-overhead", help="per-call LLM client overhead")
+    llm_parser.add_argument("--n", type=int, default=200)
+    hybrid_parser = subparsers.add_parser("hybrid-latency", help="hybrid vs dense retrieval latency")
+    hybrid_parser.add_argument("--n", type=int, default=20000)
+    quant_parser = subparsers.add_parser("quantization", help="float16/int8 footprint and recall")
+    quant_parser.add_argument("--n", type=int, default=50000)
+    quant_parser.add_argument("--vectors", help="(n, d) .npy array of real embeddings")
+    dims_parser = subparsers.add_parser("matryoshka", help="search cost per embedding dimension")
+    dims_parser.add_argument("--n", type=int, default=100000)
+    dims_parser.add_argument("--vectors", help="(n, d) .npy array of real embeddings")
+    embed_parser = subparsers.add_parser("embed-throughput", help="chunks/sec per embedding backend")
+    embed_parser.add_argument("--n", type=int, default=512)
+    embed_parser.add_argument("--threads", type=int)
+    splitter_parser = subparsers.add_parser("splitter", help="CJK vs recursive text splitter")
+    splitter_parser.add_argument("--mb", type=float, default=5)
+    dedup_parser = subparsers.add_parser("dedup", help="chunk deduplication on versioned documents")
+    dedup_parser.add_argument("--versions", type=int, default=5)
+    worker = subparsers.add_parser("_ingest-memory-worker")
+    worker.add_argument("n_files", type=int)
+    uploads_worker = subparsers.add_parser("_ingest-uploads-worker")
+    uploads_worker.add_argument("n_files", type=int)
+    uploads_worker.add_argument("sentences", type=int)
+    uploads_worker.add_argument("stage", choices=["split", "full"])
+    
+    args = parser.parse_args()
+    
+    if args.benchmark == "ingest-memory":
+        benchmark_ingest_memory()
+    elif args.benchmark == "ingest-uploads":
+        benchmark_ingest_uploads(n_files=args.files, sentences_per_file=args.sentences)
+    elif args.benchmark == "index-recall":
+        benchmark_index_recall(n=args.n)
+    elif args.benchmark == "db-load":
+        benchmark_db_load(n=args.n)
+    elif args.benchmark == "llm-overhead":
+        benchmark_llm_overhead(n=args.n)
+    elif args.benchmark == "hybrid-latency":
+        benchmark_hybrid_latency(n=args.n)
+    elif args.benchmark == "quantization":
+        benchmark_quantization(n=args.n, vectors_path=args.vectors)
+    elif args.benchmark == "matryoshka":
+        benchmark_matryoshka(n=args.n, vectors_path=args.vectors)
+    elif args.benchmark == "embed-throughput":
+        benchmark_embed_throughput(n=args.n, threads=args.threads)
+    elif args.benchmark == "splitter":
+        benchmark_splitter(mb=args.mb)
+    elif args.benchmark == "dedup":
+        benchmark_dedup(n_versions=args.versions)
+    elif args.benchmark == "_ingest-memory-worker":
+        _ingest_memory_worker(args.n_files)
+    elif args.benchmark == "_ingest-uploads-worker":
+        _ingest_uploads_worker(args.n_files, args.sentences, args.stage)
+
+
+if __name__ == "__main__":
+    main()
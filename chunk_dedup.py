@@ -0,0 +1,217 @@
+"""
+Chunk Dedup Module
+Drops duplicate chunks between splitting and embedding. Identical chunks
+(after whitespace normalization) are caught by a content hash, and near
+duplicates, such as the same paragraph in two versions of a policy PDF,
+by MinHash signatures with locality-sensitive hashing (LSH).
+
+A surviving chunk records every source it was seen in, so retrieval can
+still cite all the files it came from. Chunks are only compared with the
+last CHUNK_DEDUP_WINDOW kept chunks, so the filter's memory stays bounded
+however large the ingest is.
+"""
+
+import hashlib
+
+import numpy as np
+
+from config import CHUNK_DEDUP_THRESHOLD, CHUNK_DEDUP_WINDOW
+
+# Characters per shingle for the MinHash signatures
+SHINGLE_SIZE = 5
+
+# Multiplier of the polynomial shingle hash
+_SHINGLE_BASE = np.uint64(1000003)
+
+
+def _shingle_hashes(text: str):
+    """64-bit hashes of the distinct character shingles of a text, vectorized."""
+    codes = np.frombuffer("".join(text.split()).encode("utf-32-le"), dtype=np.uint32)
+    codes = codes.astype(np.uint64)
+    count = max(len(codes) - SHINGLE_SIZE + 1, 1)
+    hashes = np.zeros(count, dtype=np.uint64)
+    # Integer array arithmetic wraps around modulo 2**64 silently
+    for offset in range(min(SHINGLE_SIZE, len(codes))):
+        hashes *= _SHINGLE_BASE
+        hashes += codes[offset:offset + count]
+    return np.unique(hashes)
+
+
+def add_source(metadata: dict, source: str, file_hash: str):
+    """Record a source file in a chunk's "sources" metadata."""
+    sources = metadata.setdefault(
+        "sources", {metadata.get("source"): metadata.get("file_hash")}
+    )
+    sources.setdefault(source, file_hash)
+
+
+class ChunkDeduplicator:
+    """
+    Streaming exact and near-duplicate filter for document chunks.
+    
+    Every kept chunk gets a "sources" metadata dict mapping each source
+    file it appears in to that file's hash. When a later chunk duplicates
+    it, the later chunk's source is added to that dict. LangChain keeps
+    the metadata dict object when a chunk is indexed, so sources found
+    after a chunk was embedded still reach the stored document.
+    
+    Near duplicates are found with num_perm MinHash values split into
+    bands: chunks that agree on all values of any band are candidates,
+    and a candidate is a duplicate when the share of equal MinHash values
+    (an estimate of the shingle Jaccard similarity) is at least threshold.
+    
+    Kept chunks occupy the slots of a ring of window entries; when the
+    ring is full, the oldest kept chunk is forgotten to make room, so
+    memory is bounded by window (about 2 KB per slot) rather than by the
+    number of chunks filtered.
+    """
+
+    def __init__(self, threshold: float = CHUNK_DEDUP_THRESHOLD,
+                 num_perm: int = 128, bands: int = 16, seed: int = 1,
+                 window: int = CHUNK_DEDUP_WINDOW):
+        """
+        Args:
+            threshold (float): Estimated Jaccard similarity at which chunks
+                count as near duplicates (>= 1 disables near-duplicate checks)
+            num_perm (int): MinHash values per signature
+            bands (int): LSH bands (num_perm must be divisible by bands)
+            seed (int): Seed of the MinHash permutations
+            window (int): Number of most recently kept chunks that new
+                chunks are compared with
+        """
+        if num_perm % bands:
+            raise ValueError("num_perm must be divisible by bands")
+        # Multiply-add-shift hash functions, one per MinHash value
+        rng = np.random.default_rng(seed)
+        self._a = (rng.integers(0, 1 << 63, num_perm, dtype=np.uint64) * 2 + 1)[:, None]
+        self._b = rng.integers(0, 1 << 63, num_perm, dtype=np.uint64)[:, None]
+        self.threshold = threshold
+        self.bands = bands
+        self.window = window
+        self._rows = num_perm // bands
+        
+        # Ring of kept chunks; the arrays grow by doubling up to window rows
+        self._count = 0                                     # chunks ever kept
+        self._kept = []                                     # slot -> metadata dict
+        self._hashes = np.zeros(0, dtype=np.uint64)         # slot -> content hash
+        self._signatures = np.zeros((0, num_perm), dtype=np.uint32)  # slot -> MinHash
+        self._exact = {}                                    # content hash -> slot
+        self._buckets = [{} for _ in range(bands)]          # band -> {key: slot or slots}
+        self.exact_removed = 0
+        self.near_removed = 0
+
+    @property
+    def removed(self):
+        """Number of chunks dropped so far."""
+        return self.exact_removed + self.near_removed
+
+    def _signature(self, text: str):
+        values = self._a * _shingle_hashes(text)  # (num_perm, shingles)
+        values += self._b
+        values >>= np.uint64(32)
+        return values.min(axis=1).astype(np.uint32)
+
+    def _band_keys(self, signature):
+        # Hash collisions only add candidates, which are verified below
+        return [hash(band.tobytes()) for band in signature.reshape(self.bands, self._rows)]
+
+    def _find_near_duplicate(self, signature, band_keys):
+        candidates = set()
+        for band, key in enumerate(band_keys):
+            slots = self._buckets[band].get(key, ())
+            if isinstance(slots, int):
+                candidates.add(slots)
+            else:
+                candidates.update(slots)
+        if not candidates:
+            return None
+        # Verify every candidate at once and keep the most similar one
+        candidates = np.fromiter(candidates, dtype=np.int64, count=len(candidates))
+        similarity = (self._signatures[candidates] == signature).mean(axis=1)
+        best = int(similarity.argmax())
+        return int(candidates[best]) if similarity[best] >= self.threshold else None
+
+    def _evict(self, slot: int):
+        """Forget the kept chunk in a slot before the slot is reused."""
+        content_hash = int(self._hashes[slot])
+        if self._exact.get(content_hash) == slot:
+            del self._exact[content_hash]
+        if self.threshold < 1:
+            for band, key in enumerate(self._band_keys(self._signatures[slot])):
+                bucket = self._buckets[band]
+                slots = bucket[key]
+                if isinstance(slots, int):
+                    del bucket[key]
+                else:
+                    slots.remove(slot)
+                    if len(slots) == 1:
+                        bucket[key] = slots[0]
+
+    def _keep(self, metadata: dict, content_hash: int, signature, band_keys):
+        """Store a kept chunk in the next slot of the ring."""
+        slot = self._count % self.window
+        self._count += 1
+        if slot < len(self._kept):
+            self._evict(slot)
+            self._kept[slot] = metadata
+        else:
+            self._kept.append(metadata)
+            if slot >= len(self._hashes):
+                capacity = min(max(2 * len(self._hashes), 64), self.window)
+                self._hashes = np.resize(self._hashes, capacity)
+                if signature is not None:
+                    self._signatures = np.resize(
+                        self._signatures, (capacity, self._signatures.shape[1])
+                    )
+        
+        self._hashes[slot] = content_hash
+        self._exact[content_hash] = slot
+        if signature is not None:
+            self._signatures[slot] = signature
+            for band, key in enumerate(band_keys):
+                bucket = self._buckets[band]
+                slots = bucket.get(key)
+                if slots is None:
+                    bucket[key] = slot
+                elif isinstance(slots, int):
+                    bucket[key] = [slots, slot]
+                else:
+                    slots.append(slot)
+
+    def filter(self, documents):
+        """
+        Drop the chunks that duplicate a chunk seen before.
+        
+        Args:
+            documents (list): Split documents with "source" and "file_hash"
+                metadata
+        
+        Returns:
+            list: The documents to embed, in input order
+        """
+        kept = []
+        for document in documents:
+            metadata = document.metadata
+            content_hash = int.from_bytes(hashlib.blake2b(
+                " ".join(document.page_content.split()).encode("utf-8"), digest_size=8
+            ).digest(), "little")
+            slot = self._exact.get(content_hash)
+            if slot is not None:
+                add_source(self._kept[slot], metadata["source"], metadata.get("file_hash"))
+                self.exact_removed += 1
+                continue
+            
+            signature = band_keys = None
+            if self.threshold < 1:
+                signature = self._signature(document.page_content)
+                band_keys = self._band_keys(signature)
+                slot = self._find_near_duplicate(signature, band_keys)
+                if slot is not None:
+                    add_source(self._kept[slot], metadata["source"], metadata.get("file_hash"))
+                    self.near_removed += 1
+                    continue
+            
+            add_source(metadata, metadata["source"], metadata.get("file_hash"))
+            self._keep(metadata, content_hash, signature, band_keys)
+            kept.append(document)
+        return kept
@@ -0,0 +1,196 @@
+"""
+CJK Splitter Module
+Text splitter for mostly Traditional Chinese documents. Text is cut at
+sentence punctuation (。！？；), Latin sentence ends and line breaks, and
+sentences are packed into chunks measured in estimated LLM tokens, all in
+a single linear pass over the text.
+
+RecursiveCharacterTextSplitter only knows whitespace separators, so on
+Chinese text without spaces it falls through to per-character splitting,
+which is slow and cuts chunks mid-sentence.
+"""
+
+import re
+from bisect import bisect_left, bisect_right
+from itertools import accumulate
+
+import numpy as np
+from langchain.text_splitter import TextSplitter
+
+from context_builder import estimate_tokens
+
+# Sentence ends (with any closing quotes or brackets and trailing spaces)
+# and line breaks; a "." only ends a sentence when followed by whitespace,
+# so numbers such as "3.5" and codes such as "v1.2" are not cut. The
+# leading lookahead lets the regex engine skip ordinary characters fast.
+_BOUNDARY = re.compile(
+    r"(?=[。！？；!?\n.])(?:(?:[。！？；!?]+|\.(?=\s))[」』”’\"')）\]]*[ \t]*|\n+)"
+)
+
+# Code point ranges counted as one token each by estimate_tokens()
+_CJK_RANGES = (
+    (0x3040, 0x30FF),  # Hiragana, Katakana
+    (0x3400, 0x4DBF),  # CJK Extension A
+    (0x4E00, 0x9FFF),  # CJK Unified Ideographs
+    (0xAC00, 0xD7AF),  # Hangul syllables
+    (0xF900, 0xFAFF),  # CJK Compatibility Ideographs
+)
+
+
+def _cjk_prefix_counts(text: str):
+    """Number of CJK characters in text[:i] for every i, in one vectorized pass."""
+    codes = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32)
+    is_cjk = np.zeros(len(codes), dtype=bool)
+    for low, high in _CJK_RANGES:
+        is_cjk |= (codes >= low) & (codes <= high)
+    counts = np.zeros(len(codes) + 1, dtype=np.int64)
+    np.cumsum(is_cjk, out=counts[1:])
+    return counts
+
+
+def _hard_split(text: str, max_tokens: int, length_function=estimate_tokens):
+    """Cut a sentence longer than max_tokens into pieces that fit."""
+    if length_function is not estimate_tokens:
+        return _hard_split_by(text, max_tokens, length_function)
+    pieces = []
+    start = 0
+    tokens = 0.0
+    for position, char in enumerate(text):
+        cost = 1.0 if any(low <= ord(char) <= high for low, high in _CJK_RANGES) else 0.25
+        if tokens + cost > max_tokens and position > start:
+            pieces.append(text[start:position])
+            start = position
+            tokens = 0.0
+        tokens += cost
+    pieces.append(text[start:])
+    return pieces
+
+
+def _hard_split_by(text: str, max_tokens: int, length_function):
+    """
+    Cut text into the longest pieces that length_function keeps within
+    max_tokens, finding each piece end by binary search (a piece has at
+    least one character).
+    """
+    pieces = []
+    start = 0
+    while start < len(text):
+        low, high = start + 1, len(text)
+        while low < high:
+            middle = (low + high + 1) // 2
+            if length_function(text[start:middle]) <= max_tokens:
+                low = middle
+            else:
+                high = middle - 1
+        pieces.append(text[start:low])
+        start = low
+    return pieces
+
+
+class CJKTextSplitter(TextSplitter):
+    """
+    Sentence-aware splitter that measures chunk size in tokens.
+    
+    Chunks are built greedily from whole sentences; consecutive chunks
+    share up to chunk_overlap tokens of trailing sentences. A sentence
+    longer than chunk_size on its own is cut into fitting pieces. Every
+    sentence is measured once and enters and leaves the sliding window
+    once, so splitting is linear in the length of the text. With the
+    default token estimate, all sentences are measured at once from a
+    prefix count of CJK characters instead of one call per sentence.
+    """
+
+    def __init__(self, chunk_size: int = 500, chunk_overlap: int = 100,
+                 length_function=estimate_tokens, **kwargs):
+        """
+        Args:
+            chunk_size (int): Maximum tokens per chunk
+            chunk_overlap (int): Maximum tokens shared by consecutive chunks
+            length_function (callable): Token counter for a piece of text;
+                defaults to context_builder.estimate_tokens, but any
+                tokenizer's len(encode(text)) can be passed
+        """
+        super().__init__(
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap,
+            length_function=length_function,
+            **kwargs
+        )
+
+    def _sentences(self, text: str):
+        """
+        Cut text into sentences and measure them.
+        
+        Returns:
+            tuple: (start offsets, end offsets, token counts), with
+                sentences longer than chunk_size already cut into pieces
+        """
+        ends = [match.end() for match in _BOUNDARY.finditer(text)]
+        if not ends or ends[-1] < len(text):
+            ends.append(len(text))
+        starts = [0] + ends[:-1]
+        
+        if self._length_function is estimate_tokens:
+            cjk = _cjk_prefix_counts(text)
+            start_array = np.asarray(starts)
+            end_array = np.asarray(ends)
+            cjk_chars = cjk[end_array] - cjk[start_array]
+            other_chars = end_array - start_array - cjk_chars
+            counts = (cjk_chars + (other_chars + 3) // 4).tolist()
+        else:
+            counts = [self._length_function(text[start:end]) for start, end in zip(starts, ends)]
+        
+        if max(counts, default=0) <= self._chunk_size:
+            return starts, ends, counts
+        
+        spans = ([], [], [])
+        for start, end, tokens in zip(starts, ends, counts):
+            if tokens <= self._chunk_size:
+                pieces = [(start, end, tokens)]
+            else:
+                pieces = []
+                for piece in _hard_split(
+                    text[start:end], self._chunk_size, self._length_function
+                ):
+                    pieces.append((start, start + len(piece), self._length_function(piece)))
+                    start += len(piece)
+            for span, value in zip(spans, zip(*pieces)):
+                span.extend(value)
+        return spans
+
+    def split_text(self, text: str):
+        """
+        Split text into chunks of at most chunk_size tokens.
+        
+        Chunk ends and overlap starts are found by binary search over the
+        running token total of the sentences, and each chunk is a single
+        slice of the text, so the cost is one scan of the text plus
+        O(log n) per chunk.
+        
+        Args:
+            text (str): Text to split
+        
+        Returns:
+            list: Chunk strings (whitespace-stripped, empty chunks dropped)
+        """
+        starts, ends, counts = self._sentences(text)
+        totals = [0, *accumulate(counts)]  # totals[i] = tokens in sentences[:i]
+        
+        chunks = []
+        first = 0
+        while first < len(counts):
+            # Most sentences from first on that fit (at least one)
+            last = max(bisect_right(totals, totals[first] + self._chunk_size) - 1, first + 1)
+            chunk = text[starts[first]:ends[last - 1]].strip()
+            if chunk:
+                chunks.append(chunk)
+            if last == len(counts):
+                break
+            # Trailing sentences kept as overlap: at most chunk_overlap tokens,
+            # leaving room for the next sentence
+            first = max(
+                bisect_left(totals, totals[last] - self._chunk_overlap),
+                bisect_left(totals, totals[last + 1] - self._chunk_size),
+                first + 1
+            )
+        return chunks
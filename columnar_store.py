@@ -0,0 +1,474 @@
+"""
+Columnar Store Module
+Pickle-free, versioned on-disk format for vector databases.
+
+Layout of a columnar database directory:
+- format.json: format name, version, chunk count, dimension, vector dtype
+- vectors.bin: 32-byte header followed by raw float32/float16 vectors
+  (exact "flat" databases only; approximate indexes keep index.faiss)
+- texts.offsets / texts.blob: chunk texts as uint64 offsets into UTF-8 bytes
+- ids.offsets / ids.blob: docstore IDs in the same layout
+- metadata.codes / metadata.json: per-chunk uint32 code into the list of
+  distinct metadata dicts
+
+Every column is memory-mapped on load, so opening a database only reads the
+small JSON files; chunks are decoded on demand. Because loaded stores map
+these files, a database is never rewritten in place: it is written to a
+sibling staging directory that then replaces the old one (see
+staged_directory()).
+
+Convert an existing faiss_db directory:
+    python columnar_store.py faiss_db [target_dir] [--dtype float16]
+"""
+
+import json
+import os
+import pickle
+import shutil
+import struct
+import threading
+import uuid
+from contextlib import contextmanager
+
+import faiss
+import numpy as np
+from langchain.vectorstores import FAISS
+from langchain_community.docstore.base import Docstore
+from langchain_core.documents import Document
+
+from faiss_index import describe_index, read_index_mmap
+from sqlite_docstore import DOCSTORE_FILE_NAME
+
+
+FORMAT_NAME = "rag-columnar"
+FORMAT_VERSION = 1
+FORMAT_FILE_NAME = "format.json"
+
+VECTOR_FILE_NAME = "vectors.bin"
+VECTOR_MAGIC = b"RAGVEC\0\0"
+# magic, version, dtype code, count, dimension, reserved
+_VECTOR_HEADER = struct.Struct("<8sIIQII")
+_DTYPE_CODES = {"float32": 1, "float16": 2}
+
+# Rows converted to float32 at a time when searching float16 vectors
+_SEARCH_BLOCK_ROWS = 65536
+
+
+# ============================================================================
+# Column Writers and Readers
+# ============================================================================
+
+def _write_strings(path_prefix: str, values):
+    """Write strings as uint64 offsets plus a UTF-8 blob."""
+    offsets = [0]
+    with open(f"{path_prefix}.blob", "wb") as blob:
+        for value in values:
+            data = value.encode("utf-8")
+            blob.write(data)
+            offsets.append(offsets[-1] + len(data))
+    np.asarray(offsets, dtype=np.uint64).tofile(f"{path_prefix}.offsets")
+
+
+def _map_array(path: str, dtype, offset: int = 0, shape=None):
+    """Memory-map a raw array file (empty files map to an empty array)."""
+    if os.path.getsize(path) <= offset:
+        return np.zeros(shape or (0,), dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=shape)
+
+
+class _StringColumn:
+    """Zero-copy view of a column written by _write_strings()."""
+    
+    def __init__(self, path_prefix: str):
+        self._offsets = _map_array(f"{path_prefix}.offsets", np.uint64)
+        self._blob = _map_array(f"{path_prefix}.blob", np.uint8)
+
+    def __len__(self):
+        return max(len(self._offsets) - 1, 0)
+
+    def __getitem__(self, position):
+        start, end = int(self._offsets[position]), int(self._offsets[position + 1])
+        return self._blob[start:end].tobytes().decode("utf-8")
+
+
+def write_vectors(path: str, vectors, dtype: str = "float32"):
+    """
+    Write vectors to a raw vector file with a header.
+    
+    Args:
+        path (str): Target file
+        vectors: Array of shape (n, d)
+        dtype (str): "float32" or "float16"
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.dtype(dtype))
+    count, dim = vectors.shape
+    with open(path, "wb") as f:
+        f.write(_VECTOR_HEADER.pack(
+            VECTOR_MAGIC, FORMAT_VERSION, _DTYPE_CODES[dtype], count, dim, 0
+        ))
+        vectors.tofile(f)
+
+
+def read_vectors(path: str):
+    """
+    Memory-map a vector file written by write_vectors().
+    
+    Returns:
+        np.ndarray: Read-only (n, d) view of the vectors
+        
+    Raises:
+        ValueError: If the file is not a supported vector file
+    """
+    with open(path, "rb") as f:
+        header = f.read(_VECTOR_HEADER.size)
+    magic, version, dtype_code, count, dim, _ = _VECTOR_HEADER.unpack(header)
+    if magic != VECTOR_MAGIC or version > FORMAT_VERSION:
+        raise ValueError(f"不支援的向量檔案格式：{path}")
+    
+    dtype = {code: name for name, code in _DTYPE_CODES.items()}[dtype_code]
+    return _map_array(path, dtype, offset=_VECTOR_HEADER.size, shape=(count, dim))
+
+
+# ============================================================================
+# Index and Docstore Backed by Mapped Columns
+# ============================================================================
+
+class MappedFlatIndex:
+    """
+    Read-only exact L2 index that searches a memory-mapped vector column
+    in place, so loading it costs no copy of the vectors.
+    """
+    
+    metric_type = faiss.METRIC_L2
+    is_trained = True
+    
+    def __init__(self, vectors):
+        self.vectors = vectors
+        self.ntotal, self.d = vectors.shape
+
+    def search(self, queries, k):
+        """Return (distances, positions) like faiss.Index.search."""
+        queries = np.ascontiguousarray(queries, dtype=np.float32)
+        if self.vectors.dtype == np.float32:
+            return faiss.knn(queries, self.vectors, k)
+        
+        # Convert float16 vectors block by block and merge the partial top-k
+        all_distances, all_positions = [], []
+        for start in range(0, self.ntotal, _SEARCH_BLOCK_ROWS):
+            block = np.asarray(self.vectors[start:start + _SEARCH_BLOCK_ROWS], dtype=np.float32)
+            distances, positions = faiss.knn(queries, block, min(k, len(block)))
+            all_distances.append(distances)
+            all_positions.append(positions + start)
+        
+        distances = np.concatenate(all_distances, axis=1)
+        positions = np.concatenate(all_positions, axis=1)
+        order = np.argsort(distances, axis=1, kind="stable")[:, :k]
+        distances = np.take_along_axis(distances, order, axis=1)
+        positions = np.take_along_axis(positions, order, axis=1)
+        
+        if positions.shape[1] < k:
+            missing = k - positions.shape[1]
+            distances = np.pad(distances, ((0, 0), (0, missing)), constant_values=np.inf)
+            positions = np.pad(positions, ((0, 0), (0, missing)), constant_values=-1)
+        return distances, positions
+
+    def reconstruct(self, position):
+        """Return the stored vector at a position as float32."""
+        return np.asarray(self.vectors[position], dtype=np.float32)
+
+
+class ColumnarDocstore(Docstore):
+    """Read-only docstore that decodes chunks from mapped columns."""
+    
+    def __init__(self, path: str):
+        """
+        Open the text, ID and metadata columns of a columnar database.
+        
+        Args:
+            path (str): Columnar database directory
+        """
+        self._texts = _StringColumn(os.path.join(path, "texts"))
+        self._ids = _StringColumn(os.path.join(path, "ids"))
+        self._metadata_codes = _map_array(os.path.join(path, "metadata.codes"), np.uint32)
+        with open(os.path.join(path, "metadata.json"), encoding="utf-8") as f:
+            self._metadata_values = json.load(f)
+        
+        self._lock = threading.Lock()
+        self._positions = None
+        # Positions of IDs just handed out by the index mapping, so the
+        # lookup that usually follows a search does not need the full map
+        self._recent_positions = {}
+
+    def __len__(self):
+        return len(self._ids)
+
+    def document(self, position):
+        """Decode the chunk stored at a position."""
+        metadata = self._metadata_values[int(self._metadata_codes[position])]
+        return Document(page_content=self._texts[position], metadata=dict(metadata))
+
+    def doc_id(self, position):
+        """Get the docstore ID stored at a position."""
+        doc_id = self._ids[position]
+        if len(self._recent_positions) > 1024:
+            self._recent_positions.clear()
+        self._recent_positions[doc_id] = position
+        return doc_id
+
+    def iter_chunks(self):
+        """
+        Decode every chunk in FAISS position order.
+        
+        Yields:
+            tuple: (position, docstore ID, Document)
+        """
+        for position in range(len(self._ids)):
+            yield position, self._ids[position], self.document(position)
+
+    def search(self, search: str):
+        """
+        Look up a chunk by docstore ID.
+        
+        Args:
+            search (str): Docstore ID
+            
+        Returns:
+            Document if found, else error message
+        """
+        position = self._recent_positions.get(search)
+        if position is None:
+            with self._lock:
+                if self._positions is None:
+                    self._positions = {
+                        self._ids[i]: i for i in range(len(self._ids))
+                    }
+            position = self._positions.get(search)
+        if position is None:
+            return f"ID {search} not found."
+        return self.document(position)
+
+
+class ColumnarIndexMapping:
+    """Read-only FAISS position to docstore ID mapping over the ID column."""
+    
+    def __init__(self, docstore: ColumnarDocstore):
+        self._docstore = docstore
+
+    def __getitem__(self, position):
+        if not 0 <= position < len(self._docstore):
+            raise KeyError(position)
+        return self._docstore.doc_id(int(position))
+
+    def __len__(self):
+        return len(self._docstore)
+
+    def __iter__(self):
+        return iter(range(len(self._docstore)))
+
+    def items(self):
+        return ((i, self[i]) for i in range(len(self._docstore)))
+
+    def values(self):
+        return (self[i] for i in range(len(self._docstore)))
+
+    def get(self, position, default=None):
+        try:
+            return self[position]
+        except KeyError:
+            return default
+
+
+# ============================================================================
+# Save, Load and Convert
+# ============================================================================
+
+def is_columnar(path: str):
+    """Check whether a directory holds a columnar database."""
+    return os.path.exists(os.path.join(path, FORMAT_FILE_NAME))
+
+
+def replace_directory(staging_path: str, path: str):
+    """
+    Move a completely written directory to path, replacing any old copy.
+    
+    The old directory is renamed aside and then deleted, never truncated,
+    so stores that still memory-map its files keep reading the old data
+    (the files stay alive until they are unmapped).
+    
+    Args:
+        staging_path (str): Finished directory on the same file system
+        path (str): Target directory
+    """
+    old_path = None
+    if os.path.exists(path):
+        old_path = f"{os.path.normpath(path)}.old-{uuid.uuid4().hex[:8]}"
+        os.rename(path, old_path)
+    os.rename(staging_path, path)
+    if old_path is not None:
+        shutil.rmtree(old_path, ignore_errors=True)
+
+
+@contextmanager
+def staged_directory(path: str):
+    """
+    Write a database directory next to path and swap it in when done.
+    
+    Yields an empty sibling directory to write into. When the block
+    finishes it replaces path (see replace_directory()); when the block
+    raises it is deleted and path is left untouched.
+    
+    Args:
+        path (str): Target directory
+    """
+    staging_path = f"{os.path.normpath(path)}.tmp-{uuid.uuid4().hex[:8]}"
+    os.makedirs(staging_path)
+    try:
+        yield staging_path
+    except BaseException:
+        shutil.rmtree(staging_path, ignore_errors=True)
+        raise
+    replace_directory(staging_path, path)
+
+
+def _write_columns(path: str, index, docstore, index_to_docstore_id, dtype: str):
+    """Write the index and chunks of a vector store as columns into a new directory."""
+    positions = sorted(index_to_docstore_id)
+    doc_ids = [index_to_docstore_id[position] for position in positions]
+    documents = [docstore.search(doc_id) for doc_id in doc_ids]
+    
+    if isinstance(index, faiss.IndexFlat):
+        vectors = index.reconstruct_n(0, index.ntotal)
+        write_vectors(os.path.join(path, VECTOR_FILE_NAME), vectors, dtype)
+        index_file = None
+    else:
+        # Approximate indexes cannot be searched from raw vectors; keep them
+        # in FAISS's own (pickle-free) format
+        index_file = "index.faiss"
+        faiss.write_index(index, os.path.join(path, index_file))
+    
+    _write_strings(os.path.join(path, "texts"), (doc.page_content for doc in documents))
+    _write_strings(os.path.join(path, "ids"), doc_ids)
+    
+    codes = {}
+    metadata_codes = np.empty(len(documents), dtype=np.uint32)
+    for i, document in enumerate(documents):
+        key = json.dumps(document.metadata, ensure_ascii=False, sort_keys=True)
+        metadata_codes[i] = codes.setdefault(key, len(codes))
+    metadata_codes.tofile(os.path.join(path, "metadata.codes"))
+    with open(os.path.join(path, "metadata.json"), "w", encoding="utf-8") as f:
+        json.dump([json.loads(key) for key in codes], f, ensure_ascii=False)
+    
+    with open(os.path.join(path, FORMAT_FILE_NAME), "w", encoding="utf-8") as f:
+        json.dump({
+            "format": FORMAT_NAME,
+            "version": FORMAT_VERSION,
+            "count": len(doc_ids),
+            "dim": index.d,
+            "dtype": dtype if index_file is None else None,
+            "index_file": index_file,
+            "index_type": describe_index(index)["index_type"],
+        }, f, indent=2)
+
+
+def write_columnar(vectorstore, path: str, dtype: str = "float32"):
+    """
+    Write a FAISS vector store in the columnar format into an existing,
+    empty directory, such as one yielded by staged_directory().
+    
+    Args:
+        vectorstore (FAISS): Vector store to write
+        path (str): Empty target directory
+        dtype (str): Storage type of the vectors, "float32" or "float16"
+    """
+    _write_columns(
+        path,
+        vectorstore.index,
+        vectorstore.docstore,
+        vectorstore.index_to_docstore_id,
+        dtype
+    )
+
+
+def save_columnar(vectorstore, path: str, dtype: str = "float32"):
+    """
+    Save a FAISS vector store in the columnar format.
+    
+    The database is written to a staging directory that replaces path once
+    complete, so stores loaded from path are never mapped over.
+    
+    Args:
+        vectorstore (FAISS): Vector store to save
+        path (str): Target directory
+        dtype (str): Storage type of the vectors, "float32" or "float16"
+    """
+    with staged_directory(path) as staging_path:
+        write_columnar(vectorstore, staging_path, dtype)
+
+
+def load_columnar(path: str, embeddings):
+    """
+    Open a columnar database as a read-only FAISS vector store.
+    
+    Args:
+        path (str): Columnar database directory
+        embeddings: Embeddings used to embed queries
+        
+    Returns:
+        FAISS: Vector store backed by memory-mapped columns
+        
+    Raises:
+        ValueError: If the directory uses an unsupported format version
+    """
+    with open(os.path.join(path, FORMAT_FILE_NAME), encoding="utf-8") as f:
+        info = json.load(f)
+    if info.get("format") != FORMAT_NAME or info.get("version", 0) > FORMAT_VERSION:
+        raise ValueError(f"不支援的資料庫格式：{info.get('format')} v{info.get('version')}")
+    
+    if info.get("index_file"):
+        index = read_index_mmap(
+            os.path.join(path, info["index_file"]),
+            info["index_type"]
+        )
+    else:
+        index = MappedFlatIndex(read_vectors(os.path.join(path, VECTOR_FILE_NAME)))
+    
+    docstore = ColumnarDocstore(path)
+    return FAISS(embeddings, index, docstore, ColumnarIndexMapping(docstore))
+
+
+def convert_faiss_db(source_path: str, target_path: str = None, dtype: str = "float32"):
+    """
+    Convert a directory saved with FAISS.save_local to the columnar format.
+    
+    This is the only place that still unpickles index.pkl; only convert
+    databases you created yourself. The other files of the database
+    (manifest, index metadata, keyword index) are copied along, and
+    converting in place swaps the whole directory like save_columnar().
+    
+    Args:
+        source_path (str): Existing faiss_db directory
+        target_path (str): Target directory (defaults to source_path)
+        dtype (str): Storage type of the vectors, "float32" or "float16"
+    """
+    target_path = target_path or source_path
+    index = faiss.read_index(os.path.join(source_path, "index.faiss"))
+    with open(os.path.join(source_path, "index.pkl"), "rb") as f:
+        docstore, index_to_docstore_id = pickle.load(f)
+    with staged_directory(target_path) as staging_path:
+        for entry in os.scandir(source_path):
+            if entry.is_file() and entry.name not in ("index.faiss", "index.pkl", DOCSTORE_FILE_NAME):
+                shutil.copy2(entry.path, staging_path)
+        _write_columns(staging_path, index, docstore, index_to_docstore_id, dtype)
+    print(f"已轉換 {index.ntotal} 個片段: {source_path} → {target_path}")
+
+
+if __name__ == "__main__":
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="Convert a faiss_db directory to the columnar format")
+    parser.add_argument("source")
+    parser.add_argument("target", nargs="?")
+    parser.add_argument("--dtype", choices=list(_DTYPE_CODES), default="float32")
+    args = parser.parse_args()
+    
+    convert_faiss_db(args.source, args.target, args.dtype)
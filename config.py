@@ -26,22 +26,126 @@ GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY", "")
 EMBEDDING_MODEL_NAME = "google/embeddinggemma-300m"
 EMBEDDING_DEVICE = os.getenv("EMBEDDING_DEVICE", "cpu")
 EMBEDDING_NORMALIZE = True
+# Output dimension: 768, or 512/256/128 for Matryoshka truncation (smaller
+# index, faster search). Databases must be rebuilt after changing it.
+EMBEDDING_DIMENSION = int(os.getenv("EMBEDDING_DIMENSION", "768"))
+# Inference backend: "torch" (sentence-transformers) or "onnx" (ONNX Runtime;
+# prepare the model with `python onnx_embeddings.py export [--quantize]`)
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch")
+EMBEDDING_ONNX_PATH = os.getenv("EMBEDDING_ONNX_PATH", "embeddinggemma_onnx")
+EMBEDDING_ONNX_QUANTIZED = os.getenv("EMBEDDING_ONNX_QUANTIZED", "false").lower() == "true"
+EMBEDDING_ONNX_THREADS = int(os.getenv("EMBEDDING_ONNX_THREADS", str(os.cpu_count() or 1)))
+# Load the embedding model when the app starts instead of on first use
+EMBEDDING_WARMUP = os.getenv("EMBEDDING_WARMUP", "false").lower() == "true"
+
+# Persistent embedding cache (skips re-embedding unchanged chunks). Kept in
+# the per-user cache directory (%LOCALAPPDATA% on Windows, else
+# $XDG_CACHE_HOME or ~/.cache), not in whatever directory the app, the batch
+# CLI or the tests happen to run from
+_USER_CACHE_DIR = os.path.join(
+    (os.getenv("LOCALAPPDATA") if os.name == "nt" else os.getenv("XDG_CACHE_HOME"))
+    or os.path.join(os.path.expanduser("~"), ".cache"),
+    "rag_qa"
+)
+EMBEDDING_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE_ENABLED", "true").lower() == "true"
+EMBEDDING_CACHE_PATH = os.path.expanduser(os.getenv(
+    "EMBEDDING_CACHE_PATH", os.path.join(_USER_CACHE_DIR, "embedding_cache.sqlite3")
+))
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "200000"))
 
 # Gemini Configuration
 LLM_MODEL_NAME = "gemini-2.5-flash"
 LLM_TEMPERATURE = float(os.getenv("LLM_TEMPERATURE", "0.0"))
+# Gemini client transport ("grpc" or "rest") and endpoint override, e.g. a
+# local fake server for latency measurements
+LLM_TRANSPORT = os.getenv("LLM_TRANSPORT") or None
+LLM_API_ENDPOINT = os.getenv("LLM_API_ENDPOINT") or None
+# Number of pooled Gemini clients/chains kept per process
+LLM_POOL_SIZE = int(os.getenv("LLM_POOL_SIZE", "32"))
+# Batch question answering: concurrent Gemini calls and rate-limit retries
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "8"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "5"))
+
+# Answer cache in front of the LLM: exact match on the normalized query.
+# Setting ANSWER_CACHE_SIMILARITY (cosine, e.g. 0.95) also serves answers of
+# similar past questions; off by default, since similar wording can ask for
+# different things (e.g. 退貨 vs 換貨)
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "true").lower() == "true"
+ANSWER_CACHE_SIMILARITY = (
+    float(os.getenv("ANSWER_CACHE_SIMILARITY")) if os.getenv("ANSWER_CACHE_SIMILARITY") else None
+)
+ANSWER_CACHE_TTL_SECONDS = float(os.getenv("ANSWER_CACHE_TTL_SECONDS", "3600"))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "1000"))
+
+# Optional cross-encoder reranking: over-fetch RERANK_FETCH_K candidates and
+# send only the RERANK_TOP_K best-scoring ones to the LLM
+RERANK_ENABLED = os.getenv("RERANK_ENABLED", "false").lower() == "true"
+RERANK_MODEL_NAME = os.getenv("RERANK_MODEL_NAME", "BAAI/bge-reranker-base")
+RERANK_FETCH_K = int(os.getenv("RERANK_FETCH_K", "20"))
+RERANK_TOP_K = int(os.getenv("RERANK_TOP_K", "3"))
+RERANK_CACHE_MAX_ENTRIES = int(os.getenv("RERANK_CACHE_MAX_ENTRIES", "10000"))
 
 
 # ============================================================================
 # Text Processing Configuration
 # ============================================================================
 
-# Text Splitter
+# Text Splitter: "recursive" (RecursiveCharacterTextSplitter, sizes in
+# characters) or "cjk" (sentence-aware, sizes in estimated tokens; see
+# cjk_splitter.py). CHUNK_SIZE and CHUNK_OVERLAP keep their values when
+# switching, so review them: "cjk" chunks hold more text per unit
+TEXT_SPLITTER = os.getenv("TEXT_SPLITTER", "recursive")
 CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", "500"))
 CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "100"))
 
+# Drop exact and near-duplicate chunks before embedding (see chunk_dedup.py);
+# the threshold is the estimated Jaccard similarity of character shingles
+CHUNK_DEDUP_ENABLED = os.getenv("CHUNK_DEDUP_ENABLED", "true").lower() == "true"
+CHUNK_DEDUP_THRESHOLD = float(os.getenv("CHUNK_DEDUP_THRESHOLD", "0.9"))
+# Most recently kept chunks that new chunks are compared with (bounds memory)
+CHUNK_DEDUP_WINDOW = int(os.getenv("CHUNK_DEDUP_WINDOW", "20000"))
+
+# Worker processes used to load and split uploaded files in parallel
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+# Chunks embedded and added to the index per batch (bounds peak memory)
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "64"))
+
+# Background ingestion jobs run at a time (see ingest_jobs.py) and finished
+# jobs kept in the job table
+INGEST_JOB_WORKERS = int(os.getenv("INGEST_JOB_WORKERS", "1"))
+INGEST_JOB_HISTORY = int(os.getenv("INGEST_JOB_HISTORY", "20"))
+
+# FAISS index type: "flat" (exact), "sq_fp16" / "sq8" (exact search over
+# float16 / int8 scalar-quantized vectors), "ivf_flat", "ivf_pq" or "hnsw".
+# HNSW indexes do not support removing documents.
+FAISS_INDEX_TYPE = os.getenv("FAISS_INDEX_TYPE", "flat")
+FAISS_TRAIN_SIZE = int(os.getenv("FAISS_TRAIN_SIZE", "50000"))  # IVF training sample
+FAISS_NLIST = int(os.getenv("FAISS_NLIST", "1024"))
+FAISS_PQ_M = int(os.getenv("FAISS_PQ_M", "64"))
+FAISS_HNSW_M = int(os.getenv("FAISS_HNSW_M", "32"))
+# Query-time search parameters
+FAISS_NPROBE = int(os.getenv("FAISS_NPROBE", "16"))
+FAISS_EF_SEARCH = int(os.getenv("FAISS_EF_SEARCH", "64"))
+# On-disk format written by save_vectorstore: "faiss" (index.faiss + pickle)
+# or "columnar" (pickle-free, memory-mapped columns; see columnar_store.py)
+DB_FORMAT = os.getenv("DB_FORMAT", "faiss")
+# Storage type of vectors in the columnar format: "float32" or "float16"
+DB_VECTOR_DTYPE = os.getenv("DB_VECTOR_DTYPE", "float32")
+# Memory-map saved databases on load (read-only, shared between processes)
+FAISS_LOAD_MMAP = os.getenv("FAISS_LOAD_MMAP", "false").lower() == "true"
+
 # Retriever
 RETRIEVER_K = int(os.getenv("RETRIEVER_K", "4"))
+# Hybrid retrieval: fuse BM25 keyword and FAISS rankings (reciprocal rank
+# fusion) over the top HYBRID_FETCH_K candidates of each
+HYBRID_SEARCH_ENABLED = os.getenv("HYBRID_SEARCH_ENABLED", "true").lower() == "true"
+HYBRID_FETCH_K = int(os.getenv("HYBRID_FETCH_K", "20"))
+RRF_K = int(os.getenv("RRF_K", "60"))
+# Context sent to Gemini: overlapping chunks are stitched together,
+# near-duplicates dropped, and passages added up to the token budget
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "2000"))  # 0 = unlimited
+CONTEXT_DEDUP_THRESHOLD = float(os.getenv("CONTEXT_DEDUP_THRESHOLD", "0.9"))
 
 
 # ============================================================================
@@ -162,10 +266,20 @@ def get_config_summary():
     """
     return {
         "embedding_model": EMBEDDING_MODEL_NAME,
+        "embedding_dimension": EMBEDDING_DIMENSION,
+        "embedding_backend": EMBEDDING_BACKEND,
         "llm_model": LLM_MODEL_NAME,
+        "text_splitter": TEXT_SPLITTER,
         "chunk_size": CHUNK_SIZE,
         "chunk_overlap": CHUNK_OVERLAP,
+        "chunk_dedup": CHUNK_DEDUP_ENABLED,
+        "ingest_workers": INGEST_WORKERS,
+        "embed_batch_size": EMBED_BATCH_SIZE,
         "retriever_k": RETRIEVER_K,
+        "hybrid_search": HYBRID_SEARCH_ENABLED,
+        "rerank": RERANK_ENABLED,
+        "context_token_budget": CONTEXT_TOKEN_BUDGET,
+        "faiss_index_type": FAISS_INDEX_TYPE,
         "supported_formats": SUPPORTED_FILE_TYPES,
         "max_file_size_mb": MAX_FILE_SIZE_MB,
         "database_path": FAISS_DB_PATH,
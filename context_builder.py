@@ -0,0 +1,149 @@
+"""
+Context Builder Module
+Assembles the LLM context from retrieved chunks under a token budget:
+overlapping chunks of the same source are stitched back together,
+near-duplicate passages are dropped, and passages are added in relevance
+order until the budget is used up.
+"""
+
+import math
+import re
+
+CONTEXT_SEPARATOR = "\n\n---\n\n"
+
+# Shortest shared text that counts as chunk overlap when stitching chunks
+MIN_OVERLAP_CHARS = 10
+
+_CJK_CHAR = re.compile(r"[぀-ヿ㐀-䶿一-鿿가-힯豈-﫿]")
+
+
+def estimate_tokens(text: str):
+    """
+    Estimate the number of LLM tokens in a text without a tokenizer.
+    
+    CJK characters are counted as one token each and all other text as
+    one token per four characters, which is close to Gemini's tokenizer
+    for mixed Traditional Chinese / English documents.
+    
+    Args:
+        text (str): Text to measure
+    
+    Returns:
+        int: Estimated token count
+    """
+    cjk_chars = len(_CJK_CHAR.findall(text))
+    return cjk_chars + math.ceil((len(text) - cjk_chars) / 4)
+
+
+def _overlap(left: str, right: str):
+    """Length of the longest suffix of left that is a prefix of right."""
+    if len(left) < MIN_OVERLAP_CHARS or len(right) < MIN_OVERLAP_CHARS:
+        return 0
+    probe = right[:MIN_OVERLAP_CHARS]
+    start = left.find(probe, max(0, len(left) - len(right)))
+    while start != -1:
+        if right.startswith(left[start:]):
+            return len(left) - start
+        start = left.find(probe, start + 1)
+    return 0
+
+
+def _stitch(left: str, right: str):
+    """Join two chunks if one continues the other; return None otherwise."""
+    if right in left:
+        return left
+    if left in right:
+        return right
+    overlap = _overlap(left, right)
+    if overlap:
+        return left + right[overlap:]
+    overlap = _overlap(right, left)
+    if overlap:
+        return right + left[overlap:]
+    return None
+
+
+def _shingles(text: str, size: int = 3):
+    text = "".join(text.split())
+    return {text[i:i + size] for i in range(max(len(text) - size + 1, 1))}
+
+
+def _similarity(a, b):
+    return len(a & b) / len(a | b) if a and b else 0.0
+
+
+def build_context(docs, token_budget: int = 0, dedup_threshold: float = 0.9):
+    """
+    Build the LLM context from retrieved documents.
+    
+    Chunks are kept in relevance order. A chunk that overlaps or continues
+    an earlier passage of the same source and page is stitched into it;
+    a passage whose character-trigram Jaccard similarity with an earlier
+    one is at least dedup_threshold is dropped; remaining passages are
+    added while they fit in token_budget (the first one is truncated if it
+    alone exceeds the budget).
+    
+    Args:
+        docs (list): Retrieved documents, most relevant first
+        token_budget (int): Maximum estimated context tokens (0 = no limit)
+        dedup_threshold (float): Similarity at which passages count as duplicates
+    
+    Returns:
+        tuple: (context string, stats dict with "input_tokens",
+            "context_tokens", "saved_tokens", "chunks", "passages",
+            "merged", "duplicates" and "dropped")
+    """
+    passages = []  # [source key, text]
+    merged = 0
+    for doc in docs:
+        key = (doc.metadata.get("source"), doc.metadata.get("page"))
+        text = doc.page_content.strip()
+        for passage in passages:
+            if passage[0] != key:
+                continue
+            stitched = _stitch(passage[1], text)
+            if stitched is not None:
+                passage[1] = stitched
+                merged += 1
+                break
+        else:
+            passages.append([key, text])
+    
+    unique = []
+    duplicates = 0
+    for _, text in passages:
+        shingles = _shingles(text)
+        if any(_similarity(shingles, other) >= dedup_threshold for _, other in unique):
+            duplicates += 1
+            continue
+        unique.append((text, shingles))
+    
+    selected = []
+    used_tokens = 0
+    separator_tokens = estimate_tokens(CONTEXT_SEPARATOR)
+    for text, _ in unique:
+        tokens = estimate_tokens(text) + (separator_tokens if selected else 0)
+        if token_budget and used_tokens + tokens > token_budget:
+            if not selected:
+                # Keep at least the most relevant passage, cut to the budget
+                text = text[:max(1, len(text) * token_budget // tokens)]
+                selected.append(text)
+                used_tokens = estimate_tokens(text)
+            continue
+        selected.append(text)
+        used_tokens += tokens
+    
+    context = CONTEXT_SEPARATOR.join(selected)
+    input_tokens = estimate_tokens(CONTEXT_SEPARATOR.join(doc.page_content for doc in docs))
+    context_tokens = estimate_tokens(context)
+    stats = {
+        "input_tokens": input_tokens,
+        "context_tokens": context_tokens,
+        "saved_tokens": input_tokens - context_tokens,
+        "chunks": len(docs),
+        "passages": len(selected),
+        "merged": merged,
+        "duplicates": duplicates,
+        "dropped": len(unique) - len(selected),
+    }
+    return context, stats
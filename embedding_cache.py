@@ -0,0 +1,173 @@
+"""
+Embedding Cache Module
+Persistent, content-addressed cache of document embeddings backed by SQLite,
+so unchanged chunks are not re-embedded when a corpus is rebuilt.
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+
+class EmbeddingCache:
+    """
+    On-disk embedding cache with size-bounded LRU eviction.
+    
+    Entries are keyed by a SHA-256 hash of the model namespace and the exact
+    (prefixed) text that was embedded, and stored as float32 blobs. Hit and
+    miss counters are kept for the lifetime of the instance.
+    """
+    
+    def __init__(self, path: str, max_entries: int = 200000):
+        """
+        Open (or create) an embedding cache.
+        
+        Args:
+            path (str): Path to the SQLite database file
+            max_entries (int): Maximum number of cached vectors before the
+                least recently used ones are evicted
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " key TEXT PRIMARY KEY,"
+            " vector BLOB NOT NULL,"
+            " last_access REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_last_access"
+            " ON embeddings (last_access)"
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(namespace: str, text: str) -> str:
+        """
+        Build the content-addressed key for a text.
+        
+        Args:
+            namespace (str): Model identifier (name and output settings)
+            text (str): Exact text passed to the model, including prefixes
+            
+        Returns:
+            str: Hex digest identifying the embedding
+        """
+        digest = hashlib.sha256()
+        digest.update(namespace.encode("utf-8"))
+        digest.update(b"\0")
+        digest.update(text.encode("utf-8"))
+        return digest.hexdigest()
+
+    def get_many(self, keys):
+        """
+        Look up several embeddings at once.
+        
+        Args:
+            keys (list): Cache keys from make_key()
+            
+        Returns:
+            dict: Mapping of key to embedding (list of floats) for every hit
+        """
+        found = {}
+        unique_keys = list(dict.fromkeys(keys))
+        
+        with self._lock:
+            # Stay well below SQLite's bound-parameter limit
+            for start in range(0, len(unique_keys), 500):
+                batch = unique_keys[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})",
+                    batch
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32).tolist()
+            
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_access = ? WHERE key = ?",
+                    [(now, key) for key in found]
+                )
+                self._conn.commit()
+            
+            self.hits += sum(1 for key in keys if key in found)
+            self.misses += sum(1 for key in keys if key not in found)
+        
+        return found
+
+    def put_many(self, items):
+        """
+        Store several embeddings and evict the least recently used entries
+        if the cache grows beyond max_entries.
+        
+        Args:
+            items (dict): Mapping of key to embedding vector
+        """
+        if not items:
+            return
+        
+        now = time.time()
+        rows = [
+            (key, np.asarray(vector, dtype=np.float32).tobytes(), now)
+            for key, vector in items.items()
+        ]
+        
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, last_access)"
+                " VALUES (?, ?, ?)",
+                rows
+            )
+            (count,) = self._conn.execute(
+                "SELECT COUNT(*) FROM embeddings"
+            ).fetchone()
+            if count > self.max_entries:
+                self._conn.execute(
+                    "DELETE FROM embeddings WHERE key IN ("
+                    " SELECT key FROM embeddings ORDER BY last_access LIMIT ?)",
+                    (count - self.max_entries,)
+                )
+            self._conn.commit()
+
+    def __len__(self):
+        with self._lock:
+            (count,) = self._conn.execute(
+                "SELECT COUNT(*) FROM embeddings"
+            ).fetchone()
+        return count
+
+    def stats(self):
+        """
+        Get cache statistics.
+        
+        Returns:
+            dict: Hits, misses, hit rate and number of stored entries
+        """
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": len(self),
+            "max_entries": self.max_entries,
+        }
+
+    def close(self):
+        """Close the underlying database connection."""
+        with self._lock:
+            self._conn.close()
@@ -4,8 +4,51 @@ Implements custom embeddings using Google's EmbeddingGemma-300m model
 with proper prefix formatting for documents and queries.
 """
 
+import threading
+from typing import Any, Optional
+
+import numpy as np
 from langchain.embeddings import HuggingFaceEmbeddings
 
+from config import (
+    EMBEDDING_BACKEND,
+    EMBEDDING_CACHE_ENABLED,
+    EMBEDDING_CACHE_MAX_ENTRIES,
+    EMBEDDING_CACHE_PATH,
+    EMBEDDING_DEVICE,
+    EMBEDDING_DIMENSION,
+    EMBEDDING_MODEL_NAME,
+    EMBEDDING_NORMALIZE,
+    EMBEDDING_ONNX_QUANTIZED,
+)
+from embedding_cache import EmbeddingCache
+
+
+# Output dimensions EmbeddingGemma is trained for (Matryoshka representation)
+SUPPORTED_DIMENSIONS = (768, 512, 256, 128)
+
+
+def truncate_embeddings(embeddings, dimension: int, normalize: bool = True):
+    """
+    Keep the first `dimension` components of Matryoshka embeddings.
+    
+    Args:
+        embeddings: Array of shape (n, full_dimension)
+        dimension (int): Output dimension
+        normalize (bool): Re-normalize the truncated vectors to unit length
+        
+    Returns:
+        np.ndarray: Array of shape (n, dimension)
+    """
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    if dimension >= embeddings.shape[1]:
+        return embeddings
+    truncated = embeddings[:, :dimension]
+    if normalize:
+        norms = np.linalg.norm(truncated, axis=1, keepdims=True)
+        truncated = truncated / np.maximum(norms, 1e-12)
+    return truncated
+
 
 class EmbeddingGemmaEmbeddings(HuggingFaceEmbeddings):
     """
@@ -16,20 +59,43 @@ class EmbeddingGemmaEmbeddings(HuggingFaceEmbeddings):
     - Queries: 'task: search result | query: ...'
     
     This ensures better semantic alignment between document and query embeddings.
+    
+    If an EmbeddingCache is attached, document embeddings are looked up in it
+    first and only the misses are sent to the model.
+    
+    With output_dim below 768 the embeddings are truncated Matryoshka-style
+    (and re-normalized when normalize_embeddings is set), which makes flat
+    search proportionally faster and the index proportionally smaller.
     """
     
+    cache: Optional[Any] = None
+    """Optional EmbeddingCache for document embeddings."""
+    output_dim: int = EMBEDDING_DIMENSION
+    """Embedding dimension: 768, 512, 256 or 128."""
+    backend: str = "torch"
+    """Inference backend of the client: "torch", "onnx" or "onnx-int8"."""
+    
     def __init__(self, **kwargs):
         """
         Initialize EmbeddingGemmaEmbeddings with the google/embeddinggemma-300m model.
         
+        Prefer get_embeddings() over constructing this class directly, so that
+        the model is loaded only once per process.
+        
         Args:
             **kwargs: Additional arguments passed to HuggingFaceEmbeddings
         """
-        super().__init__(
-            model_name="google/embeddinggemma-300m",
-            encode_kwargs={"normalize_embeddings": True},
-            **kwargs
+        kwargs.setdefault("model_name", EMBEDDING_MODEL_NAME)
+        kwargs.setdefault(
+            "encode_kwargs", {"normalize_embeddings": EMBEDDING_NORMALIZE}
         )
+        kwargs.setdefault("output_dim", EMBEDDING_DIMENSION)
+        if kwargs["output_dim"] not in SUPPORTED_DIMENSIONS:
+            raise ValueError(
+                f"不支援的嵌入維度：{kwargs['output_dim']}"
+                f"（可用：{', '.join(map(str, SUPPORTED_DIMENSIONS))}）"
+            )
+        super().__init__(**kwargs)
 
     def embed_documents(self, texts):
         """
@@ -43,7 +109,27 @@ class EmbeddingGemmaEmbeddings(HuggingFaceEmbeddings):
         """
         # Apply document prefix format as recommended by Google
         prefixed_texts = [f'title: none | text: {text}' for text in texts]
-        return super().embed_documents(prefixed_texts)
+        
+        if self.cache is None:
+            return self._encode(prefixed_texts)
+        
+        namespace = self._cache_namespace()
+        keys = [EmbeddingCache.make_key(namespace, text) for text in prefixed_texts]
+        cached = self.cache.get_many(keys)
+        
+        # Embed only the cache misses, in a single batch
+        missing = {}
+        for key, text in zip(keys, prefixed_texts):
+            if key not in cached:
+                missing.setdefault(key, text)
+        
+        if missing:
+            vectors = self._encode(list(missing.values()))
+            computed = dict(zip(missing.keys(), vectors))
+            self.cache.put_many(computed)
+            cached.update(computed)
+        
+        return [cached[key] for key in keys]
 
     def embed_query(self, text):
         """
@@ -57,4 +143,135 @@ class EmbeddingGemmaEmbeddings(HuggingFaceEmbeddings):
         """
         # Apply query prefix format as recommended by Google
         prefixed_text = f'task: search result | query: {text}'
-        return super().embed_query(prefixed_text)
+        return self._encode([prefixed_text])[0]
+
+    def embed_queries(self, texts):
+        """
+        Embed several queries in a single batched forward pass.
+        
+        Args:
+            texts (list): Query texts to embed
+            
+        Returns:
+            list: Embedding vectors, one per query
+        """
+        prefixed_texts = [f'task: search result | query: {text}' for text in texts]
+        return self._encode(prefixed_texts)
+
+    def _encode(self, texts):
+        """Run the model on already-prefixed texts."""
+        texts = [text.replace("\n", " ") for text in texts]
+        embeddings = self.client.encode(
+            texts, show_progress_bar=self.show_progress, **self.encode_kwargs
+        )
+        normalize = self.encode_kwargs.get("normalize_embeddings", False)
+        return truncate_embeddings(embeddings, self.output_dim, normalize).tolist()
+
+    def _cache_namespace(self):
+        """Identify the settings that determine the embedding of a text."""
+        normalize = self.encode_kwargs.get("normalize_embeddings", False)
+        return (
+            f"{self.model_name}|normalize={normalize}|dim={self.output_dim}"
+            f"|backend={self.backend}"
+        )
+
+
+# ============================================================================
+# Process-wide Model Registry
+# ============================================================================
+
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+def _load_embeddings(model_name: str, device: str, normalize: bool, dimension: int,
+                     backend: str = EMBEDDING_BACKEND):
+    """Load a new EmbeddingGemmaEmbeddings instance from disk."""
+    cache = None
+    if EMBEDDING_CACHE_ENABLED:
+        cache = EmbeddingCache(
+            EMBEDDING_CACHE_PATH,
+            max_entries=EMBEDDING_CACHE_MAX_ENTRIES
+        )
+    
+    if backend == "onnx":
+        from onnx_embeddings import OnnxSentenceEncoder
+        
+        if dimension not in SUPPORTED_DIMENSIONS:
+            raise ValueError(f"不支援的嵌入維度：{dimension}")
+        # Same class and prefix logic; only the client running the model differs
+        return EmbeddingGemmaEmbeddings.construct(
+            client=OnnxSentenceEncoder.from_pretrained(),
+            backend="onnx-int8" if EMBEDDING_ONNX_QUANTIZED else "onnx",
+            model_name=model_name,
+            model_kwargs={"device": device},
+            encode_kwargs={"normalize_embeddings": normalize},
+            output_dim=dimension,
+            show_progress=False,
+            cache=cache
+        )
+    if backend != "torch":
+        raise ValueError(f"不支援的嵌入後端：{backend}（可用：torch, onnx）")
+    
+    return EmbeddingGemmaEmbeddings(
+        model_name=model_name,
+        model_kwargs={"device": device},
+        encode_kwargs={"normalize_embeddings": normalize},
+        output_dim=dimension,
+        show_progress=False,
+        cache=cache
+    )
+
+
+def get_embeddings(
+    model_name: str = EMBEDDING_MODEL_NAME,
+    device: str = EMBEDDING_DEVICE,
+    normalize: bool = EMBEDDING_NORMALIZE,
+    dimension: int = EMBEDDING_DIMENSION,
+    backend: str = EMBEDDING_BACKEND
+):
+    """
+    Get the shared EmbeddingGemmaEmbeddings instance for this process.
+    
+    The sentence-transformers model is loaded on first use and reused by
+    every later caller with the same settings. Safe to call from multiple
+    threads; concurrent first calls load the model only once.
+    
+    Args:
+        model_name (str): HuggingFace model name
+        device (str): Device to run the model on (e.g. "cpu")
+        normalize (bool): Whether to L2-normalize embeddings
+        dimension (int): Output dimension (Matryoshka truncation below 768)
+        backend (str): Inference backend, "torch" or "onnx"
+        
+    Returns:
+        EmbeddingGemmaEmbeddings: Shared embeddings instance
+    """
+    key = (model_name, device, normalize, dimension, backend)
+    with _registry_lock:
+        embeddings = _registry.get(key)
+        if embeddings is None:
+            embeddings = _load_embeddings(model_name, device, normalize, dimension, backend)
+            _registry[key] = embeddings
+    return embeddings
+
+
+def warm_up_embeddings():
+    """
+    Load the configured embedding model into the registry ahead of time.
+    
+    Call this at application startup so the first create, load or query
+    does not pay the model loading cost.
+    
+    Returns:
+        EmbeddingGemmaEmbeddings: Shared embeddings instance
+    """
+    embeddings = get_embeddings()
+    embeddings.embed_query("warm up")
+    return embeddings
+
+
+def clear_embeddings_registry():
+    """Drop all cached models so they can be garbage-collected."""
+    with _registry_lock:
+        _registry.clear()
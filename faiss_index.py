@@ -0,0 +1,247 @@
+"""
+FAISS Index Module
+Builds the FAISS index used by the vector store: exact flat search,
+flat search over scalar-quantized vectors (float16 or int8, 2× / 4× less
+memory), or one of the approximate index types (IVF-Flat, IVF-PQ, HNSW)
+for large corpora.
+"""
+
+import faiss
+import numpy as np
+
+from config import (
+    FAISS_EF_SEARCH,
+    FAISS_HNSW_M,
+    FAISS_INDEX_TYPE,
+    FAISS_NLIST,
+    FAISS_NPROBE,
+    FAISS_PQ_M,
+    FAISS_TRAIN_SIZE,
+)
+
+
+INDEX_TYPES = ["flat", "sq_fp16", "sq8", "ivf_flat", "ivf_pq", "hnsw"]
+
+# Scalar quantizer of each SQ index type
+_SQ_TYPES = {
+    "sq_fp16": faiss.ScalarQuantizer.QT_fp16,
+    "sq8": faiss.ScalarQuantizer.QT_8bit,
+}
+
+# FAISS needs roughly this many training points per IVF centroid
+_MIN_POINTS_PER_CENTROID = 39
+
+# IVF-PQ uses 8-bit codes, so each sub-quantizer has 256 centroids
+_PQ_MIN_TRAINING_POINTS = 256
+
+
+def training_size(index_type: str = FAISS_INDEX_TYPE):
+    """
+    Get the number of vectors to collect before the index can be built.
+    
+    Args:
+        index_type (str): One of INDEX_TYPES
+        
+    Returns:
+        int: Training sample size (0 if the index needs no training)
+    """
+    if index_type in ("ivf_flat", "ivf_pq", "sq8"):
+        return FAISS_TRAIN_SIZE
+    return 0
+
+
+def build_index(training_vectors, index_type: str = FAISS_INDEX_TYPE,
+                nlist: int = FAISS_NLIST, pq_m: int = FAISS_PQ_M,
+                hnsw_m: int = FAISS_HNSW_M):
+    """
+    Create an empty FAISS index, training it on a sample if required.
+    
+    IVF and int8 SQ indexes need a training sample (SQ learns the value
+    range of every dimension from it); nlist is reduced if the sample is
+    too small for it, and the index falls back to flat if the sample cannot
+    train it at all (e.g. a tiny corpus with IVF-PQ).
+    
+    Args:
+        training_vectors: Array-like of shape (n, d) used to infer the
+            dimension and to train IVF indexes
+        index_type (str): One of INDEX_TYPES
+        nlist (int): Number of IVF lists
+        pq_m (int): Number of PQ sub-quantizers (must divide the dimension)
+        hnsw_m (int): Number of HNSW neighbours per node
+        
+    Returns:
+        tuple: (faiss.Index, dict of the parameters actually used)
+        
+    Raises:
+        ValueError: If index_type is unknown
+    """
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"不支援的索引類型：{index_type}（可用：{', '.join(INDEX_TYPES)}）")
+    
+    vectors = np.ascontiguousarray(training_vectors, dtype=np.float32)
+    n, dim = vectors.shape
+    
+    if index_type in ("ivf_flat", "ivf_pq"):
+        nlist = max(1, min(nlist, n // _MIN_POINTS_PER_CENTROID))
+        if n < nlist or (index_type == "ivf_pq" and n < _PQ_MIN_TRAINING_POINTS):
+            print(f"訓練樣本不足 ({n})，改用 flat 索引")
+            index_type = "flat"
+    
+    if index_type == "flat":
+        return faiss.IndexFlatL2(dim), {"index_type": "flat"}
+    
+    if index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, hnsw_m)
+        return index, {"index_type": "hnsw", "hnsw_m": hnsw_m}
+    
+    if index_type in _SQ_TYPES:
+        index = faiss.IndexScalarQuantizer(dim, _SQ_TYPES[index_type], faiss.METRIC_L2)
+        index.train(vectors)
+        return index, {"index_type": index_type}
+    
+    quantizer = faiss.IndexFlatL2(dim)
+    if index_type == "ivf_flat":
+        index = faiss.IndexIVFFlat(quantizer, dim, nlist)
+        params = {"index_type": "ivf_flat", "nlist": nlist}
+    else:
+        index = faiss.IndexIVFPQ(quantizer, dim, nlist, pq_m, 8)
+        params = {"index_type": "ivf_pq", "nlist": nlist, "pq_m": pq_m}
+    
+    index.train(vectors)
+    return index, params
+
+
+def set_search_params(index, nprobe: int = FAISS_NPROBE, ef_search: int = FAISS_EF_SEARCH):
+    """
+    Apply query-time accuracy/speed settings to an index.
+    
+    Has no effect on flat indexes.
+    
+    Args:
+        index (faiss.Index): Index to tune
+        nprobe (int): IVF lists scanned per query
+        ef_search (int): HNSW candidate list size per query
+    """
+    if not isinstance(index, faiss.Index):
+        return
+    
+    ivf_index = faiss.try_extract_index_ivf(index)
+    if ivf_index is not None:
+        ivf_index.nprobe = nprobe
+    
+    if isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = ef_search
+
+
+def describe_index(index):
+    """
+    Describe the type and build parameters of an existing index.
+    
+    Args:
+        index (faiss.Index): Index to describe
+        
+    Returns:
+        dict: Same shape as the parameters returned by build_index()
+    """
+    if not isinstance(index, faiss.Index):
+        # Exact search over a mapped vector column (see columnar_store)
+        return {"index_type": "flat"}
+    
+    if isinstance(index, faiss.IndexHNSW):
+        return {"index_type": "hnsw", "hnsw_m": index.hnsw.nb_neighbors(1)}
+    
+    if isinstance(index, faiss.IndexScalarQuantizer):
+        for index_type, qtype in _SQ_TYPES.items():
+            if index.sq.qtype == qtype:
+                return {"index_type": index_type}
+    
+    ivf_index = faiss.try_extract_index_ivf(index)
+    if ivf_index is not None:
+        ivf_index = faiss.downcast_index(ivf_index)
+    if isinstance(ivf_index, faiss.IndexIVFPQ):
+        return {"index_type": "ivf_pq", "nlist": ivf_index.nlist, "pq_m": ivf_index.pq.M}
+    if ivf_index is not None:
+        return {"index_type": "ivf_flat", "nlist": ivf_index.nlist}
+    
+    return {"index_type": "flat"}
+
+
+def supports_removal(index):
+    """
+    Check whether chunks can be deleted from an index.
+    
+    HNSW graphs have no remove_ids, so documents in an HNSW store can be
+    added but not replaced or removed; rebuild the database instead.
+    
+    Args:
+        index: FAISS index (or mapped flat index) of a vector store
+        
+    Returns:
+        bool: True if the index supports deleting chunks
+    """
+    return describe_index(index)["index_type"] != "hnsw"
+
+
+def index_footprint(index):
+    """
+    Report the memory footprint of an index's stored vectors.
+    
+    Args:
+        index: faiss.Index, or a mapped vector column (see columnar_store)
+        
+    Returns:
+        dict: "count" (vectors), "bytes" (serialized index size, which is
+            also what the index occupies in memory) and "bytes_per_vector"
+    """
+    if isinstance(index, faiss.Index):
+        size = faiss.serialize_index(index).nbytes
+    else:
+        size = index.vectors.nbytes
+    return {
+        "count": index.ntotal,
+        "bytes": int(size),
+        "bytes_per_vector": size / index.ntotal if index.ntotal else 0.0,
+    }
+
+
+def copy_index(index):
+    """
+    Copy an index into memory owned by this process, so it can be modified.
+    
+    Memory-mapped FAISS indexes are serialized and read back; the mapped
+    vector column of a columnar database becomes an exact IndexFlatL2.
+    
+    Args:
+        index: faiss.Index, or a mapped vector column (see columnar_store)
+        
+    Returns:
+        faiss.Index: Writable copy with the same search parameters applied
+    """
+    if isinstance(index, faiss.Index):
+        copy = faiss.deserialize_index(faiss.serialize_index(index))
+    else:
+        copy = faiss.IndexFlatL2(index.d)
+        # Convert float16 columns a block at a time
+        for start in range(0, index.ntotal, 65536):
+            copy.add(np.asarray(index.vectors[start:start + 65536], dtype=np.float32))
+    set_search_params(copy)
+    return copy
+
+
+def read_index_mmap(path: str, index_type: str):
+    """
+    Read a saved index read-only, memory-mapping its vector data.
+    
+    Args:
+        path (str): Path to the index file
+        index_type (str): One of INDEX_TYPES, as recorded at save time
+        
+    Returns:
+        faiss.Index: Memory-mapped index
+    """
+    # IVF indexes map their inverted lists, flat/SQ/HNSW their vector codes
+    if index_type in ("ivf_flat", "ivf_pq"):
+        io_flags = faiss.IO_FLAG_MMAP
+    else:
+        io_flags = faiss.IO_FLAG_MMAP_IFC
+    return faiss.read_index(path, io_flags | faiss.IO_FLAG_READ_ONLY)
@@ -0,0 +1,199 @@
+"""
+Ingest Jobs Module
+Runs vector database creation as background jobs so the Streamlit session
+is not blocked while large uploads are parsed and embedded.
+
+Jobs live in a process-wide job table, so a browser refresh (a new
+Streamlit session) can re-attach to a running job by its id. Each job
+reports per-stage progress (files parsed, chunks split, embedded and
+indexed) with throughput and an ETA, and saves the finished database to
+disk automatically.
+"""
+
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from config import INGEST_JOB_HISTORY, INGEST_JOB_WORKERS
+from vector_store import create_vector_store, save_vectorstore
+
+# Job states
+QUEUED = "queued"
+RUNNING = "running"
+SAVING = "saving"
+DONE = "done"
+FAILED = "failed"
+
+
+class IngestJob:
+    """
+    One background vector database build and its progress counters.
+    
+    The counters are only written by the worker thread and read by the
+    UI, so they need no lock; snapshot() returns a consistent-enough view
+    for display.
+    """
+
+    def __init__(self, uploaded_files, hf_token: str, save_path: str):
+        self.job_id = uuid.uuid4().hex[:12]
+        self.uploaded_files = list(uploaded_files)
+        self.hf_token = hf_token
+        self.save_path = save_path
+        self.state = QUEUED
+        self.error = None
+        self.load_errors = []
+        self.file_sizes = [uploaded_file.size for uploaded_file in self.uploaded_files]
+        self.counts = {
+            "parsed": 0, "split": 0, "deduplicated": 0, "embedded": 0, "indexed": 0
+        }
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    def progress(self, stage: str, count: int):
+        """Progress callback passed to create_vector_store()."""
+        self.counts[stage] += count
+
+    def run(self):
+        """Build the vector store and save it to save_path."""
+        self.state = RUNNING
+        self.started_at = time.time()
+        try:
+            vectorstore = create_vector_store(
+                self.uploaded_files,
+                self.hf_token,
+                errors=self.load_errors,
+                progress=self.progress
+            )
+            self.state = SAVING
+            save_vectorstore(vectorstore, self.save_path)
+            self.state = DONE
+        except Exception as e:
+            self.error = str(e)
+            self.state = FAILED
+        finally:
+            self.finished_at = time.time()
+            # Release the upload buffers as soon as they have been indexed
+            self.uploaded_files = []
+
+    def snapshot(self):
+        """
+        Describe the job's progress for display.
+        
+        The number of chunks to embed (split minus deduplicated) is only
+        known once every file has been split; until then it is extrapolated
+        from the bytes parsed so far.
+        
+        Returns:
+            dict: "job_id", "state", "error", "load_errors", "files_total",
+                per-stage counts ("parsed", "split", "deduplicated",
+                "embedded", "indexed"), "chunks_total" (chunks to embed,
+                estimated, None before the first file is split), "elapsed"
+                seconds, "chunks_per_second" (embedding throughput) and
+                "eta" seconds (None while unknown)
+        """
+        counts = dict(self.counts)
+        files_total = len(self.file_sizes)
+        
+        bytes_parsed = sum(self.file_sizes[:counts["parsed"]])
+        unique_chunks = counts["split"] - counts["deduplicated"]
+        if counts["parsed"] >= files_total:
+            chunks_total = unique_chunks
+        elif bytes_parsed > 0:
+            chunks_total = max(
+                unique_chunks,
+                round(unique_chunks * sum(self.file_sizes) / bytes_parsed)
+            )
+        else:
+            chunks_total = None
+        
+        if self.started_at is None:
+            elapsed = 0.0
+        else:
+            elapsed = (self.finished_at or time.time()) - self.started_at
+        rate = counts["embedded"] / elapsed if elapsed > 0 else 0.0
+        
+        if self.state in (DONE, FAILED):
+            eta = 0.0
+        elif rate > 0 and chunks_total is not None:
+            eta = max(chunks_total - counts["embedded"], 0) / rate
+        else:
+            eta = None
+        
+        return {
+            "job_id": self.job_id,
+            "state": self.state,
+            "error": self.error,
+            "load_errors": list(self.load_errors),
+            "files_total": files_total,
+            **counts,
+            "chunks_total": chunks_total,
+            "elapsed": elapsed,
+            "chunks_per_second": rate,
+            "eta": eta,
+        }
+
+
+# Process-wide job table and worker pool
+_jobs = OrderedDict()
+_jobs_lock = threading.Lock()
+_executor = ThreadPoolExecutor(
+    max_workers=INGEST_JOB_WORKERS, thread_name_prefix="ingest-job"
+)
+
+
+def submit_ingest_job(uploaded_files, hf_token: str, save_path: str = "faiss_db"):
+    """
+    Queue a background job that builds a vector store and saves it.
+    
+    Jobs run one at a time by default (INGEST_JOB_WORKERS), so two jobs
+    never write the same database directory concurrently.
+    
+    Args:
+        uploaded_files (list): List of uploaded file objects from Streamlit
+        hf_token (str): HuggingFace token for model access
+        save_path (str): Directory the finished database is saved to
+    
+    Returns:
+        str: Job id for get_job()
+    """
+    job = IngestJob(uploaded_files, hf_token, save_path)
+    with _jobs_lock:
+        _jobs[job.job_id] = job
+        # Forget the oldest finished jobs beyond the history limit
+        finished = [
+            job_id for job_id, other in _jobs.items() if other.state in (DONE, FAILED)
+        ]
+        for job_id in finished[:max(len(finished) - INGEST_JOB_HISTORY, 0)]:
+            del _jobs[job_id]
+    _executor.submit(job.run)
+    return job.job_id
+
+
+def get_job(job_id: str):
+    """
+    Look up a job's progress.
+    
+    Args:
+        job_id (str): Id returned by submit_ingest_job()
+    
+    Returns:
+        dict: IngestJob.snapshot(), or None for an unknown job id
+    """
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+    return job.snapshot() if job is not None else None
+
+
+def list_jobs():
+    """
+    List every job in the job table, newest first.
+    
+    Returns:
+        list: IngestJob.snapshot() dicts
+    """
+    with _jobs_lock:
+        jobs = list(_jobs.values())
+    return [job.snapshot() for job in reversed(jobs)]
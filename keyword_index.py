@@ -0,0 +1,362 @@
+"""
+Keyword Index Module
+BM25 inverted index over document chunks, used next to FAISS for hybrid
+retrieval. Chinese, Japanese and Korean text is tokenized into character
+bigrams, so exact product codes, names and terms are matched without a
+word segmenter; Latin letters and digits are kept as whole words.
+"""
+
+import copy
+import math
+import os
+import re
+import sys
+import threading
+import unicodedata
+from collections import Counter
+
+import numpy as np
+
+KEYWORD_INDEX_FILE_NAME = "keyword_index.npz"
+
+# BM25 term-frequency saturation and length normalization
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+_CJK_RANGES = (
+    "぀-ヿ"  # Hiragana, Katakana
+    "㐀-䶿"  # CJK Extension A
+    "一-鿿"  # CJK Unified Ideographs
+    "가-힯"  # Hangul syllables
+    "豈-﫿"  # CJK Compatibility Ideographs
+)
+_TOKEN_PATTERN = re.compile(
+    rf"[{_CJK_RANGES}]+|[0-9a-z]+(?:[-_./][0-9a-z]+)*"
+)
+_WORD_SEPARATORS = re.compile(r"[-_./]")
+
+
+def tokenize(text: str):
+    """
+    Split text into index terms.
+    
+    CJK runs become overlapping character bigrams (a single character is
+    kept as is); Latin/digit words are lowercased and kept whole, and
+    codes such as "AB-1234" also yield their parts.
+    
+    Args:
+        text (str): Text to tokenize
+    
+    Returns:
+        list: Terms in order of appearance
+    """
+    text = unicodedata.normalize("NFKC", text).lower()
+    tokens = []
+    for match in _TOKEN_PATTERN.finditer(text):
+        run = match.group()
+        if run[0].isascii():
+            tokens.append(run)
+            parts = _WORD_SEPARATORS.split(run)
+            if len(parts) > 1:
+                tokens.extend(parts)
+        elif len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+def reciprocal_rank_fusion(rankings, rrf_k: int = 60):
+    """
+    Fuse several ranked lists of ids with reciprocal rank fusion.
+    
+    Args:
+        rankings (list): Ranked lists of ids, best first
+        rrf_k (int): Rank offset; larger values flatten the fusion
+    
+    Returns:
+        list: (id, fused score) tuples, best first
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (rrf_k + rank + 1)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+class KeywordIndex:
+    """
+    BM25 inverted index keyed by docstore id.
+    
+    Chunks get consecutive integer slots and terms consecutive integer
+    ids. Every add() appends its postings as one block of flat int32
+    arrays (term id, slot, term frequency), about 12 bytes per posting, so
+    an index built during ingestion stays small. On the first search the
+    blocks are compiled into one array sorted by term (one contiguous
+    range of slots and precomputed BM25 term weights per term), so a
+    query costs one vectorized scatter-add per query term. Postings of
+    removed chunks are dropped when the index is next compiled.
+    """
+    
+    def __init__(self):
+        self._doc_ids = []      # slot -> doc_id (None once removed)
+        self._slots = {}        # doc_id -> slot
+        self._lengths = []      # slot -> number of terms (0 once removed)
+        self._terms = {}        # term -> term id
+        self._blocks = []       # (term ids, slots, tfs) arrays, one per add()
+        self._compiled = None   # (term ranges, slots, tfs, weights)
+    
+    def __len__(self):
+        return len(self._slots)
+    
+    def memory_bytes(self):
+        """Approximate memory held by the index: postings, vocabulary and id maps."""
+        postings = sum(array.nbytes for block in self._blocks for array in block)
+        terms = sys.getsizeof(self._terms) + sum(sys.getsizeof(term) for term in self._terms)
+        ids = (
+            sys.getsizeof(self._doc_ids) + sys.getsizeof(self._slots)
+            + sys.getsizeof(self._lengths)
+        )
+        return postings + terms + ids
+    
+    def add(self, doc_ids, texts):
+        """
+        Index chunks.
+        
+        Args:
+            doc_ids (list): Docstore ids of the chunks
+            texts (list): Chunk texts, aligned with doc_ids
+        """
+        self.remove([doc_id for doc_id in doc_ids if doc_id in self._slots])
+        term_ids, slots, tfs = [], [], []
+        for doc_id, text in zip(doc_ids, texts):
+            slot = len(self._doc_ids)
+            terms = tokenize(text)
+            for term, count in Counter(terms).items():
+                term_ids.append(self._terms.setdefault(term, len(self._terms)))
+                slots.append(slot)
+                tfs.append(count)
+            self._doc_ids.append(doc_id)
+            self._slots[doc_id] = slot
+            self._lengths.append(len(terms))
+        self._blocks.append((
+            np.asarray(term_ids, dtype=np.int32),
+            np.asarray(slots, dtype=np.int32),
+            np.asarray(tfs, dtype=np.int32)
+        ))
+        self._compiled = None
+    
+    def remove(self, doc_ids):
+        """
+        Remove chunks from the index.
+        
+        Args:
+            doc_ids (list): Docstore ids of the chunks to remove
+        """
+        slots = {self._slots[doc_id] for doc_id in doc_ids if doc_id in self._slots}
+        if not slots:
+            return
+        for slot in slots:
+            del self._slots[self._doc_ids[slot]]
+            self._doc_ids[slot] = None
+            self._lengths[slot] = 0
+        self._compiled = None
+    
+    def _compile(self):
+        """Merge the posting blocks into term-sorted arrays for fast scoring."""
+        if self._compiled is None:
+            if self._blocks:
+                term_ids, slots, tfs = (np.concatenate(column) for column in zip(*self._blocks))
+            else:
+                term_ids = slots = tfs = np.zeros(0, dtype=np.int32)
+            live = np.array([doc_id is not None for doc_id in self._doc_ids], dtype=bool)
+            keep = live[slots]
+            order = np.argsort(term_ids[keep], kind="stable")
+            term_ids, slots, tfs = term_ids[keep][order], slots[keep][order], tfs[keep][order]
+            self._blocks = [(term_ids, slots, tfs)]
+            
+            # Term ids are dict insertion order, so they index this list
+            names = list(self._terms)
+            present, starts, counts = np.unique(term_ids, return_index=True, return_counts=True)
+            term_ranges = {
+                names[term_id]: (start, start + count)
+                for term_id, start, count in zip(present.tolist(), starts.tolist(), counts.tolist())
+            }
+            self._set_compiled(term_ranges, slots, tfs)
+        return self._compiled
+    
+    def _set_compiled(self, term_ranges, slots, tfs):
+        """Store compiled postings with their precomputed BM25 term weights."""
+        lengths = np.asarray(self._lengths, dtype=np.float32)
+        avg_length = lengths.sum() / max(len(self._slots), 1)
+        norms = BM25_K1 * (1.0 - BM25_B + BM25_B * lengths[slots] / max(avg_length, 1e-9))
+        weights = (tfs * (BM25_K1 + 1.0) / (tfs + norms)).astype(np.float32)
+        self._compiled = (term_ranges, slots, tfs, weights)
+    
+    def search(self, query: str, k: int = 20):
+        """
+        Rank chunks against a query with BM25.
+        
+        Args:
+            query (str): Query text
+            k (int): Number of results to return
+            
+        Returns:
+            list: (doc_id, score) tuples, best first
+        """
+        n_docs = len(self._slots)
+        if n_docs == 0:
+            return []
+        term_ranges, slots, _, weights = self._compile()
+        
+        scores = np.zeros(len(self._doc_ids), dtype=np.float32)
+        for term, query_count in Counter(tokenize(query)).items():
+            term_range = term_ranges.get(term)
+            if term_range is None:
+                continue
+            start, end = term_range
+            df = end - start
+            idf = math.log(1.0 + (n_docs - df + 0.5) / (df + 0.5))
+            # Slots are unique within a term, so fancy-index += is safe
+            scores[slots[start:end]] += idf * query_count * weights[start:end]
+        
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [
+            (self._doc_ids[slot], float(scores[slot]))
+            for slot in top.tolist()
+            if scores[slot] > 0
+        ]
+    
+    @classmethod
+    def from_vectorstore(cls, vectorstore):
+        """
+        Build an index over every chunk in a vector store.
+        
+        Args:
+            vectorstore (FAISS): Vector store to index
+            
+        Returns:
+            KeywordIndex: New index
+        """
+        index = cls()
+        doc_ids = list(vectorstore.index_to_docstore_id.values())
+        index.add(
+            doc_ids,
+            [vectorstore.docstore.search(doc_id).page_content for doc_id in doc_ids]
+        )
+        return index
+    
+    def save(self, path: str):
+        """
+        Write the index to an .npz file (no pickled objects).
+        
+        Removed slots are compacted away, so the saved postings only refer
+        to live chunks.
+        
+        Args:
+            path (str): Target file path
+        """
+        term_ranges, slots, tfs, _ = self._compile()
+        live = [slot for slot, doc_id in enumerate(self._doc_ids) if doc_id is not None]
+        renumber = np.full(len(self._doc_ids), -1, dtype=np.int32)
+        renumber[live] = np.arange(len(live), dtype=np.int32)
+        
+        # Compiled ranges are contiguous and in term order
+        terms = list(term_ranges)
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        offsets[1:] = [end for _, end in term_ranges.values()]
+        
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(
+                f,
+                doc_ids=np.array([self._doc_ids[slot] for slot in live], dtype=str),
+                lengths=np.asarray(self._lengths, dtype=np.int32)[live],
+                terms=np.array(terms, dtype=str),
+                offsets=offsets,
+                slots=renumber[slots],
+                tfs=np.minimum(tfs, np.iinfo(np.uint16).max).astype(np.uint16),
+            )
+        os.replace(tmp_path, path)
+    
+    @classmethod
+    def load(cls, path):
+        """
+        Read an index written by save().
+        
+        Args:
+            path (str or file): Index file path, or a binary file opened on it
+            
+        Returns:
+            KeywordIndex: Loaded index, in compiled (read-optimized) form
+        """
+        with np.load(path, allow_pickle=False) as data:
+            doc_ids = data["doc_ids"].tolist()
+            lengths = data["lengths"]
+            terms = data["terms"].tolist()
+            offsets = data["offsets"].tolist()
+            slots = data["slots"]
+            tfs = data["tfs"]
+        
+        index = cls()
+        index._doc_ids = doc_ids
+        index._slots = {doc_id: slot for slot, doc_id in enumerate(doc_ids)}
+        index._lengths = lengths.tolist()
+        index._terms = {term: term_id for term_id, term in enumerate(terms)}
+        slots = slots.astype(np.int32)
+        tfs = tfs.astype(np.int32)
+        term_ids = np.repeat(
+            np.arange(len(terms), dtype=np.int32), np.diff(offsets)
+        )
+        index._blocks = [(term_ids, slots, tfs)]
+        index._set_compiled(
+            {term: (offsets[i], offsets[i + 1]) for i, term in enumerate(terms)},
+            slots,
+            tfs
+        )
+        return index
+
+
+class LazyKeywordIndex:
+    """
+    KeywordIndex that is read from disk the first time it is used.
+    
+    Keeps memory-mapped loads near-instant however large the corpus is:
+    the postings are only read when hybrid search (or a change to the
+    index) first needs them. The file is opened right away, so a save
+    that swaps the database directory in the meantime does not change
+    what is read. Any attribute access loads the index and forwards to it.
+    """
+    
+    def __init__(self, path: str):
+        """
+        Args:
+            path (str): Index file path
+        """
+        self._file = open(path, "rb")
+        self._index = None
+        self._lock = threading.Lock()
+    
+    @property
+    def loaded(self):
+        """Whether the index has been read yet."""
+        return self._index is not None
+    
+    def _load(self):
+        if self._index is None:
+            with self._lock:
+                if self._index is None:
+                    with self._file:
+                        self._index = KeywordIndex.load(self._file)
+        return self._index
+    
+    def __getattr__(self, name):
+        return getattr(self._load(), name)
+    
+    def __len__(self):
+        return len(self._load())
+    
+    def __deepcopy__(self, memo):
+        return copy.deepcopy(self._load(), memo)
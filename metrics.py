@@ -0,0 +1,86 @@
+"""
+Metrics Module
+Process-wide latency and counter metrics for the RAG pipeline.
+"""
+
+import os
+import sys
+import threading
+from collections import defaultdict, deque
+
+import numpy as np
+
+
+# Number of most recent samples kept per metric
+_MAX_SAMPLES = 1000
+
+_samples = defaultdict(lambda: deque(maxlen=_MAX_SAMPLES))
+_lock = threading.Lock()
+
+
+def record(name: str, value: float):
+    """
+    Record one sample of a metric (e.g. a latency in seconds).
+    
+    Args:
+        name (str): Metric name
+        value (float): Sample value
+    """
+    with _lock:
+        _samples[name].append(float(value))
+
+
+def summary(name: str):
+    """
+    Summarize the recent samples of a metric.
+    
+    Args:
+        name (str): Metric name
+        
+    Returns:
+        dict: count, last, mean, p50 and p95 (values are None without samples)
+    """
+    with _lock:
+        values = np.array(_samples[name], dtype=np.float64)
+    if not len(values):
+        return {"count": 0, "last": None, "mean": None, "p50": None, "p95": None}
+    return {
+        "count": len(values),
+        "last": float(values[-1]),
+        "mean": float(values.mean()),
+        "p50": float(np.percentile(values, 50)),
+        "p95": float(np.percentile(values, 95)),
+    }
+
+
+def reset():
+    """Drop all recorded samples."""
+    with _lock:
+        _samples.clear()
+
+
+def process_memory_mb():
+    """
+    Report the memory use of this process (i.e. of one app pod).
+    
+    Returns:
+        dict: "rss" (current resident set size, None where /proc is not
+            available) and "peak_rss", in MB
+    """
+    rss = None
+    status_path = f"/proc/{os.getpid()}/status"
+    if os.path.exists(status_path):
+        with open(status_path) as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    rss = int(line.split()[1]) / 1024
+                    break
+    
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+        peak_rss = peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+    except ImportError:  # Windows
+        peak_rss = None
+    return {"rss": rss, "peak_rss": peak_rss}
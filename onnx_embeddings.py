@@ -0,0 +1,208 @@
+"""
+ONNX Embeddings Module
+Runs EmbeddingGemma with ONNX Runtime instead of PyTorch
+sentence-transformers, optionally with an int8 dynamically quantized graph.
+
+OnnxSentenceEncoder has the same encode() interface as SentenceTransformer,
+so EmbeddingGemmaEmbeddings uses it as its client unchanged: the document
+and query prefixes, the embedding cache and Matryoshka truncation behave
+exactly as with the PyTorch backend.
+
+Download the exported model (and build the int8 variant) once:
+    python onnx_embeddings.py export [--dir embeddinggemma_onnx] [--quantize]
+"""
+
+import os
+import shutil
+
+import numpy as np
+
+from config import (
+    EMBEDDING_ONNX_PATH,
+    EMBEDDING_ONNX_QUANTIZED,
+    EMBEDDING_ONNX_THREADS,
+)
+
+
+# Exported sentence-transformers pipeline (transformer, mean pooling and
+# dense projections) for google/embeddinggemma-300m
+ONNX_REPO_ID = "onnx-community/embeddinggemma-300m-ONNX"
+MODEL_FILE_NAME = "model.onnx"
+QUANTIZED_MODEL_FILE_NAME = "model_quantized.onnx"
+TOKENIZER_FILE_NAME = "tokenizer.json"
+
+# EmbeddingGemma's maximum input length
+MAX_SEQ_LENGTH = 2048
+
+
+class OnnxSentenceEncoder:
+    """
+    Drop-in replacement for SentenceTransformer.encode backed by ONNX Runtime.
+    
+    Texts are sorted by length before batching so each batch is padded
+    only to the length of its own longest text; results are returned in
+    input order.
+    """
+
+    def __init__(self, session, tokenizer):
+        """
+        Args:
+            session: onnxruntime.InferenceSession of the exported model
+            tokenizer: tokenizers.Tokenizer with padding and truncation enabled
+        """
+        self.session = session
+        self.tokenizer = tokenizer
+        self._input_names = {model_input.name for model_input in session.get_inputs()}
+        self._output_names = [output.name for output in session.get_outputs()]
+
+    @classmethod
+    def from_pretrained(cls, model_dir: str = EMBEDDING_ONNX_PATH,
+                        quantized: bool = EMBEDDING_ONNX_QUANTIZED,
+                        intra_op_threads: int = EMBEDDING_ONNX_THREADS):
+        """
+        Load an exported model directory (see export_onnx()).
+        
+        Args:
+            model_dir (str): Directory with the ONNX graph and tokenizer.json
+            quantized (bool): Use the int8 dynamically quantized graph
+            intra_op_threads (int): ONNX Runtime intra-op threads (0 = all cores)
+        
+        Returns:
+            OnnxSentenceEncoder: Ready-to-use encoder
+        
+        Raises:
+            ImportError: If onnxruntime or tokenizers is not installed
+            FileNotFoundError: If the model has not been exported yet
+        """
+        try:
+            import onnxruntime as ort
+            from tokenizers import Tokenizer
+        except ImportError as e:
+            raise ImportError(
+                "Could not import onnxruntime / tokenizers. "
+                "Please install them with `pip install onnxruntime tokenizers`."
+            ) from e
+        
+        model_path = os.path.join(
+            model_dir, QUANTIZED_MODEL_FILE_NAME if quantized else MODEL_FILE_NAME
+        )
+        if not os.path.exists(model_path):
+            raise FileNotFoundError(
+                f"找不到 ONNX 模型 {model_path}，"
+                f"請先執行 python onnx_embeddings.py export"
+                f"{' --quantize' if quantized else ''}"
+            )
+        
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = intra_op_threads
+        options.inter_op_num_threads = 1
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        session = ort.InferenceSession(
+            model_path, options, providers=["CPUExecutionProvider"]
+        )
+        
+        tokenizer = Tokenizer.from_file(os.path.join(model_dir, TOKENIZER_FILE_NAME))
+        tokenizer.enable_truncation(MAX_SEQ_LENGTH)
+        tokenizer.enable_padding()
+        return cls(session, tokenizer)
+
+    def _run(self, texts):
+        """Embed one batch of texts."""
+        encodings = self.tokenizer.encode_batch(texts)
+        input_ids = np.array([encoding.ids for encoding in encodings], dtype=np.int64)
+        attention_mask = np.array(
+            [encoding.attention_mask for encoding in encodings], dtype=np.int64
+        )
+        inputs = {"input_ids": input_ids, "attention_mask": attention_mask}
+        inputs = {name: value for name, value in inputs.items() if name in self._input_names}
+        
+        outputs = dict(zip(self._output_names, self.session.run(None, inputs)))
+        if "sentence_embedding" in outputs:
+            return outputs["sentence_embedding"]
+        
+        # Graphs exported without the pooling head: mean-pool token states
+        hidden = outputs[self._output_names[0]]
+        mask = attention_mask[:, :, None].astype(hidden.dtype)
+        return (hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+
+    def encode(self, sentences, batch_size: int = 32, show_progress_bar: bool = False,
+               normalize_embeddings: bool = False, **kwargs):
+        """
+        Embed texts, mirroring SentenceTransformer.encode.
+        
+        Args:
+            sentences (list): Texts to embed (already prefixed)
+            batch_size (int): Texts per ONNX Runtime call
+            show_progress_bar (bool): Ignored; accepted for compatibility
+            normalize_embeddings (bool): L2-normalize the embeddings
+        
+        Returns:
+            np.ndarray: float32 array of shape (len(sentences), dim)
+        """
+        if not sentences:
+            return np.zeros((0, 0), dtype=np.float32)
+        
+        order = sorted(range(len(sentences)), key=lambda i: len(sentences[i]))
+        batches = [
+            self._run([sentences[i] for i in order[start:start + batch_size]])
+            for start in range(0, len(order), batch_size)
+        ]
+        embeddings = np.empty(
+            (len(sentences), batches[0].shape[1]), dtype=np.float32
+        )
+        embeddings[order] = np.concatenate(batches)
+        
+        if normalize_embeddings:
+            norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+            embeddings /= np.maximum(norms, 1e-12)
+        return embeddings
+
+
+def export_onnx(model_dir: str = EMBEDDING_ONNX_PATH, quantize: bool = False):
+    """
+    Download the exported EmbeddingGemma ONNX graph and tokenizer, and
+    optionally write an int8 dynamically quantized copy of the graph.
+    
+    The files are symlinked from the Hugging Face cache, or copied where
+    symlinks are not allowed (Windows without developer mode).
+    
+    Args:
+        model_dir (str): Target directory
+        quantize (bool): Also write model_quantized.onnx
+    """
+    from huggingface_hub import hf_hub_download
+    
+    os.makedirs(model_dir, exist_ok=True)
+    for file_name in ("onnx/model.onnx", "onnx/model.onnx_data", TOKENIZER_FILE_NAME):
+        path = hf_hub_download(ONNX_REPO_ID, file_name)
+        target = os.path.join(model_dir, os.path.basename(file_name))
+        if not os.path.exists(target):
+            try:
+                os.symlink(path, target)
+            except OSError:
+                # Windows only allows symlinks with developer mode or admin rights
+                shutil.copy2(path, target)
+    print(f"已下載 ONNX 模型到: {model_dir}")
+    
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        
+        quantize_dynamic(
+            os.path.join(model_dir, MODEL_FILE_NAME),
+            os.path.join(model_dir, QUANTIZED_MODEL_FILE_NAME),
+            weight_type=QuantType.QInt8
+        )
+        print(f"已建立 int8 量化模型: {QUANTIZED_MODEL_FILE_NAME}")
+
+
+if __name__ == "__main__":
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="Prepare the EmbeddingGemma ONNX model")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    export_parser = subparsers.add_parser("export", help="download and optionally quantize")
+    export_parser.add_argument("--dir", default=EMBEDDING_ONNX_PATH)
+    export_parser.add_argument("--quantize", action="store_true")
+    args = parser.parse_args()
+    
+    export_onnx(args.dir, quantize=args.quantize)
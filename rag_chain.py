@@ -4,11 +4,44 @@ Implements the RAG (Retrieval-Augmented Generation) query functionality
 using Gemini 2.5 Flash and LangChain.
 """
 
+import asyncio
+import random
+import threading
+import time
+from collections import OrderedDict
+
+import google.generativeai as genai
+from google.generativeai import client as genai_client
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain.prompts import ChatPromptTemplate
 from langchain.schema.runnable import RunnablePassthrough
 from langchain.schema.output_parser import StrOutputParser
 
+import metrics
+from answer_cache import AnswerCache, store_fingerprint
+from context_builder import build_context
+from config import (
+    ANSWER_CACHE_ENABLED,
+    ANSWER_CACHE_MAX_ENTRIES,
+    ANSWER_CACHE_SIMILARITY,
+    ANSWER_CACHE_TTL_SECONDS,
+    CONTEXT_DEDUP_THRESHOLD,
+    CONTEXT_TOKEN_BUDGET,
+    LLM_API_ENDPOINT,
+    LLM_CONCURRENCY,
+    LLM_MAX_RETRIES,
+    LLM_MODEL_NAME,
+    LLM_POOL_SIZE,
+    LLM_TEMPERATURE,
+    LLM_TRANSPORT,
+    RERANK_ENABLED,
+    RERANK_FETCH_K,
+    RERANK_TOP_K,
+    RETRIEVER_K,
+)
+from reranker import get_reranker
+from vector_store import embed_queries, retrieve_documents
+
 
 # Define RAG prompt template in Traditional Chinese
 RAG_PROMPT_TEMPLATE = """
@@ -24,11 +57,208 @@ Question:
 """
 
 
+# Process-wide cache of answers in front of the LLM step
+_answer_cache = AnswerCache(
+    similarity_threshold=ANSWER_CACHE_SIMILARITY,
+    ttl_seconds=ANSWER_CACHE_TTL_SECONDS,
+    max_entries=ANSWER_CACHE_MAX_ENTRIES
+)
+
+
+def get_answer_cache():
+    """Get the process-wide AnswerCache (e.g. for its stats())."""
+    return _answer_cache
+
+
+def format_docs(docs, query_stats: dict = None):
+    """
+    Format retrieved documents into a single context string.
+    
+    Overlapping chunks are merged, near-duplicates removed and the result
+    capped at CONTEXT_TOKEN_BUDGET (see context_builder.build_context).
+    The estimated prompt tokens and the tokens saved compared to joining
+    every chunk are recorded as the "context_tokens" and
+    "context_tokens_saved" metrics, and also stored in query_stats when
+    given, so a caller can report them for its own query.
+    """
+    context, stats = build_context(docs, CONTEXT_TOKEN_BUDGET, CONTEXT_DEDUP_THRESHOLD)
+    metrics.record("context_tokens", stats["context_tokens"])
+    metrics.record("context_tokens_saved", stats["saved_tokens"])
+    if query_stats is not None:
+        query_stats["context_tokens"] = stats["context_tokens"]
+        query_stats["context_tokens_saved"] = stats["saved_tokens"]
+    return context
+
+
+def build_answer_chain(llm):
+    """
+    Build the generation half of the RAG chain.
+    
+    Args:
+        llm: Chat model used to generate the answer
+        
+    Returns:
+        Runnable: Chain from {"context": docs, "question": str} to the
+            answer; an optional "query_stats" dict receives the context
+            token counts (see format_docs)
+    """
+    return (
+        RunnablePassthrough.assign(
+            context=lambda x: format_docs(x["context"], x.get("query_stats"))
+        )
+        | ChatPromptTemplate.from_template(RAG_PROMPT_TEMPLATE)
+        | llm
+        | StrOutputParser()
+    )
+
+
+class _LazyClient:
+    """Client of a client manager, created on first use (async clients need the event loop)."""
+    
+    def __init__(self, manager, name: str):
+        self._manager = manager
+        self._name = name
+    
+    def __getattr__(self, attr):
+        return getattr(self._manager.get_default_client(self._name), attr)
+
+
+def _bind_clients(llm, llm_api_key: str):
+    """
+    Connect a Gemini chat model to its own API key.
+    
+    ChatGoogleGenerativeAI configures google-generativeai globally, and its
+    model connects on first use with whichever key was configured last, so
+    a pooled chain could end up on another session's key. The model gets
+    clients from a client manager of its own instead.
+    """
+    manager = genai_client._ClientManager()
+    manager.configure(
+        api_key=llm_api_key,
+        transport=LLM_TRANSPORT,
+        client_options={"api_endpoint": LLM_API_ENDPOINT} if LLM_API_ENDPOINT else None
+    )
+    llm.client._client = manager.get_default_client("generative")
+    llm.client._async_client = _LazyClient(manager, "generative_async")
+
+
+# Compiled answer chains (and their LLM clients) reused across queries
+_chain_pool = OrderedDict()
+_chain_pool_lock = threading.Lock()
+
+
+def get_answer_chain(llm_api_key: str, model: str = LLM_MODEL_NAME,
+                     temperature: float = LLM_TEMPERATURE):
+    """
+    Get a pooled answer chain for an API key and model settings.
+    
+    The Gemini client is created once per (api key, model, temperature) and
+    reused, so its connection (gRPC channel or REST session) stays alive
+    between questions. Each client is bound to its own API key when the
+    chain is built, so sessions with different keys never share one. The
+    pool keeps the LLM_POOL_SIZE most recently used chains.
+    
+    Args:
+        llm_api_key (str): Google API key for Gemini access
+        model (str): Gemini model name
+        temperature (float): Sampling temperature
+        
+    Returns:
+        Runnable: Chain built by build_answer_chain()
+    """
+    key = (llm_api_key, model, temperature)
+    with _chain_pool_lock:
+        chain = _chain_pool.get(key)
+        if chain is None:
+            llm = ChatGoogleGenerativeAI(
+                model=model,
+                temperature=temperature,
+                google_api_key=llm_api_key,
+                transport=LLM_TRANSPORT,
+                client_options={"api_endpoint": LLM_API_ENDPOINT} if LLM_API_ENDPOINT else None
+            )
+            if isinstance(getattr(llm, "client", None), genai.GenerativeModel):
+                _bind_clients(llm, llm_api_key)
+            chain = build_answer_chain(llm)
+            _chain_pool[key] = chain
+        _chain_pool.move_to_end(key)
+        while len(_chain_pool) > LLM_POOL_SIZE:
+            _chain_pool.popitem(last=False)
+    return chain
+
+
+def clear_chain_pool():
+    """Drop all pooled chains and LLM clients."""
+    with _chain_pool_lock:
+        _chain_pool.clear()
+
+
+def _lookup(vectorstore, query: str):
+    """
+    Look the query up in the answer cache, embedding it at most once.
+    
+    Returns:
+        tuple: (fingerprint, query_embedding, cached) where cached is
+            (answer, docs) on a hit and None otherwise; query_embedding is
+            None for exact-match hits
+    """
+    fingerprint = store_fingerprint(vectorstore)
+
+    if ANSWER_CACHE_ENABLED:
+        cached = _answer_cache.get_exact(query, fingerprint)
+        if cached is not None:
+            return fingerprint, None, cached
+
+    # Embed the query once and reuse it for the semantic lookup and retrieval
+    start = time.perf_counter()
+    query_embedding = vectorstore.embedding_function.embed_query(query)
+    metrics.record("embedding_seconds", time.perf_counter() - start)
+
+    if ANSWER_CACHE_ENABLED:
+        cached = _answer_cache.get_similar(query_embedding, fingerprint)
+        if cached is not None:
+            return fingerprint, query_embedding, cached
+
+    return fingerprint, query_embedding, None
+
+
+def _retrieve(vectorstore, queries, query_embeddings):
+    """
+    Retrieve the context documents for one or more queries.
+    
+    With RERANK_ENABLED, RERANK_FETCH_K candidates are fetched per query and
+    the RERANK_TOP_K best by cross-encoder score are kept; otherwise the
+    top RETRIEVER_K hits are used as is. Stage latencies are recorded as the
+    "retrieval_seconds" and "rerank_seconds" metrics.
+    
+    Returns:
+        list: Per query, the documents to send to the LLM
+    """
+    start = time.perf_counter()
+    fetch_k = max(RERANK_FETCH_K, RERANK_TOP_K) if RERANK_ENABLED else RETRIEVER_K
+    candidates = retrieve_documents(vectorstore, queries, query_embeddings, k=fetch_k)
+    metrics.record("retrieval_seconds", time.perf_counter() - start)
+    if not RERANK_ENABLED:
+        return candidates
+    
+    start = time.perf_counter()
+    reranker = get_reranker()
+    reranked = [
+        [doc for doc, _ in reranker.rerank(query, docs, RERANK_TOP_K)]
+        for query, docs in zip(queries, candidates)
+    ]
+    metrics.record("rerank_seconds", time.perf_counter() - start)
+    return reranked
+
+
 def query_rag(vectorstore, query: str, llm_api_key: str):
     """
     Execute the RAG query pipeline: retrieve relevant documents, 
     format context, and generate an answer using Gemini 2.5 Flash.
     
+    Answers are served from the answer cache when the same (or a very
+    similar) question was already answered against the same store contents.
+    
     Args:
         vectorstore: FAISS vector store containing embedded documents
         query (str): User's question
@@ -42,37 +272,159 @@ def query_rag(vectorstore, query: str, llm_api_key: str):
     if not llm_api_key:
         return "錯誤：未提供 Google API Key。", []
 
-    # Initialize Gemini 2.5 Flash LLM
-    llm = ChatGoogleGenerativeAI(
-        model="gemini-2.5-flash",
-        temperature=0.0,
-        google_api_key=llm_api_key
+    start = time.perf_counter()
+    fingerprint, query_embedding, cached = _lookup(vectorstore, query)
+    if cached is not None:
+        return cached
+
+    # Fetch the most relevant documents (hybrid BM25 + dense, then the
+    # optional reranking stage)
+    retrieved_docs = _retrieve(vectorstore, [query], [query_embedding])[0]
+
+    # Generate the answer with the pooled Gemini client and chain
+    generation_start = time.perf_counter()
+    final_answer = get_answer_chain(llm_api_key).invoke(
+        {"context": retrieved_docs, "question": query}
     )
+    metrics.record("generation_seconds", time.perf_counter() - generation_start)
 
-    # Set up retriever with k=4 to fetch top 4 most relevant documents
-    retriever = vectorstore.as_retriever(search_kwargs={"k": 4})
-
-    def format_docs(docs):
-        """Format retrieved documents into a single context string."""
-        return "\n\n---\n\n".join(doc.page_content for doc in docs)
-
-    # Build the RAG chain:
-    # 1. Retrieve documents matching the query
-    # 2. Format them into context
-    # 3. Create prompt with context and question
-    # 4. Pass through LLM
-    # 5. Parse output to string
-    rag_chain = (
-        {"context": retriever | format_docs, "question": RunnablePassthrough()}
-        | ChatPromptTemplate.from_template(RAG_PROMPT_TEMPLATE)
-        | llm
-        | StrOutputParser()
+    if ANSWER_CACHE_ENABLED:
+        _answer_cache.put(
+            query,
+            query_embedding,
+            fingerprint,
+            final_answer,
+            retrieved_docs,
+            latency=time.perf_counter() - start
+        )
+
+    return final_answer, retrieved_docs
+
+
+def query_rag_stream(vectorstore, query: str, llm_api_key: str):
+    """
+    Streaming variant of query_rag().
+    
+    Yields the retrieved documents as soon as retrieval finishes, then the
+    answer piece by piece as Gemini generates it, then the stats of this
+    query. The time from the call to the first answer token is also
+    recorded as the process-wide "time_to_first_token" metric.
+    
+    Args:
+        vectorstore: FAISS vector store containing embedded documents
+        query (str): User's question
+        llm_api_key (str): Google API key for Gemini access
+        
+    Yields:
+        tuple: ("docs", retrieved_docs) once, then ("token", text) chunks,
+            then ("stats", {"time_to_first_token": float, "cached": bool})
+            once an answer was produced; generated (not cached) answers
+            also get "context_tokens" and "context_tokens_saved"
+    """
+    if not llm_api_key:
+        yield "docs", []
+        yield "token", "錯誤：未提供 Google API Key。"
+        return
+
+    start = time.perf_counter()
+    fingerprint, query_embedding, cached = _lookup(vectorstore, query)
+    if cached is not None:
+        final_answer, retrieved_docs = cached
+        yield "docs", retrieved_docs
+        time_to_first_token = time.perf_counter() - start
+        metrics.record("time_to_first_token", time_to_first_token)
+        yield "token", final_answer
+        yield "stats", {"time_to_first_token": time_to_first_token, "cached": True}
+        return
+
+    # Fetch the most relevant documents (hybrid BM25 + dense, then the
+    # optional reranking stage)
+    retrieved_docs = _retrieve(vectorstore, [query], [query_embedding])[0]
+    yield "docs", retrieved_docs
+
+    # Stream the answer with the pooled Gemini client and chain
+    parts = []
+    query_stats = {"time_to_first_token": None, "cached": False}
+    generation_start = time.perf_counter()
+    for token in get_answer_chain(llm_api_key).stream(
+        {"context": retrieved_docs, "question": query, "query_stats": query_stats}
+    ):
+        if not parts:
+            query_stats["time_to_first_token"] = time.perf_counter() - start
+            metrics.record("time_to_first_token", query_stats["time_to_first_token"])
+        parts.append(token)
+        yield "token", token
+    metrics.record("generation_seconds", time.perf_counter() - generation_start)
+
+    if ANSWER_CACHE_ENABLED:
+        _answer_cache.put(
+            query,
+            query_embedding,
+            fingerprint,
+            "".join(parts),
+            retrieved_docs,
+            latency=time.perf_counter() - start
+        )
+
+    yield "stats", query_stats
+
+
+def _is_rate_limited(error):
+    """Check whether an LLM error is a rate-limit (HTTP 429) response."""
+    return (
+        type(error).__name__ in ("ResourceExhausted", "TooManyRequests")
+        or "429" in str(error)
     )
 
-    # Execute the RAG chain to get the final answer
-    final_answer = rag_chain.invoke(query)
+
+async def query_rag_batch(vectorstore, queries, llm_api_key: str,
+                          concurrency: int = LLM_CONCURRENCY,
+                          max_retries: int = LLM_MAX_RETRIES):
+    """
+    Answer many questions with batched retrieval and concurrent generation.
     
-    # Separately invoke retriever to get documents for display
-    retrieved_docs = retriever.invoke(query)
+    All queries are embedded in one batched forward pass and searched with a
+    single FAISS call. Gemini calls then run concurrently, at most
+    `concurrency` at a time, and are retried with exponential backoff when
+    rate limited. The answer cache is bypassed.
+    
+    Args:
+        vectorstore: FAISS vector store containing embedded documents
+        queries (list): Questions to answer
+        llm_api_key (str): Google API key for Gemini access
+        concurrency (int): Maximum number of concurrent Gemini calls
+        max_retries (int): Retries per question after a rate-limit error
+        
+    Returns:
+        list: (final_answer, retrieved_docs) per question, in input order.
+            Questions that fail get an error message as the answer.
+    """
+    if not llm_api_key:
+        return [("錯誤：未提供 Google API Key。", []) for _ in queries]
+    if not queries:
+        return []
 
-    return final_answer, retrieved_docs
+    queries = list(queries)
+    query_embeddings = embed_queries(vectorstore.embedding_function, queries)
+    all_docs = _retrieve(vectorstore, queries, query_embeddings)
+
+    answer_chain = get_answer_chain(llm_api_key)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def answer(query, retrieved_docs):
+        async with semaphore:
+            for attempt in range(max_retries + 1):
+                try:
+                    final_answer = await answer_chain.ainvoke(
+                        {"context": retrieved_docs, "question": query}
+                    )
+                    return final_answer, retrieved_docs
+                except Exception as e:
+                    if not _is_rate_limited(e) or attempt == max_retries:
+                        return f"錯誤：{str(e)}", retrieved_docs
+                    # Exponential backoff with jitter: ~1s, 2s, 4s, ...
+                    await asyncio.sleep(2 ** attempt + random.random())
+
+    return await asyncio.gather(
+        *(answer(query, docs) for query, docs in zip(queries, all_docs))
+    )
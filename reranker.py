@@ -0,0 +1,135 @@
+"""
+Reranker Module
+Optional cross-encoder reranking of retrieved chunks. Candidates are
+over-fetched from the vector store, scored against the query in one
+batched cross-encoder pass on CPU, and only the best ones are sent to
+the LLM.
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict
+
+from config import EMBEDDING_DEVICE, RERANK_CACHE_MAX_ENTRIES, RERANK_MODEL_NAME
+
+
+class CrossEncoderReranker:
+    """
+    Scores (query, chunk) pairs with a cross-encoder model.
+    
+    Scores are kept in an LRU cache keyed by the query and a hash of the
+    chunk text, so asking the same question again (or paging through the
+    same passages) does not run the model twice.
+    """
+
+    def __init__(self, model, max_cache_entries: int = RERANK_CACHE_MAX_ENTRIES,
+                 batch_size: int = 32):
+        """
+        Args:
+            model: Object with a sentence-transformers style
+                predict(list of (query, passage) pairs) method
+            max_cache_entries (int): Maximum number of cached scores
+            batch_size (int): Pairs per forward pass
+        """
+        self.model = model
+        self.max_cache_entries = max_cache_entries
+        self.batch_size = batch_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(query: str, text: str):
+        return query, hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+    def score(self, query: str, docs):
+        """
+        Score documents against a query, running the model only on cache misses.
+        
+        Args:
+            query (str): User's question
+            docs (list): Candidate documents
+        
+        Returns:
+            list: One relevance score per document (higher is better)
+        """
+        keys = [self._key(query, doc.page_content) for doc in docs]
+        scores = {}
+        with self._lock:
+            for key in keys:
+                if key in self._cache:
+                    self._cache.move_to_end(key)
+                    scores[key] = self._cache[key]
+        
+        missing = {key: doc for key, doc in zip(keys, docs) if key not in scores}
+        if missing:
+            predictions = self.model.predict(
+                [(query, doc.page_content) for doc in missing.values()],
+                batch_size=self.batch_size
+            )
+            new_scores = dict(zip(missing, (float(value) for value in predictions)))
+            scores.update(new_scores)
+            with self._lock:
+                self._cache.update(new_scores)
+                while len(self._cache) > self.max_cache_entries:
+                    self._cache.popitem(last=False)
+        
+        with self._lock:
+            self.misses += len(missing)
+            self.hits += len(keys) - len(missing)
+        return [scores[key] for key in keys]
+
+    def rerank(self, query: str, docs, top_k: int):
+        """
+        Keep the top_k documents by cross-encoder score.
+        
+        Args:
+            query (str): User's question
+            docs (list): Candidate documents
+            top_k (int): Number of documents to keep
+        
+        Returns:
+            list: (document, score) tuples, best first
+        """
+        ranked = sorted(
+            zip(docs, self.score(query, docs)),
+            key=lambda item: item[1],
+            reverse=True
+        )
+        return ranked[:top_k]
+
+
+# Process-wide reranker registry (one model per name/device)
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+def get_reranker(model_name: str = RERANK_MODEL_NAME, device: str = EMBEDDING_DEVICE):
+    """
+    Return the shared reranker for a model, loading it on first use.
+    
+    Args:
+        model_name (str): HuggingFace cross-encoder model name
+        device (str): Device to run the model on
+    
+    Returns:
+        CrossEncoderReranker: Shared reranker
+    
+    Raises:
+        ImportError: If sentence-transformers is not installed
+    """
+    key = (model_name, device)
+    with _registry_lock:
+        reranker = _registry.get(key)
+        if reranker is None:
+            try:
+                from sentence_transformers import CrossEncoder
+            except ImportError as e:
+                raise ImportError(
+                    "Could not import sentence_transformers python package. "
+                    "Please install it with `pip install sentence-transformers`."
+                ) from e
+            reranker = CrossEncoderReranker(CrossEncoder(model_name, device=device))
+            _registry[key] = reranker
+    return reranker
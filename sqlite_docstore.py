@@ -0,0 +1,152 @@
+"""
+SQLite Docstore Module
+Read-only, SQLite-backed docstore for saved vector databases, so chunk
+text and metadata are read on demand instead of being unpickled into RAM.
+SQLite's memory-mapped I/O lets several processes share the same pages.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+from collections.abc import Mapping
+
+from langchain_community.docstore.base import Docstore
+from langchain_core.documents import Document
+
+
+DOCSTORE_FILE_NAME = "docstore.sqlite3"
+
+# Upper bound for SQLite memory-mapped I/O on the docstore file
+_MMAP_SIZE = 1 << 34
+
+
+def write_sqlite_docstore(path: str, docstore, index_to_docstore_id):
+    """
+    Write the chunks of a vector store to a SQLite docstore file.
+    
+    The file is written next to the target and moved into place, so readers
+    never see a half-written database.
+    
+    Args:
+        path (str): Target SQLite file
+        docstore: LangChain docstore holding the chunks
+        index_to_docstore_id (dict): FAISS position to docstore ID mapping
+    """
+    tmp_path = f"{path}.tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    
+    conn = sqlite3.connect(tmp_path)
+    try:
+        conn.execute(
+            "CREATE TABLE chunks ("
+            " position INTEGER PRIMARY KEY,"
+            " id TEXT NOT NULL UNIQUE,"
+            " page_content TEXT NOT NULL,"
+            " metadata TEXT NOT NULL)"
+        )
+        
+        def rows():
+            for position, doc_id in sorted(index_to_docstore_id.items()):
+                document = docstore.search(doc_id)
+                yield (
+                    position,
+                    doc_id,
+                    document.page_content,
+                    json.dumps(document.metadata, ensure_ascii=False)
+                )
+        
+        conn.executemany("INSERT INTO chunks VALUES (?, ?, ?, ?)", rows())
+        conn.commit()
+    finally:
+        conn.close()
+    
+    os.replace(tmp_path, path)
+
+
+class SQLiteDocstore(Docstore):
+    """Read-only docstore that looks chunks up in a SQLite file."""
+    
+    def __init__(self, path: str):
+        """
+        Open a docstore written by write_sqlite_docstore().
+        
+        Args:
+            path (str): Path to the SQLite file
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        uri = f"file:{os.path.abspath(path)}?mode=ro"
+        self._conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        self._conn.execute(f"PRAGMA mmap_size={_MMAP_SIZE}")
+
+    def search(self, search: str):
+        """
+        Look up a chunk by docstore ID.
+        
+        Args:
+            search (str): Docstore ID
+            
+        Returns:
+            Document if found, else error message
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT page_content, metadata FROM chunks WHERE id = ?",
+                (search,)
+            ).fetchone()
+        if row is None:
+            return f"ID {search} not found."
+        return Document(page_content=row[0], metadata=json.loads(row[1]))
+
+    def iter_chunks(self):
+        """
+        Read every chunk in FAISS position order with a single query.
+        
+        Yields:
+            tuple: (position, docstore ID, Document)
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT position, id, page_content, metadata FROM chunks ORDER BY position"
+            ).fetchall()
+        for position, doc_id, page_content, metadata in rows:
+            yield position, doc_id, Document(page_content=page_content, metadata=json.loads(metadata))
+
+    def index_mapping(self):
+        """Get the lazy FAISS position to docstore ID mapping."""
+        return SQLiteIndexMapping(self)
+
+
+class SQLiteIndexMapping(Mapping):
+    """Read-only FAISS position to docstore ID mapping backed by SQLite."""
+    
+    def __init__(self, docstore: SQLiteDocstore):
+        self._docstore = docstore
+        with docstore._lock:
+            (self._length,) = docstore._conn.execute(
+                "SELECT COUNT(*) FROM chunks"
+            ).fetchone()
+
+    def __getitem__(self, position):
+        with self._docstore._lock:
+            row = self._docstore._conn.execute(
+                "SELECT id FROM chunks WHERE position = ?",
+                (int(position),)
+            ).fetchone()
+        if row is None:
+            raise KeyError(position)
+        return row[0]
+
+    def __iter__(self):
+        with self._docstore._lock:
+            positions = [
+                position for (position,) in self._docstore._conn.execute(
+                    "SELECT position FROM chunks ORDER BY position"
+                )
+            ]
+        return iter(positions)
+
+    def __len__(self):
+        return self._length
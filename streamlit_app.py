@@ -12,14 +12,30 @@ Features:
 import streamlit as st
 import os
 import sys
+import time
+from collections import Counter
 from pathlib import Path
 
 # Add current directory to path for local imports
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-from embeddings import EmbeddingGemmaEmbeddings
-from rag_chain import query_rag
-from vector_store import create_vector_store, save_vectorstore, load_vectorstore
+from config import EMBEDDING_WARMUP
+from embeddings import warm_up_embeddings
+from faiss_index import supports_removal
+from ingest_jobs import get_job, submit_ingest_job
+import metrics
+from rag_chain import get_answer_cache, query_rag_stream
+from vector_store import (
+    save_vectorstore,
+    load_vectorstore,
+    add_documents_to_vectorstore,
+    remove_source_from_vectorstore,
+    copy_to_memory,
+    get_manifest,
+    get_db_version,
+    load_manifest,
+    load_db_metadata,
+)
 
 
 # ============================================================================
@@ -33,6 +49,118 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+
+# ============================================================================
+# Shared Resources
+# ============================================================================
+
+@st.cache_resource(show_spinner=False)
+def get_shared_embeddings():
+    """Embedding model shared by every session and rerun of this process."""
+    return warm_up_embeddings()
+
+
+@st.cache_resource(show_spinner=False, max_entries=2)
+def get_shared_vectorstore(load_path: str, version):
+    """
+    Saved vector store shared by every session of this process.
+    
+    Keyed by path and on-disk version (see get_db_version), so a database
+    that is saved again is loaded once more and sessions switch to it on
+    their next rerun. Shared stores must not be modified in place; see
+    make_private_vectorstore().
+    """
+    return load_vectorstore(load_path)
+
+
+@st.cache_resource(show_spinner=False, max_entries=2)
+def get_shared_manifest(load_path: str, version):
+    """
+    Per-source manifest of the shared store, read once per on-disk version.
+    
+    save_vectorstore() writes manifest.json together with the index, so it
+    describes the store get_shared_vectorstore() returns for the same
+    version. Databases saved without one fall back to scanning the store.
+    """
+    manifest = load_manifest(load_path)
+    if not manifest:
+        manifest = get_manifest(get_shared_vectorstore(load_path, version))
+    return manifest
+
+
+def get_session_manifest():
+    """Manifest of this session's store, without scanning every chunk on each rerun."""
+    if st.session_state['db_version'] is not None:
+        return get_shared_manifest("faiss_db", st.session_state['db_version'])
+    if st.session_state.get('manifest') is None:
+        st.session_state['manifest'] = get_manifest(st.session_state['vectorstore'])
+    return st.session_state['manifest']
+
+
+def use_shared_vectorstore():
+    """Switch this session to the saved faiss_db store shared by every session."""
+    version = get_db_version("faiss_db")
+    if version is None:
+        raise FileNotFoundError("找不到 faiss_db 資料庫，請稍後再試。")
+    st.session_state['vectorstore'] = get_shared_vectorstore("faiss_db", version)
+    st.session_state['db_version'] = version
+
+
+def make_private_vectorstore():
+    """Give this session its own writable copy before it modifies the store."""
+    if st.session_state['db_version'] is not None:
+        shared = st.session_state['vectorstore']
+        private = copy_to_memory(shared)
+        if private is shared:
+            # Already in memory, so shared by every session: load a copy
+            private = load_vectorstore("faiss_db", mmap=False)
+        st.session_state['vectorstore'] = private
+        st.session_state['db_version'] = None
+    # The private store is about to change; rebuild its manifest on next use
+    st.session_state['manifest'] = None
+    return st.session_state['vectorstore']
+
+
+def render_ingest_job(job):
+    """Show the per-stage progress of a background ingestion job."""
+    st.markdown("### ⏳ 背景建立資料庫")
+    files_total = max(job["files_total"], 1)
+    chunks_total = job["chunks_total"]
+    chunks_label = f"{chunks_total}" if job["parsed"] >= job["files_total"] else f"約 {chunks_total}"
+    
+    st.progress(
+        job["parsed"] / files_total,
+        text=f"解析文件：{job['parsed']}/{job['files_total']}"
+    )
+    split_text = f"切分片段：{job['split']} 個"
+    if job["deduplicated"]:
+        split_text += f"（移除重複 {job['deduplicated']} 個）"
+    st.progress(job["parsed"] / files_total, text=split_text)
+    for stage, label in (("embedded", "嵌入片段"), ("indexed", "建立索引")):
+        if chunks_total:
+            st.progress(
+                min(job[stage] / chunks_total, 1.0),
+                text=f"{label}：{job[stage]}/{chunks_label}"
+            )
+        else:
+            st.progress(0.0, text=f"{label}：等待切分完成")
+    
+    if job["state"] == "queued":
+        st.caption("排隊中，等待其他建立工作完成...")
+        return
+    caption = f"已執行 {job['elapsed']:.0f} 秒 · {job['chunks_per_second']:.1f} 片段/秒"
+    if job["state"] == "saving":
+        caption += " · 正在保存資料庫..."
+    elif job["eta"] is not None:
+        caption += f" · 預計剩餘 {job['eta']:.0f} 秒"
+    st.caption(caption)
+
+
+# Load the embedding model once per process; later reruns reuse it
+if EMBEDDING_WARMUP:
+    with st.spinner("正在載入嵌入模型..."):
+        get_shared_embeddings()
+
 st.title("📚 RAG 文件問答系統")
 st.markdown("""
 基於向量資料庫的文件問答系統，使用 Google 的 EmbeddingGemma 模型和 Gemini 2.5 Flash。
@@ -65,6 +193,42 @@ with st.sidebar:
         options=["建立新資料庫", "載入現有資料庫"],
         help="建立新資料庫或從本地載入已保存的資料庫"
     )
+    
+    with st.expander("📈 答案快取統計"):
+        cache_stats = get_answer_cache().stats()
+        st.metric("命中率", f"{cache_stats['hit_rate']:.0%}")
+        st.metric("節省的 LLM 時間", f"{cache_stats['latency_saved_seconds']:.1f} 秒")
+        st.caption(
+            f"完全相符 {cache_stats['exact_hits']} · 語意相近 {cache_stats['semantic_hits']} · "
+            f"未命中 {cache_stats['misses']}"
+        )
+    
+    with st.expander("🖥️ 記憶體使用（本 Pod）"):
+        memory = metrics.process_memory_mb()
+        if memory["rss"] is not None:
+            st.metric("常駐記憶體", f"{memory['rss']:.0f} MB")
+        if memory["peak_rss"] is not None:
+            st.caption(f"峰值 {memory['peak_rss']:.0f} MB")
+        footprint = load_db_metadata("faiss_db").get("footprint")
+        if footprint:
+            st.caption(
+                f"共用資料庫：{footprint['count']} 個片段，"
+                f"向量索引 {footprint['bytes'] / 2**20:.1f} MB（所有工作階段共用一份）"
+            )
+    
+    with st.expander("⏱️ 各階段延遲"):
+        for label, name in [
+            ("查詢嵌入", "embedding_seconds"),
+            ("檢索", "retrieval_seconds"),
+            ("重新排序", "rerank_seconds"),
+            ("生成答案", "generation_seconds"),
+        ]:
+            stage = metrics.summary(name)
+            if stage["count"]:
+                st.caption(
+                    f"{label}：平均 {stage['mean'] * 1000:.0f} ms · "
+                    f"p95 {stage['p95'] * 1000:.0f} ms（{stage['count']} 次）"
+                )
 
 
 # ============================================================================
@@ -77,6 +241,22 @@ if 'vectorstore' not in st.session_state:
 if 'db_created' not in st.session_state:
     st.session_state['db_created'] = False
 
+# Version of the shared faiss_db store this session uses (None: private store)
+if 'db_version' not in st.session_state:
+    st.session_state['db_version'] = None
+
+# Hot reload: follow the saved database when another session re-saves it.
+# Saves swap the directory in whole, so any version listed is complete.
+if st.session_state['db_version'] is not None:
+    current_version = get_db_version("faiss_db")
+    if current_version is not None and current_version != st.session_state['db_version']:
+        try:
+            st.session_state['vectorstore'] = get_shared_vectorstore("faiss_db", current_version)
+            st.session_state['db_version'] = current_version
+            st.toast("🔄 已載入更新後的資料庫")
+        except Exception as e:
+            st.warning(f"⚠️ 重新載入資料庫失敗，繼續使用目前版本：{str(e)}")
+
 
 # ============================================================================
 # Main Application Layout
@@ -108,7 +288,7 @@ with tab1:
             for file in uploaded_files:
                 st.write(f"- {file.name} ({file.size} bytes)")
         
-        col1, col2 = st.columns([1, 1])
+        col1, col2, col3 = st.columns([1, 1, 1])
         
         with col1:
             if st.button("🔨 建立向量資料庫", use_container_width=True, type="primary"):
@@ -117,28 +297,54 @@ with tab1:
                 elif not hf_token:
                     st.error("請輸入 HuggingFace Token。")
                 else:
-                    with st.spinner("正在處理文件並建立資料庫..."):
-                        try:
-                            st.session_state['vectorstore'] = create_vector_store(
-                                uploaded_files,
-                                hf_token
-                            )
-                            st.session_state['db_created'] = True
-                            st.success("✅ 向量資料庫建立成功！")
-                            st.balloons()
-                        except Exception as e:
-                            st.error(f"❌ 建立資料庫時出錯：{str(e)}")
+                    # Runs in the background and saves to faiss_db when done;
+                    # the job id in the URL lets a refreshed page re-attach
+                    job_id = submit_ingest_job(uploaded_files, hf_token)
+                    st.session_state['ingest_job'] = job_id
+                    st.query_params["job"] = job_id
         
         with col2:
             if st.button("💾 保存資料庫", use_container_width=True):
-                if st.session_state['vectorstore'] is not None:
+                if st.session_state['vectorstore'] is None:
+                    st.warning("⚠️ 請先建立向量資料庫。")
+                elif st.session_state['db_version'] is not None:
+                    # Still the shared store loaded from faiss_db: nothing new to save
+                    st.info("ℹ️ 資料庫沒有未保存的變更。")
+                else:
                     try:
+                        # Written to a staging directory and swapped in whole, so
+                        # other sessions only see the new version once it is complete
                         save_vectorstore(st.session_state['vectorstore'], "faiss_db")
                         st.success("✅ 資料庫已保存！")
                     except Exception as e:
                         st.error(f"❌ 保存資料庫時出錯：{str(e)}")
+        
+        with col3:
+            if st.button("➕ 加入現有資料庫", use_container_width=True):
+                if st.session_state['vectorstore'] is None:
+                    st.warning("⚠️ 請先建立或載入向量資料庫。")
+                elif not uploaded_files:
+                    st.error("請先選擇至少一個文件。")
                 else:
-                    st.warning("⚠️ 請先建立向量資料庫。")
+                    with st.spinner("正在加入新文件..."):
+                        try:
+                            load_errors = []
+                            stage_counts = Counter()
+                            added, skipped = add_documents_to_vectorstore(
+                                make_private_vectorstore(),
+                                uploaded_files,
+                                errors=load_errors,
+                                progress=lambda stage, count: stage_counts.update({stage: count})
+                            )
+                            st.success(
+                                f"✅ 已加入 {len(added)} 個文件，"
+                                f"略過 {len(skipped)} 個未變更的文件，"
+                                f"移除 {stage_counts['deduplicated']} 個重複片段。"
+                            )
+                            for source, message in load_errors:
+                                st.warning(f"⚠️ 無法載入 {source}：{message}")
+                        except Exception as e:
+                            st.error(f"❌ 加入文件時出錯：{str(e)}")
     
     else:  # Load existing database
         st.markdown("### 載入已保存的向量資料庫")
@@ -147,7 +353,8 @@ with tab1:
             if st.button("📂 載入 faiss_db 資料庫", use_container_width=True, type="primary"):
                 with st.spinner("正在載入資料庫..."):
                     try:
-                        st.session_state['vectorstore'] = load_vectorstore("faiss_db")
+                        # Shared by all sessions; loaded from disk only once per version
+                        use_shared_vectorstore()
                         st.session_state['db_created'] = True
                         st.success("✅ 資料庫載入成功！")
                     except Exception as e:
@@ -155,6 +362,61 @@ with tab1:
         else:
             st.info("ℹ️ 未找到已保存的資料庫。請先建立新資料庫。")
     
+    # Background ingestion job of this session
+    poll_ingest_job = False
+    job_id = st.session_state.get('ingest_job') or st.query_params.get("job")
+    job = get_job(job_id) if job_id else None
+    if job is not None:
+        st.markdown("---")
+        if job["state"] == "done":
+            if st.session_state.get('ingest_loaded') != job_id:
+                # The job saved to faiss_db; use it as the shared store
+                try:
+                    use_shared_vectorstore()
+                    st.session_state['db_created'] = True
+                    st.session_state['ingest_loaded'] = job_id
+                    st.balloons()
+                except Exception as e:
+                    st.error(f"❌ 載入資料庫時出錯：{str(e)}")
+            st.success(
+                f"✅ 向量資料庫建立成功並已保存！共 {job['indexed']} 個片段"
+                f"（移除重複 {job['deduplicated']} 個），耗時 {job['elapsed']:.0f} 秒。"
+            )
+        elif job["state"] == "failed":
+            st.error(f"❌ 建立資料庫時出錯：{job['error']}")
+        else:
+            render_ingest_job(job)
+            # Keep refreshing while there is nothing to query yet; otherwise
+            # leave the page alone so answers are not cleared by reruns
+            poll_ingest_job = st.session_state['vectorstore'] is None
+            st.button("🔄 更新進度", use_container_width=True)
+        for source, message in job["load_errors"]:
+            st.warning(f"⚠️ 無法載入 {source}：{message}")
+    
+    # Manage indexed documents
+    if st.session_state['vectorstore'] is not None:
+        st.markdown("---")
+        st.markdown("### 管理已索引文件")
+        manifest = get_session_manifest()
+        
+        if manifest and not supports_removal(st.session_state['vectorstore'].index):
+            st.caption(f"已索引 {len(manifest)} 個文件。HNSW 索引不支援移除文件，如需移除請重新建立資料庫。")
+        elif manifest:
+            source_to_remove = st.selectbox(
+                "選擇要移除的文件：",
+                options=sorted(manifest),
+                format_func=lambda source: f"{source} ({len(manifest[source]['chunk_ids'])} 個片段)"
+            )
+            if st.button("🗑️ 移除文件", use_container_width=True):
+                try:
+                    removed = remove_source_from_vectorstore(
+                        make_private_vectorstore(),
+                        source_to_remove
+                    )
+                    st.success(f"✅ 已移除 {removed} 個片段，請記得保存資料庫。")
+                except Exception as e:
+                    st.error(f"❌ 移除文件時出錯：{str(e)}")
+    
     # Display database status
     st.markdown("---")
     st.markdown("### 資料庫狀態")
@@ -198,41 +460,66 @@ with tab2:
             if not llm_api_key:
                 st.error("❌ 請在側邊欄輸入 Google API Key。")
             else:
-                with st.spinner("正在檢索並生成答案..."):
-                    try:
-                        vectorstore = st.session_state['vectorstore']
-                        
-                        # Execute RAG query
-                        final_answer, retrieved_docs = query_rag(
-                            vectorstore,
-                            query,
-                            llm_api_key
-                        )
-                        
-                        # Display final answer
-                        st.markdown("---")
-                        st.subheader("🤖 最終答案")
-                        st.success(final_answer)
-                        
-                        # Display retrieved context
-                        st.subheader("📚 檢索到的文件片段 (Context)")
-                        
-                        if retrieved_docs:
-                            st.markdown(f"**找到 {len(retrieved_docs)} 個相關片段：**")
-                            
-                            for i, doc in enumerate(retrieved_docs, 1):
-                                source_info = doc.metadata.get('source', '未知文件')
-                                
-                                with st.expander(
-                                    f"📄 片段 {i} (來自: {source_info})",
-                                    expanded=(i == 1)
-                                ):
-                                    st.markdown(doc.page_content)
+                try:
+                    vectorstore = st.session_state['vectorstore']
+                    
+                    # Lay out the answer above the context; both are filled
+                    # in as the streaming query produces them
+                    st.markdown("---")
+                    st.subheader("🤖 最終答案")
+                    answer_placeholder = st.empty()
+                    answer_placeholder.info("正在檢索並生成答案...")
+                    timing_placeholder = st.empty()
+                    
+                    st.subheader("📚 檢索到的文件片段 (Context)")
+                    context_container = st.container()
+                    
+                    # Execute RAG query, rendering tokens as they arrive
+                    final_answer = ""
+                    query_stats = None
+                    for kind, value in query_rag_stream(vectorstore, query, llm_api_key):
+                        if kind == "docs":
+                            with context_container:
+                                if value:
+                                    st.markdown(f"**找到 {len(value)} 個相關片段：**")
+                                    
+                                    for i, doc in enumerate(value, 1):
+                                        # Deduplicated chunks list every file they appear in
+                                        source_info = "、".join(
+                                            doc.metadata.get('sources')
+                                            or [doc.metadata.get('source', '未知文件')]
+                                        )
+                                        
+                                        with st.expander(
+                                            f"📄 片段 {i} (來自: {source_info})",
+                                            expanded=(i == 1)
+                                        ):
+                                            st.markdown(doc.page_content)
+                                else:
+                                    st.info("ℹ️ 未檢索到相關文件片段。")
+                        elif kind == "token":
+                            final_answer += value
+                            answer_placeholder.success(final_answer)
                         else:
-                            st.info("ℹ️ 未檢索到相關文件片段。")
+                            query_stats = value
                     
-                    except Exception as e:
-                        st.error(f"❌ 執行查詢時出錯：{str(e)}")
+                    # Stats of this query; the process-wide metrics mix every session
+                    if query_stats and query_stats["time_to_first_token"] is not None:
+                        ttft = metrics.summary("time_to_first_token")
+                        caption = (
+                            f"⏱️ 首個字元延遲 {query_stats['time_to_first_token']:.2f} 秒"
+                            f"（平均 {ttft['mean']:.2f} 秒，共 {ttft['count']} 次）"
+                        )
+                        # Cached answers did not build a context this time
+                        if "context_tokens" in query_stats:
+                            caption += (
+                                f" · 上下文約 {query_stats['context_tokens']:.0f} tokens"
+                                f"（節省 {query_stats['context_tokens_saved']:.0f}）"
+                            )
+                        timing_placeholder.caption(caption)
+                
+                except Exception as e:
+                    st.error(f"❌ 執行查詢時出錯：{str(e)}")
         
         elif submit_button:
             st.warning("⚠️ 請輸入問題。")
@@ -256,3 +543,8 @@ st.markdown("""
     </small>
 </div>
 """, unsafe_allow_html=True)
+
+# Poll a running ingestion job (after everything has been rendered)
+if poll_ingest_job:
+    time.sleep(1)
+    st.rerun()
@@ -42,6 +42,366 @@ def test_embeddings():
         return False
 
 
+def test_embeddings_registry():
+    """Test that the embedding model is loaded once per process."""
+    print("\n🧪 測試嵌入模型註冊表...\n")
+    
+    try:
+        import threading
+        import embeddings
+        
+        load_calls = []
+        original_loader = embeddings._load_embeddings
+        
+        def fake_loader(model_name, device, normalize, dimension, backend):
+            load_calls.append((model_name, device, normalize, dimension, backend))
+            return CountingEmbeddings()
+        
+        embeddings._load_embeddings = fake_loader
+        embeddings.clear_embeddings_registry()
+        
+        try:
+            results = []
+            threads = [
+                threading.Thread(target=lambda: results.append(embeddings.get_embeddings()))
+                for _ in range(8)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            
+            assert len(load_calls) == 1, load_calls
+            assert all(result is results[0] for result in results)
+            print(f"✅ {len(threads)} 個執行緒共用同一個模型")
+            
+            embeddings.get_embeddings(device="cuda")
+            assert len(load_calls) == 2
+            other_backend = "onnx" if load_calls[0][-1] == "torch" else "torch"
+            embeddings.get_embeddings(backend=other_backend)
+            assert len(load_calls) == 3 and load_calls[-1][-1] == other_backend
+            print("✅ 不同設定（含推論後端）會載入不同模型")
+        finally:
+            embeddings._load_embeddings = original_loader
+            embeddings.clear_embeddings_registry()
+        
+        return True
+    
+    except Exception as e:
+        print(f"❌ 嵌入模型註冊表測試失敗: {str(e)}")
+        return False
+
+
+class FakeSentenceTransformer:
+    """Stand-in for a SentenceTransformer that records encoded texts."""
+    
+    def __init__(self, dim=8):
+        self.dim = dim
+        self.encoded = []
+    
+    def encode(self, texts, show_progress_bar=False, **kwargs):
+        import numpy as np
+        self.encoded.extend(texts)
+        return np.array(
+            [CountingEmbeddings(self.dim)._vector(text) for text in texts],
+            dtype=np.float32
+        )
+
+
+def test_embedding_cache():
+    """Test the persistent embedding cache."""
+    print("\n🧪 測試嵌入快取...\n")
+    
+    try:
+        import tempfile
+        from embedding_cache import EmbeddingCache
+        from embeddings import EmbeddingGemmaEmbeddings
+        
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            cache_path = os.path.join(tmp_dir, "cache.sqlite3")
+            client = FakeSentenceTransformer()
+            embeddings = EmbeddingGemmaEmbeddings.construct(
+                model_name="fake-model",
+                encode_kwargs={"normalize_embeddings": True},
+                show_progress=False,
+                client=client,
+                cache=EmbeddingCache(cache_path, max_entries=100)
+            )
+            
+            first = embeddings.embed_documents(["文件 1", "文件 2"])
+            assert len(client.encoded) == 2
+            
+            second = embeddings.embed_documents(["文件 1", "文件 2", "文件 3"])
+            assert len(client.encoded) == 3, client.encoded
+            assert client.encoded[-1] == "title: none | text: 文件 3"
+            assert second[:2] == first
+            print("✅ 只嵌入快取未命中的文件")
+            
+            stats = embeddings.cache.stats()
+            assert stats["hits"] == 2 and stats["misses"] == 3, stats
+            print(f"✅ 快取統計: {stats}")
+            
+            # Query embeddings bypass the cache and use the query prefix only
+            embeddings.embed_query("問題")
+            assert client.encoded[-1] == "task: search result | query: 問題"
+            print("✅ 查詢前綴正確")
+            
+            # Reopening the cache keeps entries across processes
+            reopened = EmbeddingCache(cache_path, max_entries=2)
+            reopened.put_many({"extra": [0.0] * 8})
+            assert len(reopened) == 2
+            print("✅ LRU 淘汰後保留 2 筆")
+            
+            embeddings.cache.close()
+            reopened.close()
+        
+        if "EMBEDDING_CACHE_PATH" not in os.environ:
+            from config import EMBEDDING_CACHE_PATH
+            assert os.path.dirname(os.path.abspath(EMBEDDING_CACHE_PATH)) != os.getcwd()
+            print(f"✅ 預設快取位於使用者快取目錄: {EMBEDDING_CACHE_PATH}")
+        
+        return True
+    
+    except Exception as e:
+        print(f"❌ 嵌入快取測試失敗: {str(e)}")
+        return False
+
+
+def test_matryoshka_dimension():
+    """Test Matryoshka truncation and the dimension check on load."""
+    print("\n🧪 測試 Matryoshka 維度截斷...\n")
+    
+    try:
+        import tempfile
+        import numpy as np
+        import vector_store
+        from embeddings import EmbeddingGemmaEmbeddings
+        
+        def make_embeddings(output_dim):
+            return EmbeddingGemmaEmbeddings.construct(
+                model_name="fake-model",
+                encode_kwargs={"normalize_embeddings": True},
+                show_progress=False,
+                client=FakeSentenceTransformer(dim=16),
+                output_dim=output_dim
+            )
+        
+        full = make_embeddings(768).embed_query("問題")
+        truncated = make_embeddings(8).embed_query("問題")
+        assert len(full) == 16 and len(truncated) == 8
+        assert abs(np.linalg.norm(truncated) - 1.0) < 1e-5
+        direction = np.array(full[:8]) / np.linalg.norm(full[:8])
+        assert np.allclose(truncated, direction, atol=1e-6)
+        print("✅ 截斷後重新正規化")
+        
+        assert make_embeddings(8)._cache_namespace() != make_embeddings(768)._cache_namespace()
+        print("✅ 嵌入快取依維度區分")
+        
+        try:
+            EmbeddingGemmaEmbeddings(output_dim=300)
+            assert False, "300 維應被拒絕"
+        except ValueError:
+            print("✅ 拒絕不支援的維度")
+        
+        embeddings = CountingEmbeddings()
+        original_get_embeddings = vector_store.get_embeddings
+        vector_store.get_embeddings = lambda: embeddings
+        
+        try:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                vectorstore = vector_store.create_vector_store(
+                    [FakeUploadedFile("a.txt", "文件內容。")],
+                    "",
+                    temp_dir=os.path.join(tmp_dir, "uploads")
+                )
+                save_path = os.path.join(tmp_dir, "columnar_db")
+                vector_store.save_vectorstore(vectorstore, save_path, db_format="columnar")
+                assert vector_store.load_db_metadata(save_path)["embedding_dim"] == 16
+                
+                embeddings.output_dim = 16
+                vector_store.load_vectorstore(save_path)
+                embeddings.output_dim = 8
+                try:
+                    vector_store.load_vectorstore(save_path)
+                    assert False, "維度不符時應拒絕載入"
+                except ValueError as e:
+                    print(f"✅ 維度不符時拒絕載入：{e}")
+        finally:
+            vector_store.get_embeddings = original_get_embeddings
+        
+        return True
+    
+    except Exception as e:
+        print(f"❌ Matryoshka 維度截斷測試失敗: {str(e)}")
+        return False
+
+
+class FakeOnnxSession:
+    """Stand-in for an onnxruntime session over a mean-pooling-free graph."""
+    
+    class _Node:
+        def __init__(self, name):
+            self.name = name
+    
+    def __init__(self, outputs=("sentence_embedding",)):
+        self.outputs = outputs
+        self.batch_lengths = []
+    
+    def get_inputs(self):
+        return [self._Node("input_ids"), self._Node("attention_mask")]
+    
+    def get_outputs(self):
+        return [self._Node(name) for name in self.outputs]
+    
+    def run(self, output_names, inputs):
+        import numpy as np
+        ids, mask = inputs["input_ids"], inputs["attention_mask"]
+        self.batch_lengths.append(ids.shape[1])
+        tokens = np.stack([ids * mask, mask, mask * 2], axis=2).astype(np.float32)
+        if self.outputs[0] == "sentence_embedding":
+            return [tokens.sum(axis=1)]
+        return [tokens]
+
+
+class FakeTokenizer:
+    """Stand-in for a padded tokenizers.Tokenizer (one token per character)."""
+    
+    class _Encoding:
+        def __init__(self, ids, attention_mask):
+            self.ids = ids
+            self.attention_mask = attention_mask
+    
+    def encode_batch(self, texts):
+        length = max(len(text) for text in texts)
+        return [
+            self._Encoding(
+                [ord(ch) % 97 + 1 for ch in text] + [0] * (length - len(text)),
+                [1] * len(text) + [0] * (length - len(text))
+            )
+            for text in texts
+        ]
+
+
+def test_onnx_encoder():
+    """Test the ONNX Runtime encoder used by the onnx embedding backend."""
+    print("\n🧪 測試 ONNX 嵌入後端...\n")
+    
+    try:
+        import numpy as np
+        from embeddings import EmbeddingGemmaEmbeddings
+        from onnx_embeddings import OnnxSentenceEncoder
+        
+        session = FakeOnnxSession()
+        encoder = OnnxSentenceEncoder(session, FakeTokenizer())
+        texts = ["長長長長長長長長", "短", "中中中", "短短"]
+        vectors = encoder.encode(texts, batch_size=2)
+        expected = np.stack([encoder.encode([text])[0] for text in texts])
+        assert np.allclose(vectors, expected)
+        assert session.batch_lengths[:2] == [2, 8], session.batch_lengths
+        print("✅ 依長度分批（減少 padding），輸出維持原順序")
+        
+        normalized = encoder.encode(texts, normalize_embeddings=True)
+        assert np.allclose(np.linalg.norm(normalized, axis=1), 1.0)
+        print("✅ 正規化輸出")
+        
+        pooled = OnnxSentenceEncoder(FakeOnnxSession(("last_hidden_state",)), FakeTokenizer())
+        assert np.allclose(pooled.encode(texts), vectors / [[len(t)] for t in texts])
+        print("✅ 無 sentence_embedding 輸出時使用 mean pooling")
+        
+        embeddings = EmbeddingGemmaEmbeddings.construct(
+            client=encoder,
+            backend="onnx",
+            encode_kwargs={"normalize_embeddings": True},
+            show_progress=False
+        )
+        query = embeddings.embed_query("問題")
+        assert np.allclose(
+            query, encoder.encode(["task: search result | query: 問題"], normalize_embeddings=True)[0]
+        )
+        print("✅ 查詢與文件前綴與 PyTorch 後端相同")
+        
+        # Without symlink rights (Windows), export_onnx copies the files
+        import tempfile
+        import types
+        import onnx_embeddings
+        
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            def fake_download(repo_id, file_name):
+                path = os.path.join(tmp_dir, "hub", file_name)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, "w", encoding="utf-8") as f:
+                    f.write(file_name)
+                return path
+            
+            def no_symlink(*args):
+                raise OSError("symbolic link privilege not held")
+            
+            original_hub = sys.modules.get("huggingface_hub")
+            original_symlink = os.symlink
+            sys.modules["huggingface_hub"] = types.SimpleNamespace(hf_hub_download=fake_download)
+            os.symlink = no_symlink
+            try:
+                model_dir = os.path.join(tmp_dir, "onnx")
+                onnx_embeddings.export_onnx(model_dir)
+            finally:
+                os.symlink = original_symlink
+                if original_hub is None:
+                    del sys.modules["huggingface_hub"]
+                else:
+                    sys.modules["huggingface_hub"] = original_hub
+            
+            tokenizer_path = os.path.join(model_dir, onnx_embeddings.TOKENIZER_FILE_NAME)
+            assert not os.path.islink(tokenizer_path)
+            with open(tokenizer_path, encoding="utf-8") as f:
+                assert f.read() == onnx_embeddings.TOKENIZER_FILE_NAME
+        print("✅ 無法建立符號連結時改為複製模型檔案")
+        
+        return True
+    
+    except Exception as e:
+        print(f"❌ ONNX 嵌入後端測試失敗: {str(e)}")
+        return False
+
+
+def test_onnx_parity():
+    """Test that ONNX Runtime embeddings match the PyTorch model (cosine similarity)."""
+    print("\n🧪 測試 ONNX 與 PyTorch 嵌入一致性...\n")
+    
+    try:
+        import numpy as np
+        from config import EMBEDDING_ONNX_PATH
+        from embeddings import EmbeddingGemmaEmbeddings
+        from onnx_embeddings import OnnxSentenceEncoder
+        
+        texts = ["本公司的退貨政策規定商品須於收到後七日內申請退貨。", "The warranty covers defects."]
+        torch_embeddings = EmbeddingGemmaEmbeddings(
+            model_kwargs={"device": "cpu"},
+            show_progress=False
+        )
+        reference = np.array(
+            torch_embeddings.embed_documents(texts) + [torch_embeddings.embed_query("退貨期限？")]
+        )
+        
+        for quantized, threshold in [(False, 0.99), (True, 0.95)]:
+            embeddings = EmbeddingGemmaEmbeddings.construct(
+                client=OnnxSentenceEncoder.from_pretrained(EMBEDDING_ONNX_PATH, quantized=quantized),
+                encode_kwargs=torch_embeddings.encode_kwargs,
+                show_progress=False
+            )
+            actual = np.array(embeddings.embed_documents(texts) + [embeddings.embed_query("退貨期限？")])
+            cosine = (actual * reference).sum(axis=1) / (
+                np.linalg.norm(actual, axis=1) * np.linalg.norm(reference, axis=1)
+            )
+            assert cosine.min() >= threshold, cosine
+            print(f"✅ {'int8' if quantized else 'fp32'} ONNX 最低餘弦相似度 {cosine.min():.4f}")
+        
+        return True
+    
+    except Exception as e:
+        print(f"❌ ONNX 一致性測試失敗: {str(e)}")
+        return False
+
+
 def test_rag_chain():
     """Test RAG chain structure."""
     print("\n🧪 測試 RAG 鏈...\n")
@@ -65,6 +425,526 @@ def test_rag_chain():
         return False
 
 
+try:
+    from langchain_core.embeddings import Embeddings as _Embeddings
+except ImportError:  # pragma: no cover - langchain not installed
+    _Embeddings = object
+
+
+class CountingEmbeddings(_Embeddings):
+    """Deterministic fake embeddings that count every embedding call."""
+    
+    def __init__(self, dim=16):
+        self.dim = dim
+        self.query_calls = 0
+        self.document_calls = 0
+    
+    def _vector(self, text):
+        import hashlib
+        digest = hashlib.sha256(text.encode("utf-8")).digest()
+        return [b / 255.0 for b in digest[:self.dim]]
+    
+    def embed_documents(self, texts):
+        self.document_calls += 1
+        return [self._vector(text) for text in texts]
+    
+    def embed_query(self, text):
+        self.query_calls += 1
+        return self._vector(text)
+
+
+def test_single_retrieval():
+    """Test that a RAG query embeds and searches the query only once."""
+    print("\n🧪 測試單次檢索...\n")
+    
+    try:
+        from langchain.vectorstores import FAISS
+        from langchain_community.chat_models.fake import FakeListChatModel
+        import rag_chain
+        
+        embeddings = CountingEmbeddings()
+        vectorstore = FAISS.from_texts(
+            ["文件 A", "文件 B", "文件 C", "文件 D", "文件 E"],
+            embeddings
+        )
+        
+        searches = []
+        original_search = vectorstore.index.search
+        vectorstore.index.search = lambda *args: searches.append(1) or original_search(*args)
+        
+        llm = FakeListChatModel(responses=["答案"] * 10)
+        original_llm = rag_chain.ChatGoogleGenerativeAI
+        rag_chain.ChatGoogleGenerativeAI = lambda **kwargs: llm
+        rag_chain.clear_chain_pool()
+        rag_chain.get_answer_cache().clear()
+        
+        try:
+            answer, docs = rag_chain.query_rag(vectorstore, "這是測試查詢", "key")
+            assert answer == "答案"
+            assert len(docs) == 4
+            assert embeddings.query_calls == 1, embeddings.query_calls
+            assert len(searches) == 1, len(searches)
+            print(f"✅ query_rag 每次查詢嵌入 {embeddings.query_calls} 次")
+            
+            parts = list(rag_chain.query_rag_stream(vectorstore, "另一個測試查詢", "key"))
+            assert parts[0][0] == "docs" and len(parts[0][1]) == 4
+            assert embeddings.query_calls == 2, embeddings.query_calls
+            assert len(searches) == 2, len(searches)
+            print("✅ query_rag_stream 每次查詢嵌入 1 次")
+        finally:
+            rag_chain.ChatGoogleGenerativeAI = original_llm
+            rag_chain.clear_chain_pool()
+            rag_chain.get_answer_cache().clear()
+        
+        return True
+    
+    except Exception as e:
+        print(f"❌ 單次檢索測試失敗: {str(e)}")
+        return False
+
+
+def test_answer_cache():
+    """Test the answer cache in front of the LLM step."""
+    print("\n🧪 測試答案快取...\n")
+    
+    try:
+        from langchain.vectorstores import FAISS
+        from langchain_community.chat_models.fake import FakeListChatModel
+        import rag_chain
+        from answer_cache import AnswerCache
+        
+        embeddings = CountingEmbeddings()
+        vectorstore = FAISS.from_texts(["文件 A", "文件 B", "文件 C"], embeddings)
+        
+        llm = FakeListChatModel(responses=["答案"] * 10)
+        original_llm = rag_chain.ChatGoogleGenerativeAI
+        rag_chain.ChatGoogleGenerativeAI = lambda **kwargs: llm
+        rag_chain.clear_chain_pool()
+        rag_chain.get_answer_cache().clear()
+        
+        try:
+            answer, docs = rag_chain.query_rag(vectorstore, "退貨政策是什麼？", "key")
+            assert answer == "答案" and len(docs) == 3
+            assert embeddings.query_calls == 1
+            
+            rag_chain.query_rag(vectorstore, "  退貨政策是什麼 ", "key")
+            assert llm.i == 1 and embeddings.query_calls == 1
+            print("✅ 正規化後完全相符的問題直接命中")
+            
+            rag_chain.query_rag(vectorstore, "換貨政策是什麼？", "key")
+            assert llm.i == 2
+            
+            vectorstore.add_texts(["文件 D"])
+            rag_chain.query_rag(vectorstore, "退貨政策是什麼？", "key")
+            assert llm.i == 3
+            print("✅ 資料庫變更後快取失效")
+        finally:
+            rag_chain.ChatGoogleGenerativeAI = original_llm
+            rag_chain.clear_chain_pool()
+            rag_chain.get_answer_cache().clear()
+        
+        cache = AnswerCache()
+        cache.put("退貨政策", [1.0, 0.0], "store", "答一", [], latency=2.0)
+        assert cache.get_similar([1.0, 0.0], "store") is None
+        assert cache.get_exact("退貨政策？", "store") == ("答一", [])
+        print("✅ 預設只做完全比對")
+        
+        cache = AnswerCache(similarity_threshold=0.9, max_entries=2)
+        cache.put("問題一", [1.0, 0.0], "store", "答一", [], latency=2.0)
+        assert cache.get_similar([0.99, 0.05], "store") == ("答一", [])
+        assert cache.get_similar([0.0, 1.0], "store") is None
+        assert cache.get_similar([1.0, 0.0], "other store") is None
+        cache.put("問題二", [0.0, 1.0], "store", "答二", [], latency=1.0)
+        cache.put("問題三", [0.7, 0.7], "store", "答三", [], latency=1.0)
+        assert cache.get_exact("問題一", "store") is None
+        stats = cache.stats()
+        assert stats["semantic_hits"] == 1 and stats["latency_saved_seconds"] == 2.0, stats
+        print(f"✅ 語意命中與 LRU 淘汰: {stats}")
+        
+        return True
+    
+    except Exception as e:
+        print(f"❌ 答案快取測試失敗: {str(e)}")
+        return False
+
+
+def test_chain_pool():
+    """Test that the LLM client and chain are reused across queries."""
+    print("\n🧪 測試 LLM 連線池...\n")
+    
+    try:
+        from langchain.vectorstores import FAISS
+        from langchain_community.chat_models.fake import FakeListChatModel
+        import rag_chain
+        
+        vectorstore = FAISS.from_texts(["文件 A", "文件 B"], CountingEmbeddings())
+        
+        constructed = []
+        original_llm = rag_chain.ChatGoogleGenerativeAI
+        rag_chain.ChatGoogleGenerativeAI = lambda **kwargs: (
+            constructed.append(kwargs) or FakeListChatModel(responses=["答案"] * 10)
+        )
+        rag_chain.clear_chain_pool()
+        rag_chain.get_answer_cache().clear()
+        
+        try:
+            for query in ["問題一", "問題二", "問題三"]:
+                rag_chain.query_rag(vectorstore, query, "key-a")
+            assert len(constructed) == 1, constructed
+            print("✅ 同一組設定只建立一次 LLM 客戶端")
+            
+            rag_chain.query_rag(vectorstore, "問題四", "key-b")
+            assert len(constructed) == 2
+            assert rag_chain.get_answer_chain("key-a") is rag_chain.get_answer_chain("key-a")
+            print("✅ 不同 API Key 使用不同客戶端")
+        finally:
+            rag_chain.ChatGoogleGenerativeAI = original_llm
+            rag_chain.clear_chain_pool()
+            rag_chain.get_answer_cache().clear()
+        
+        # Real Gemini clients: building a chain for key B must not move
+        # the not yet used chain of key A onto key B
+        try:
+            import asyncio
+            chain_a = rag_chain.get_answer_chain("key-a")
+            chain_b = rag_chain.get_answer_chain("key-b")
+            
+            def client_keys(chain):
+                model = chain.steps[2].client
+                
+                async def async_key():
+                    return model._async_client._client._transport._credentials.token
+                
+                return model._client._transport._credentials.token, asyncio.run(async_key())
+            
+            assert client_keys(chain_a) == ("key-a", "key-a")
+            assert client_keys(chain_b) == ("key-b", "key-b")
+            print("✅ 每個客戶端綁定自己的 API Key（同步與非同步）")
+        finally:
+            rag_chain.clear_chain_pool()
+        
+        return True
+    
+    except Exception as e:
+        print(f"❌ LLM 連線池測試失敗: {str(e)}")
+        return False
+
+
+def test_streaming_query():
+    """Test that the streaming query yields docs first, then answer tokens."""
+    print("\n🧪 測試串流回答...\n")
+    
+    try:
+        from langchain.vectorstores import FAISS
+        from langchain_community.chat_models.fake import FakeListChatModel
+        import metrics
+        import rag_chain
+        
+        vectorstore = FAISS.from_texts(["文件 A", "文件 B"], CountingEmbeddings())
+        
+        original_llm = rag_chain.ChatGoogleGenerativeAI
+        rag_chain.ChatGoogleGenerativeAI = lambda **kwargs: FakeListChatModel(
+            responses=["這是串流答案"]
+        )
+        rag_chain.clear_chain_pool()
+        rag_chain.get_answer_cache().clear()
+        metrics.reset()
+        
+        try:
+            events = list(rag_chain.query_rag_stream(vectorstore, "問題", "key"))
+            kinds = [kind for kind, _ in events]
+            assert kinds[0] == "docs" and len(events[0][1]) == 2
+            assert set(kinds[1:-1]) == {"token"} and len(kinds) > 3, kinds
+            assert "".join(value for kind, value in events[1:-1]) == "這是串流答案"
+            print(f"✅ 先回傳文件，再回傳 {len(kinds) - 2} 個片段")
+            
+            kind, stats = events[-1]
+            assert kind == "stats" and not stats["cached"]
+            assert stats["time_to_first_token"] == metrics.summary("time_to_first_token")["last"]
+            assert stats["context_tokens"] == metrics.summary("context_tokens")["last"] > 0
+            print("✅ 最後回傳本次查詢的首個字元延遲與上下文 tokens")
+            
+            answer, _ = rag_chain.query_rag(vectorstore, "問題", "key")
+            assert answer == "這是串流答案"
+            print("✅ 串流答案已寫入快取")
+            
+            kind, stats = list(rag_chain.query_rag_stream(vectorstore, "問題", "key"))[-1]
+            assert kind == "stats" and stats["cached"]
+            assert "context_tokens" not in stats
+            print("✅ 快取命中時不回報上下文 tokens")
+        finally:
+            rag_chain.ChatGoogleGenerativeAI = original_llm
+            rag_chain.clear_chain_pool()
+            rag_chain.get_answer_cache().clear()
+        
+        return True
+    
+    except Exception as e:
+        print(f"❌ 串流回答測試失敗: {str(e)}")
+        return False
+
+
+def test_batch_search():
+    """Test that batched search matches per-query search with one embedding batch."""
+    print("\n🧪 測試批次向量搜尋...\n")
+    
+    try:
+        from langchain.vectorstores import FAISS
+        from vector_store import similarity_search_batch
+        
+        class BatchCountingEmbeddings(CountingEmbeddings):
+            def embed_queries(self, texts):
+                self.query_calls += 1
+                return [self._vector(text) for text in texts]
+        
+        embeddings = BatchCountingEmbeddings()
+        texts = [f"文件 {i}" for i in range(20)]
+        vectorstore = FAISS.from_texts(texts, embeddings)
+        queries = ["文件 3", "問題 A", "文件 17"]
+        
+        embeddings.query_calls = 0
+        results = similarity_search_batch(vectorstore, queries, k=5)
+        assert embeddings.query_calls == 1
+        assert len(results) == len(queries) and all(len(hits) == 5 for hits in results)
+        print("✅ 所有查詢只進行一次批次嵌入")
+        
+        for query, hits in zip(queries, results):
+            expected = vectorstore.similarity_search_with_score(query, k=5)
+            assert [doc.page_content for doc, _ in hits] == [doc.page_content for doc, _ in expected]
+            assert all(abs(a - b) < 1e-5 for (_, a), (_, b) in zip(hits, expected))
+        assert results[0][0][0].page_content == "文件 3" and results[0][0][1] < 1e-6
+        print("✅ 批次結果與逐一查詢一致（含分數）")
+        
+        assert similarity_search_batch(vectorstore, [], k=5) == []
+        print("✅ 空查詢列表回傳空結果")
+        
+        return True
+    
+    except Exception as e:
+        print(f"❌ 批次向量搜尋測試失敗: {str(e)}")
+        return False
+
+
+def test_batch_query():
+    """Test batched retrieval, ordering and rate-limit retries in query_rag_batch."""
+    print("\n🧪 測試批次問答...\n")
+    
+    try:
+        import asyncio
+        from langchain.vectorstores import FAISS
+        from langchain_core.runnables import RunnableLambda
+        import rag_chain
+        
+        class BatchCountingEmbeddings(CountingEmbeddings):
+            def embed_queries(self, texts):
+                self.query_calls += 1
+                return [self._vector(text) for text in texts]
+        
+        embeddings = BatchCountingEmbeddings()
+        vectorstore = FAISS.from_texts(["文件 A", "文件 B", "文件 C"], embeddings)
+        
+        calls = {"count": 0}
+        
+        async def fake_llm(prompt_value):
+            calls["count"] += 1
+            if calls["count"] == 1:
+                raise Exception("429 Resource has been exhausted")
+            question = prompt_value.to_string().rsplit("Question:", 1)[-1]
+            return f"答案 {question.split()[0]}"
+        
+        original_llm = rag_chain.ChatGoogleGenerativeAI
+        rag_chain.ChatGoogleGenerativeAI = lambda **kwargs: RunnableLambda(
+            lambda prompt_value: None, afunc=fake_llm
+        )
+        rag_chain.clear_chain_pool()
+        
+        try:
+            queries = ["Q1", "Q2", "Q3", "Q4"]
+            results = asyncio.run(rag_chain.query_rag_batch(
+                vectorstore, queries, "key", concurrency=2, max_retries=2
+            ))
+            assert [answer for answer, _ in results] == [f"答案 {q}" for q in queries], results
+            assert all(len(docs) == 3 for _, docs in results)
+            print("✅ 答案順序與問題一致")
+            
+            assert embeddings.query_calls == 1
+            print("✅ 所有問題只進行一次批次嵌入")
+            
+            assert calls["count"] == len(queries) + 1
+            print("✅ 速率限制錯誤已重試")
+        finally:
+            rag_chain.ChatGoogleGenerativeAI = original_llm
+            rag_chain.clear_chain_pool()
+        
+        return True
+    
+    except Exception as e:
+        print(f"❌ 批次問答測試失敗: {str(e)}")
+        return False
+
+
+def test_reranking():
+    """Test cross-encoder reranking, its score cache and per-stage timing."""
+    print("\n🧪 測試重新排序...\n")
+    
+    try:
+        from langchain.vectorstores import FAISS
+        from langchain_community.chat_models.fake import FakeListChatModel
+        import metrics
+        import rag_chain
+        from reranker import CrossEncoderReranker
+        
+        class FakeCrossEncoder:
+            """Scores a pair by the number of query characters in the passage."""
+            
+            def __init__(self):
+                self.calls = []
+            
+            def predict(self, pairs, batch_size=32):
+                self.calls.append(len(pairs))
+                return [sum(ch in passage for ch in set(query)) for query, passage in pairs]
+        
+        texts = [f"無關片段 {i}" for i in range(10)] + ["退貨須於七日內申請", "七日內退貨"]
+        vectorstore = FAISS.from_texts(texts, CountingEmbeddings())
+        model = FakeCrossEncoder()
+        reranker = CrossEncoderReranker(model)
+        
+        original = (rag_chain.RERANK_ENABLED, rag_chain.get_reranker, rag_chain.ChatGoogleGenerativeAI)
+        rag_chain.RERANK_ENABLED = True
+        rag_chain.get_reranker = lambda: reranker
+        rag_chain.ChatGoogleGenerativeAI = lambda **kwargs: FakeListChatModel(responses=["答案"])
+        rag_chain.clear_chain_pool()
+        rag_chain.get_answer_cache().clear()
+        metrics.reset()
+        
+        try:
+            _, docs = rag_chain.query_rag(vectorstore, "退貨要在幾日內申請", "key")
+            assert len(docs) == rag_chain.RERANK_TOP_K
+            assert docs[0].page_content == "退貨須於七日內申請", docs
+            assert model.calls == [len(texts)], model.calls
+            print(f"✅ 從 {len(texts)} 個候選中保留 {len(docs)} 個片段，單次批次評分")
+            
+            reranker.score("退貨要在幾日內申請", docs)
+            assert model.calls == [len(texts)] and reranker.hits == len(docs)
+            print("✅ (問題, 片段) 分數已快取")
+            
+            for name in ["embedding_seconds", "retrieval_seconds", "rerank_seconds", "generation_seconds"]:
+                assert metrics.summary(name)["count"] == 1, name
+            print("✅ 已記錄各階段延遲")
+        finally:
+            rag_chain.RERANK_ENABLED, rag_chain.get_reranker, rag_chain.ChatGoogleGenerativeAI = original
+            rag_chain.clear_chain_pool()
+            rag_chain.get_answer_cache().clear()
+        
+        return True
+    
+    except Exception as e:
+        print(f"❌ 重新排序測試失敗: {str(e)}")
+        return False
+
+
+def test_cjk_splitter():
+    """Test the sentence-aware, token-sized CJK text splitter."""
+    print("\n🧪 測試中文切分器...\n")
+    
+    try:
+        from cjk_splitter import CJKTextSplitter
+        from context_builder import estimate_tokens
+        
+        sentences = [f"第{i}條規定員工須於每月五日前提交報告並經主管核准。" for i in range(40)]
+        text = "".join(sentences)  # no spaces or line breaks at all
+        splitter = CJKTextSplitter(chunk_size=100, chunk_overlap=30)
+        chunks = splitter.split_text(text)
+        
+        assert len(chunks) > 1
+        assert all(estimate_tokens(chunk) <= 100 for chunk in chunks)
+        assert all(chunk.endswith("。") for chunk in chunks)
+        assert all(any(sentence in chunk for chunk in chunks) for sentence in sentences)
+        print(f"✅ {len(chunks)} 個片段，皆在句號處結束且不超過 100 tokens")
+        
+        for previous, current in zip(chunks, chunks[1:]):
+            first_sentence = current[:current.index("。") + 1]
+            assert previous.endswith(first_sentence)
+        print("✅ 相鄰片段以完整句子重疊")
+        
+        mixed = "The warranty covers defects. Version 3.5 is supported!\n\n保固兩年；逾期不受理。"
+        assert CJKTextSplitter(chunk_size=12, chunk_overlap=0).split_text(mixed) == [
+            "The warranty covers defects.",
+            "Version 3.5 is supported!",
+            "保固兩年；逾期不受理。",
+        ]
+        print("✅ 中英混合文字於句界切分，不切開 3.5")
+        
+        long_sentence = "沒有標點的超長段落" * 30
+        pieces = CJKTextSplitter(chunk_size=50, chunk_overlap=10).split_text(long_sentence)
+        assert "".join(pieces) == long_sentence
+        assert all(estimate_tokens(piece) <= 50 for piece in pieces)
+        
+        by_chars = CJKTextSplitter(chunk_size=60, chunk_overlap=0, length_function=len)
+        assert all(len(chunk) <= 60 for chunk in by_chars.split_text(text))
+        
+        # Latin text is cut by the custom function, not the token estimate
+        unbroken = "x" * 500
+        pieces = by_chars.split_text(unbroken)
+        assert "".join(pieces) == unbroken
+        assert [len(piece) for piece in pieces] == [60] * 8 + [20]
+        print("✅ 超長句子強制切分，並支援自訂長度函式")
+        
+        return True
+    
+    except Exception as e:
+        print(f"❌ 中文切分器測試失敗: {str(e)}")
+        return False
+
+
+def test_context_builder():
+    """Test merging, deduplication and the token budget of the context builder."""
+    print("\n🧪 測試上下文組裝...\n")
+    
+    try:
+        from langchain.text_splitter import RecursiveCharacterTextSplitter
+        from langchain_core.documents import Document
+        from context_builder import build_context, estimate_tokens
+        import metrics
+        from rag_chain import format_docs
+        
+        text = "".join(f"第{i}條規定內容說明。" for i in range(40))
+        splitter = RecursiveCharacterTextSplitter(chunk_size=100, chunk_overlap=30, separators=["。", ""])
+        chunks = [
+            Document(page_content=chunk, metadata={"source": "a.txt"})
+            for chunk in splitter.split_text(text)
+        ]
+        other = Document(page_content="另一份文件的內容。" * 5, metadata={"source": "b.txt"})
+        docs = [chunks[2], other, chunks[3], chunks[2]]
+        
+        context, stats = build_context(docs)
+        passages = context.split("\n\n---\n\n")
+        assert len(passages) == 2 and stats["merged"] == 2, stats
+        assert passages[0] in text and chunks[2].page_content in passages[0] and chunks[3].page_content in passages[0]
+        print(f"✅ 重疊片段已合併（{stats['chunks']} 個片段 → {stats['passages']} 段）")
+        
+        near_duplicate = Document(page_content=other.page_content + "。", metadata={"source": "c.txt"})
+        _, stats = build_context([other, near_duplicate])
+        assert stats["duplicates"] == 1 and stats["passages"] == 1
+        print("✅ 近似重複段落已移除")
+        
+        context, stats = build_context(docs, token_budget=60)
+        assert estimate_tokens(context) <= 60 and stats["dropped"] == 1
+        assert stats["saved_tokens"] == stats["input_tokens"] - stats["context_tokens"] > 0
+        print(f"✅ 符合 token 預算，節省約 {stats['saved_tokens']} tokens")
+        
+        metrics.reset()
+        format_docs(docs)
+        assert metrics.summary("context_tokens_saved")["count"] == 1
+        print("✅ 每次查詢記錄節省的 token 數")
+        
+        return True
+    
+    except Exception as e:
+        print(f"❌ 上下文組裝測試失敗: {str(e)}")
+        return False
+
+
 def test_vector_store():
     """Test vector store functions."""
     print("\n🧪 測試向量資料庫模組...\n")
@@ -85,6 +965,725 @@ def test_vector_store():
         return False
 
 
+class FakeUploadedFile:
+    """Minimal stand-in for Streamlit's UploadedFile."""
+    
+    def __init__(self, name, content):
+        self.name = name
+        if isinstance(content, str):
+            content = content.encode("utf-8")
+        self._content = content
+        self.size = len(self._content)
+    
+    def getbuffer(self):
+        return memoryview(self._content)
+    
+    def getvalue(self):
+        return self._content
+
+
+def minimal_pdf(text):
+    """Build a one-page PDF with a single line of (ASCII) text."""
+    stream = f"BT /F1 12 Tf 72 720 Td ({text}) Tj ET".encode("latin-1")
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents 4 0 R "
+        b"/Resources << /Font << /F1 5 0 R >> >> >>",
+        b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream",
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    pdf = b"%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(pdf))
+        pdf += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(pdf)
+    pdf += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    pdf += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    pdf += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (
+        len(objects) + 1, xref
+    )
+    return pdf
+
+
+def test_incremental_updates():
+    """Test adding and removing documents in an existing vector store."""
+    print("\n🧪 測試增量更新...\n")
+    
+    try:
+        import tempfile
+        import vector_store
+        
+        embeddings = CountingEmbeddings()
+        original_get_embeddings = vector_store.get_embeddings
+        vector_store.get_embeddings = lambda: embeddings
+        
+        try:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                temp_dir = os.path.join(tmp_dir, "uploads")
+                vectorstore = vector_store.create_vector_store(
+                    [FakeUploadedFile("a.txt", "第一份文件。" * 200)],
+                    "",
+                    temp_dir=temp_dir
+                )
+                chunks_a = len(vectorstore.index_to_docstore_id)
+                
+                added, skipped = vector_store.add_documents_to_vectorstore(
+                    vectorstore,
+                    [
+                        FakeUploadedFile("a.txt", "第一份文件。" * 200),
+                        FakeUploadedFile("b.txt", "第二份文件。")
+                    ],
+                    temp_dir=temp_dir
+                )
+                assert added == ["b.txt"] and skipped == ["a.txt"], (added, skipped)
+                assert vectorstore.index.ntotal == chunks_a + 1
+                print("✅ 未變更的文件已略過")
+                
+                save_path = os.path.join(tmp_dir, "faiss_db")
+                vector_store.save_vectorstore(vectorstore, save_path)
+                manifest = vector_store.load_manifest(save_path)
+                assert sorted(manifest) == ["a.txt", "b.txt"]
+                print("✅ 清單已保存")
+                
+                removed = vector_store.remove_source_from_vectorstore(vectorstore, "a.txt")
+                assert removed == chunks_a
+                assert vectorstore.index.ntotal == 1
+                assert list(vector_store.get_manifest(vectorstore)) == ["b.txt"]
+                print(f"✅ 已移除 {removed} 個片段")
+        finally:
+            vector_store.get_embeddings = original_get_embeddings
+        
+        return True
+    
+    except Exception as e:
+        print(f"❌ 增量更新測試失敗: {str(e)}")
+        return False
+
+
+def test_in_memory_uploads():
+    """Test parsing uploads from memory and spilling only when needed."""
+    print("\n🧪 測試記憶體內解析上傳檔案...\n")
+    
+    try:
+        import tempfile
+        import vector_store
+        
+        embeddings = CountingEmbeddings()
+        original_get_embeddings = vector_store.get_embeddings
+        vector_store.get_embeddings = lambda: embeddings
+        
+        try:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                spill_root = os.path.join(tmp_dir, "uploads")
+                errors = []
+                vectorstore = vector_store.create_vector_store(
+                    [
+                        FakeUploadedFile("notes.txt", "文件內容。" * 100),
+                        FakeUploadedFile("policy.pdf", minimal_pdf("Warranty covers two years")),
+                    ],
+                    "",
+                    temp_dir=spill_root,
+                    errors=errors
+                )
+                assert errors == []
+                assert not os.path.exists(spill_root)
+                pages = [
+                    doc for doc in vectorstore.docstore._dict.values()
+                    if doc.metadata["source"] == "policy.pdf"
+                ]
+                assert [(doc.page_content, doc.metadata["page"]) for doc in pages] == [
+                    ("Warranty covers two years", 0)
+                ]
+                print("✅ TXT 與 PDF 直接從記憶體解析，未寫入暫存目錄")
+                
+                # Word documents need a real path: spilled, then cleaned up
+                vector_store.add_documents_to_vectorstore(
+                    vectorstore,
+                    [FakeUploadedFile("report.docx", b"not a docx")],
+                    temp_dir=spill_root,
+                    errors=errors
+                )
+                assert [source for source, _ in errors] == ["report.docx"]
+                assert os.listdir(spill_root) == []
+                print("✅ DOCX 暫存於獨立目錄並已清除")
+        finally:
+            vector_store.get_embeddings = original_get_embeddings
+        
+        return True
+    
+    except Exception as e:
+        print(f"❌ 記憶體內解析測試失敗: {str(e)}")
+        return False
+
+
+def test_chunk_dedup():
+    """Test exact and near-duplicate chunk removal before embedding."""
+    print("\n🧪 測試重複片段移除...\n")
+    
+    try:
+        import tempfile
+        import metrics
+        import vector_store
+        from answer_cache import store_fingerprint
+        from chunk_dedup import ChunkDeduplicator
+        from langchain_core.documents import Document
+        
+        def chunk(text, source):
+            return Document(page_content=text, metadata={"source": source, "file_hash": source + "-hash"})
+        
+        text = "".join(f"第{i}條：員工須於每月{i % 28 + 1}日前提交第{i}號報告。" for i in range(12))
+        near = text.replace("第5號", "第6號")
+        other = "".join(f"資料備份第{i}次於凌晨{i % 5 + 1}點執行。" for i in range(20))
+        deduplicator = ChunkDeduplicator(threshold=0.9)
+        kept = deduplicator.filter([
+            chunk(text, "a.txt"),
+            chunk("  " + text + "\n", "b.txt"),
+            chunk(near, "c.txt"),
+            chunk(other, "c.txt"),
+        ])
+        assert [doc.page_content for doc in kept] == [text, other]
+        assert (deduplicator.exact_removed, deduplicator.near_removed) == (1, 1)
+        assert kept[0].metadata["sources"] == {
+            "a.txt": "a.txt-hash", "b.txt": "b.txt-hash", "c.txt": "c.txt-hash"
+        }
+        print("✅ 完全相同與近似重複片段皆被移除，並記錄所有來源")
+
+        # Only the last `window` kept chunks are remembered
+        deduplicator = ChunkDeduplicator(threshold=0.9, window=2)
+        kept = deduplicator.filter([
+            chunk(text, "a.txt"),
+            chunk(other, "a.txt"),
+            chunk("完全無關的第三段內容，用來擠出最舊的片段。", "a.txt"),
+            chunk(near, "b.txt"),
+            chunk("完全無關的第三段內容，用來擠出最舊的片段。", "b.txt"),
+        ])
+        assert [doc.page_content for doc in kept][-1] == near
+        assert len(kept) == 4 and deduplicator.removed == 1
+        assert len(deduplicator._exact) == 2
+        assert sum(len(bucket) for bucket in deduplicator._buckets) <= 2 * deduplicator.bands
+        print("✅ 比對視窗限制了記憶體用量")
+
+        embeddings = CountingEmbeddings()
+        original_get_embeddings = vector_store.get_embeddings
+        vector_store.get_embeddings = lambda: embeddings
+        
+        try:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                policy = "".join(
+                    f"第{i}條：員工須於每月{i % 28 + 1}日前提交第{i}號報告並經主管核准。"
+                    for i in range(60)
+                )
+                stage_counts = {}
+                vectorstore = vector_store.create_vector_store(
+                    [
+                        FakeUploadedFile("policy_v1.txt", policy),
+                        FakeUploadedFile("policy_v2.txt", policy.replace("第30號", "第31號")),
+                    ],
+                    "",
+                    temp_dir=os.path.join(tmp_dir, "uploads"),
+                    progress=lambda stage, count: stage_counts.update(
+                        {stage: stage_counts.get(stage, 0) + count}
+                    )
+                )
+                v1_chunks = stage_counts["split"] // 2
+                assert stage_counts["deduplicated"] == v1_chunks
+                assert (
+                    metrics.summary("dedup_exact_removed")["last"]
+                    + metrics.summary("dedup_near_removed")["last"]
+                ) == v1_chunks
+                assert vectorstore.index.ntotal == v1_chunks
+                manifest = vector_store.get_manifest(vectorstore)
+                assert manifest["policy_v1.txt"]["chunk_ids"] == manifest["policy_v2.txt"]["chunk_ids"]
+                print(f"✅ 第二版政策的 {v1_chunks} 個片段未重複嵌入")
+                
+                fingerprint = store_fingerprint(vectorstore)
+                assert vector_store.remove_source_from_vectorstore(vectorstore, "policy_v1.txt") == 0
+                assert store_fingerprint(vectorstore) != fingerprint
+                assert vectorstore.index.ntotal == v1_chunks
+                manifest = vector_store.get_manifest(vectorstore)
+                assert list(manifest) == ["policy_v2.txt"]
+                assert manifest["policy_v2.txt"]["file_hash"] == vector_store._file_hash(
+                    FakeUploadedFile("policy_v2.txt", policy.replace("第30號", "第31號"))
+                )
+                assert vector_store.remove_source_from_vectorstore(vectorstore, "policy_v2.txt") == v1_chunks
+                assert vectorstore.index.ntotal == 0
+                print("✅ 移除來源時保留仍屬於其他文件的共用片段，並使答案快取失效")
+        finally:
+            vector_store.get_embeddings = original_get_embeddings
+        
+        return True
+    
+    except Exception as e:
+        print(f"❌ 重複片段移除測試失敗: {str(e)}")
+        return False
+
+
+def test_ingest_jobs():
+    """Test building a vector store in a background ingestion job."""
+    print("\n🧪 測試背景建立資料庫...\n")
+    
+    try:
+        import tempfile
+        import time
+        import ingest_jobs
+        import vector_store
+        
+        embeddings = CountingEmbeddings()
+        original_get_embeddings = vector_store.get_embeddings
+        vector_store.get_embeddings = lambda: embeddings
+        
+        try:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                save_path = os.path.join(tmp_dir, "faiss_db")
+                files = [FakeUploadedFile(f"{i}.txt", f"文件 {i}。" * 300) for i in range(3)]
+                files.append(FakeUploadedFile("bad.pdf", b"not a pdf"))
+                job_id = ingest_jobs.submit_ingest_job(files, "", save_path=save_path)
+                
+                deadline = time.time() + 60
+                job = ingest_jobs.get_job(job_id)
+                while job["state"] not in (ingest_jobs.DONE, ingest_jobs.FAILED):
+                    assert time.time() < deadline, "job did not finish"
+                    time.sleep(0.05)
+                    job = ingest_jobs.get_job(job_id)
+                
+                assert job["state"] == ingest_jobs.DONE, job["error"]
+                assert job["parsed"] == job["files_total"] == 4
+                assert job["split"] - job["deduplicated"] == job["embedded"] > 0
+                assert job["embedded"] == job["indexed"] == job["chunks_total"]
+                assert [source for source, _ in job["load_errors"]] == ["bad.pdf"]
+                assert job["eta"] == 0.0 and job["chunks_per_second"] > 0
+                assert vector_store.get_db_version(save_path) is not None
+                assert any(item["job_id"] == job_id for item in ingest_jobs.list_jobs())
+                print(f"✅ 背景工作完成並自動保存（{job['indexed']} 個片段）")
+                
+                assert ingest_jobs.get_job("missing") is None
+                print("✅ 未知的工作 ID 回傳 None")
+        finally:
+            vector_store.get_embeddings = original_get_embeddings
+        
+        return True
+    
+    except Exception as e:
+        print(f"❌ 背景建立資料庫測試失敗: {str(e)}")
+        return False
+
+
+def test_parallel_loading():
+    """Test parallel loading keeps upload order and collects errors."""
+    print("\n🧪 測試平行載入...\n")
+    
+    try:
+        import tempfile
+        import vector_store
+        
+        embeddings = CountingEmbeddings()
+        original_get_embeddings = vector_store.get_embeddings
+        original_workers = vector_store.INGEST_WORKERS
+        vector_store.get_embeddings = lambda: embeddings
+        vector_store.INGEST_WORKERS = 2
+        
+        try:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                uploaded_files = [
+                    FakeUploadedFile(f"{i}.txt", f"文件 {i} 的內容。" * (i + 1))
+                    for i in range(5)
+                ]
+                uploaded_files.insert(2, FakeUploadedFile("broken.txt", b"\xff\xfe\xfa"))
+                
+                errors = []
+                vectorstore = vector_store.create_vector_store(
+                    uploaded_files,
+                    "",
+                    temp_dir=os.path.join(tmp_dir, "uploads"),
+                    errors=errors
+                )
+                
+                sources = list(vector_store.get_manifest(vectorstore))
+                assert sources == [f"{i}.txt" for i in range(5)], sources
+                print("✅ 文件順序與上傳順序一致")
+                
+                assert [source for source, _ in errors] == ["broken.txt"], errors
+                print("✅ 載入錯誤已收集")
+        finally:
+            vector_store.get_embeddings = original_get_embeddings
+            vector_store.INGEST_WORKERS = original_workers
+        
+        return True
+    
+    except Exception as e:
+        print(f"❌ 平行載入測試失敗: {str(e)}")
+        return False
+
+
+def test_mmap_loading():
+    """Test loading a saved database with a memory-mapped index."""
+    print("\n🧪 測試記憶體映射載入...\n")
+    
+    try:
+        import tempfile
+        import vector_store
+        from sqlite_docstore import SQLiteDocstore
+        
+        embeddings = CountingEmbeddings()
+        original_get_embeddings = vector_store.get_embeddings
+        vector_store.get_embeddings = lambda: embeddings
+        
+        try:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                vectorstore = vector_store.create_vector_store(
+                    [FakeUploadedFile(f"{i}.txt", f"文件 {i}。" * 100) for i in range(3)],
+                    "",
+                    temp_dir=os.path.join(tmp_dir, "uploads")
+                )
+                save_path = os.path.join(tmp_dir, "faiss_db")
+                vector_store.save_vectorstore(vectorstore, save_path)
+                
+                loaded = vectorstore
+                mapped = vector_store.load_vectorstore(save_path, mmap=True)
+                assert isinstance(mapped.docstore, SQLiteDocstore)
+                assert mapped.index.ntotal == loaded.index.ntotal
+                
+                expected = loaded.similarity_search_with_score("文件 1", k=3)
+                actual = mapped.similarity_search_with_score("文件 1", k=3)
+                assert [(d.page_content, d.metadata) for d, _ in actual] == \
+                    [(d.page_content, d.metadata) for d, _ in expected]
+                print("✅ 映射載入的檢索結果一致")
+                
+                assert vector_store.get_manifest(mapped) == vector_store.get_manifest(loaded)
+                print("✅ 清單一致")
+                
+                # Saving over the mapped files leaves the mapped store intact
+                copied = vector_store.copy_to_memory(mapped)
+                added, _ = vector_store.add_documents_to_vectorstore(
+                    copied, [FakeUploadedFile("new.txt", "新文件。")],
+                    temp_dir=os.path.join(tmp_dir, "uploads")
+                )
+                assert added == ["new.txt"] and mapped.index.ntotal == loaded.index.ntotal
+                vector_store.save_vectorstore(copied, save_path)
+                actual = mapped.similarity_search_with_score("文件 1", k=3)
+                assert [(d.page_content, d.metadata) for d, _ in actual] == \
+                    [(d.page_content, d.metadata) for d, _ in expected]
+                assert sorted(vector_store.load_manifest(save_path)) == ["0.txt", "1.txt", "2.txt", "new.txt"]
+                print("✅ 複製到記憶體後可修改，覆寫保存不影響已映射的舊版本")
+                
+                # A mapped store itself can be saved (it is copied first)
+                copy_path = os.path.join(tmp_dir, "copy_db")
+                vector_store.save_vectorstore(mapped, copy_path)
+                assert vector_store.load_vectorstore(copy_path, mmap=True).index.ntotal == \
+                    mapped.index.ntotal
+                print("✅ 映射載入的資料庫可直接保存")
+                
+                mapped.docstore._conn.close()
+        finally:
+            vector_store.get_embeddings = original_get_embeddings
+        
+        return True
+    
+    except Exception as e:
+        print(f"❌ 記憶體映射載入測試失敗: {str(e)}")
+        return False
+
+
+def test_columnar_format():
+    """Test saving, converting and loading the columnar database format."""
+    print("\n🧪 測試欄式資料庫格式...\n")
+    
+    try:
+        import tempfile
+        import columnar_store
+        import vector_store
+        from columnar_store import ColumnarDocstore, convert_faiss_db
+        
+        embeddings = CountingEmbeddings()
+        original_get_embeddings = vector_store.get_embeddings
+        vector_store.get_embeddings = lambda: embeddings
+        
+        try:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                vectorstore = vector_store.create_vector_store(
+                    [FakeUploadedFile(f"{i}.txt", f"文件 {i}。" * 100) for i in range(3)],
+                    "",
+                    temp_dir=os.path.join(tmp_dir, "uploads")
+                )
+                expected = [
+                    (d.page_content, d.metadata)
+                    for d, _ in vectorstore.similarity_search_with_score("文件 2", k=3)
+                ]
+                
+                columnar_path = os.path.join(tmp_dir, "columnar_db")
+                swaps = []
+                original_replace = columnar_store.replace_directory
+                columnar_store.replace_directory = lambda *args: (
+                    swaps.append(args) or original_replace(*args)
+                )
+                try:
+                    vector_store.save_vectorstore(vectorstore, columnar_path, db_format="columnar")
+                finally:
+                    columnar_store.replace_directory = original_replace
+                assert len(swaps) == 1, swaps
+                loaded = vector_store.load_vectorstore(columnar_path)
+                assert isinstance(loaded.docstore, ColumnarDocstore)
+                actual = [
+                    (d.page_content, d.metadata)
+                    for d, _ in loaded.similarity_search_with_score("文件 2", k=3)
+                ]
+                assert actual == expected
+                assert vector_store.get_manifest(loaded) == vector_store.get_manifest(vectorstore)
+                print("✅ 欄式格式保存與載入一致")
+                
+                faiss_path = os.path.join(tmp_dir, "faiss_db")
+                vector_store.save_vectorstore(vectorstore, faiss_path, db_format="faiss")
+                converted_path = os.path.join(tmp_dir, "converted_db")
+                convert_faiss_db(faiss_path, converted_path, dtype="float16")
+                converted = vector_store.load_vectorstore(converted_path)
+                assert converted.index.vectors.dtype.name == "float16"
+                actual = [
+                    d.page_content
+                    for d, _ in converted.similarity_search_with_score("文件 2", k=3)
+                ]
+                assert actual == [content for content, _ in expected]
+                assert vector_store.load_manifest(converted_path) == vector_store.get_manifest(vectorstore)
+                print("✅ faiss_db 轉換為 float16 欄式格式")
+                
+                # Saving over a mapped database must not touch its open files
+                vectorstore.add_texts(["新增的片段。"])
+                vector_store.save_vectorstore(vectorstore, columnar_path, db_format="columnar")
+                actual = [
+                    (d.page_content, d.metadata)
+                    for d, _ in loaded.similarity_search_with_score("文件 2", k=3)
+                ]
+                assert actual == expected
+                reloaded = vector_store.load_vectorstore(columnar_path)
+                assert reloaded.index.ntotal == loaded.index.ntotal + 1
+                assert not [name for name in os.listdir(tmp_dir) if ".tmp-" in name or ".old-" in name]
+                print("✅ 覆寫資料庫後，已載入的舊版本仍可檢索")
+        finally:
+            vector_store.get_embeddings = original_get_embeddings
+        
+        return True
+    
+    except Exception as e:
+        print(f"❌ 欄式資料庫格式測試失敗: {str(e)}")
+        return False
+
+
+def test_db_version():
+    """Test the database version used to key shared stores and hot reload."""
+    print("\n🧪 測試資料庫版本與記憶體回報...\n")
+    
+    try:
+        import tempfile
+        import metrics
+        import vector_store
+        
+        embeddings = CountingEmbeddings()
+        original_get_embeddings = vector_store.get_embeddings
+        vector_store.get_embeddings = lambda: embeddings
+        
+        try:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                save_path = os.path.join(tmp_dir, "columnar_db")
+                assert vector_store.get_db_version(save_path) is None
+                
+                vectorstore = vector_store.create_vector_store(
+                    [FakeUploadedFile("a.txt", "文件 A。" * 100)],
+                    "",
+                    temp_dir=os.path.join(tmp_dir, "uploads")
+                )
+                vector_store.save_vectorstore(vectorstore, save_path, db_format="columnar")
+                version = vector_store.get_db_version(save_path)
+                assert version and version == vector_store.get_db_version(save_path)
+                print("✅ 未變更的資料庫版本穩定")
+                
+                vector_store.add_documents_to_vectorstore(
+                    vectorstore,
+                    [FakeUploadedFile("b.txt", "文件 B。" * 100)],
+                    temp_dir=os.path.join(tmp_dir, "uploads")
+                )
+                vector_store.save_vectorstore(vectorstore, save_path, db_format="columnar")
+                assert vector_store.get_db_version(save_path) != version
+                print("✅ 重新保存後版本改變（觸發熱重載）")
+                
+                # What the Streamlit app does before modifying a shared store
+                shared = vector_store.load_vectorstore(save_path)
+                private = vector_store.copy_to_memory(shared)
+                assert private is not shared
+                assert vector_store.remove_source_from_vectorstore(private, "a.txt") > 0
+                vector_store.add_documents_to_vectorstore(
+                    private,
+                    [FakeUploadedFile("c.txt", "文件 C。" * 100)],
+                    temp_dir=os.path.join(tmp_dir, "uploads")
+                )
+                assert set(vector_store.get_manifest(private)) == {"b.txt", "c.txt"}
+                assert set(vector_store.get_manifest(shared)) == {"a.txt", "b.txt"}
+                print("✅ 欄式資料庫的記憶體副本可加入與移除文件")
+        finally:
+            vector_store.get_embeddings = original_get_embeddings
+        
+        memory = metrics.process_memory_mb()
+        assert set(memory) == {"rss", "peak_rss"}
+        assert all(value is None or value > 0 for value in memory.values())
+        print(f"✅ 記憶體回報: {memory}")
+        
+        return True
+    
+    except Exception as e:
+        print(f"❌ 資料庫版本測試失敗: {str(e)}")
+        return False
+
+
+def test_hybrid_search():
+    """Test the BM25 keyword index and hybrid BM25 + dense retrieval."""
+    print("\n🧪 測試混合檢索...\n")
+    
+    try:
+        import tempfile
+        import vector_store
+        from keyword_index import KEYWORD_INDEX_FILE_NAME, tokenize
+        
+        assert tokenize("產品型號 XK-9021") == ["產品", "品型", "型號", "xk-9021", "xk", "9021"]
+        print("✅ 中文以字元二元組切分，型號保留完整")
+        
+        embeddings = CountingEmbeddings()
+        original_get_embeddings = vector_store.get_embeddings
+        vector_store.get_embeddings = lambda: embeddings
+        
+        try:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                files = [FakeUploadedFile(f"{i}.txt", f"一般說明文件第{i}號。") for i in range(8)]
+                files.append(FakeUploadedFile("spec.txt", "型號 XK-9021 的保固期為三年。"))
+                vectorstore = vector_store.create_vector_store(
+                    files, "", temp_dir=os.path.join(tmp_dir, "uploads")
+                )
+                assert len(vectorstore.keyword_index) == vectorstore.index.ntotal
+                
+                query = "XK-9021 保固多久"
+                [docs] = vector_store.retrieve_documents(
+                    vectorstore, [query], [embeddings.embed_query(query)], k=4
+                )
+                assert docs[0].metadata["source"] == "spec.txt", docs
+                print("✅ 混合檢索找到精確型號")
+                
+                save_path = os.path.join(tmp_dir, "columnar_db")
+                vector_store.save_vectorstore(vectorstore, save_path, db_format="columnar")
+                assert os.path.exists(os.path.join(save_path, KEYWORD_INDEX_FILE_NAME))
+                loaded = vector_store.load_vectorstore(save_path)
+                assert not loaded.keyword_index.loaded
+                # Swapping the directory before first use must not change what is read
+                vector_store.save_vectorstore(vectorstore, save_path, db_format="columnar")
+                assert loaded.keyword_index.search(query) == vectorstore.keyword_index.search(query)
+                assert loaded.keyword_index.loaded
+                print("✅ 關鍵字索引已隨資料庫保存，並於首次使用時載入")
+                
+                vector_store.remove_source_from_vectorstore(vectorstore, "spec.txt")
+                assert vectorstore.keyword_index.search(query) == []
+                print("✅ 移除文件時同步更新關鍵字索引")
+        finally:
+            vector_store.get_embeddings = original_get_embeddings
+        
+        return True
+    
+    except Exception as e:
+        print(f"❌ 混合檢索測試失敗: {str(e)}")
+        return False
+
+
+def test_index_types():
+    """Test building and describing every supported FAISS index type."""
+    print("\n🧪 測試 FAISS 索引類型...\n")
+    
+    try:
+        import numpy as np
+        from faiss_index import (
+            INDEX_TYPES, build_index, describe_index, index_footprint, set_search_params
+        )
+        
+        rng = np.random.default_rng(0)
+        vectors = rng.standard_normal((2000, 64)).astype(np.float32)
+        
+        for index_type in INDEX_TYPES:
+            index, params = build_index(vectors, index_type, nlist=16, pq_m=8, hnsw_m=16)
+            set_search_params(index, nprobe=4, ef_search=32)
+            index.add(vectors)
+            _, ids = index.search(vectors[:5], 1)
+            
+            assert params["index_type"] == index_type, params
+            assert describe_index(index) == params, (describe_index(index), params)
+            if index_type != "ivf_pq":
+                assert ids[:, 0].tolist() == list(range(5)), ids
+            print(f"✅ {index_type}: {params}")
+        
+        # Too few training points for IVF-PQ falls back to exact search
+        index, params = build_index(vectors[:100], "ivf_pq", nlist=16, pq_m=8)
+        assert params["index_type"] == "flat"
+        print("✅ 訓練樣本不足時改用 flat")
+        
+        # Quantized storage: 2× / 4× smaller than float32, near-exact recall
+        queries = rng.standard_normal((50, 64)).astype(np.float32)
+        footprints = {}
+        for index_type in ["flat", "sq_fp16", "sq8"]:
+            index, _ = build_index(vectors, index_type)
+            index.add(vectors)
+            footprints[index_type] = index_footprint(index)["bytes_per_vector"]
+            if index_type == "flat":
+                _, truth = index.search(queries, 10)
+            else:
+                _, ids = index.search(queries, 10)
+                recall = sum(len(set(a) & set(b)) for a, b in zip(ids, truth)) / truth.size
+                assert recall >= 0.9, (index_type, recall)
+                print(f"✅ {index_type}: 每向量 {footprints[index_type]:.0f} bytes，recall@10 {recall:.3f}")
+        assert footprints["sq_fp16"] < footprints["flat"] / 1.9
+        assert footprints["sq8"] < footprints["flat"] / 3.8
+        
+        # HNSW stores accept new files but refuse replace/remove up front
+        import tempfile
+        import vector_store
+        
+        original_build_index = vector_store.build_index
+        original_get_embeddings = vector_store.get_embeddings
+        vector_store.build_index = lambda vectors: build_index(vectors, "hnsw", hnsw_m=16)
+        vector_store.get_embeddings = lambda: CountingEmbeddings()
+        try:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                vectorstore = vector_store.create_vector_store(
+                    [FakeUploadedFile("a.txt", "第一份文件。" * 50)], "", temp_dir=tmp_dir
+                )
+                count = vectorstore.index.ntotal
+                try:
+                    vector_store.add_documents_to_vectorstore(
+                        vectorstore,
+                        [
+                            FakeUploadedFile("b.txt", "第二份文件。"),
+                            FakeUploadedFile("a.txt", "第一份文件已修改。" * 50),
+                        ],
+                        temp_dir=tmp_dir
+                    )
+                    assert False, "HNSW 應拒絕更新文件"
+                except ValueError:
+                    assert vectorstore.index.ntotal == count
+                try:
+                    vector_store.remove_source_from_vectorstore(vectorstore, "a.txt")
+                    assert False, "HNSW 應拒絕移除文件"
+                except ValueError:
+                    assert vectorstore.index.ntotal == count
+                added, _ = vector_store.add_documents_to_vectorstore(
+                    vectorstore, [FakeUploadedFile("b.txt", "第二份文件。")], temp_dir=tmp_dir
+                )
+                assert added == ["b.txt"] and vectorstore.index.ntotal == count + 1
+                print("✅ HNSW 在加入任何片段前拒絕更新與移除")
+        finally:
+            vector_store.build_index = original_build_index
+            vector_store.get_embeddings = original_get_embeddings
+        
+        return True
+    
+    except Exception as e:
+        print(f"❌ FAISS 索引類型測試失敗: {str(e)}")
+        return False
+
+
 def test_config():
     """Test configuration module."""
     print("\n🧪 測試配置模組...\n")
@@ -186,8 +1785,32 @@ def main():
         ("文件結構", test_file_structure),
         ("配置模組", test_config),
         ("EmbeddingGemma", test_embeddings),
+        ("嵌入模型註冊表", test_embeddings_registry),
+        ("嵌入快取", test_embedding_cache),
+        ("Matryoshka 維度", test_matryoshka_dimension),
+        ("ONNX 嵌入後端", test_onnx_encoder),
+        ("ONNX 一致性", test_onnx_parity),
         ("RAG 鏈", test_rag_chain),
+        ("單次檢索", test_single_retrieval),
+        ("答案快取", test_answer_cache),
+        ("LLM 連線池", test_chain_pool),
+        ("串流回答", test_streaming_query),
+        ("批次向量搜尋", test_batch_search),
+        ("批次問答", test_batch_query),
+        ("重新排序", test_reranking),
+        ("中文切分器", test_cjk_splitter),
+        ("上下文組裝", test_context_builder),
         ("向量資料庫", test_vector_store),
+        ("增量更新", test_incremental_updates),
+        ("平行載入", test_parallel_loading),
+        ("記憶體內解析", test_in_memory_uploads),
+        ("重複片段移除", test_chunk_dedup),
+        ("背景建立資料庫", test_ingest_jobs),
+        ("FAISS 索引類型", test_index_types),
+        ("記憶體映射載入", test_mmap_loading),
+        ("欄式資料庫格式", test_columnar_format),
+        ("資料庫版本", test_db_version),
+        ("混合檢索", test_hybrid_search),
         ("API 密鑰", test_api_keys),
     ]
     
@@ -3,138 +3,907 @@ Vector Store Module
 Handles document loading, text splitting, and FAISS vector database creation.
 """
 
+import copy
+import hashlib
+import json
 import os
 import shutil
+import tempfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from langchain_community.document_loaders import (
-    PyPDFLoader, 
-    UnstructuredWordDocumentLoader, 
-    TextLoader
-)
+
+import numpy as np
+from langchain_community.document_loaders import UnstructuredWordDocumentLoader
+from langchain_community.document_loaders.blob_loaders import Blob
+from langchain_community.document_loaders.parsers.pdf import PyPDFParser
+from langchain_core.documents import Document
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain.vectorstores import FAISS
-from embeddings import EmbeddingGemmaEmbeddings
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from config import (
+    CHUNK_DEDUP_ENABLED,
+    CHUNK_OVERLAP,
+    CHUNK_SIZE,
+    DB_FORMAT,
+    DB_VECTOR_DTYPE,
+    EMBED_BATCH_SIZE,
+    FAISS_LOAD_MMAP,
+    HYBRID_FETCH_K,
+    HYBRID_SEARCH_ENABLED,
+    INGEST_WORKERS,
+    RRF_K,
+    TEMP_UPLOAD_DIR,
+    TEXT_SPLITTER,
+)
+from answer_cache import mark_store_changed
+from chunk_dedup import ChunkDeduplicator
+from cjk_splitter import CJKTextSplitter
+from columnar_store import (
+    is_columnar,
+    load_columnar,
+    staged_directory,
+    write_columnar,
+)
+from embeddings import get_embeddings
+from faiss_index import (
+    build_index,
+    copy_index,
+    describe_index,
+    index_footprint,
+    read_index_mmap,
+    set_search_params,
+    supports_removal,
+    training_size,
+)
+from keyword_index import (
+    KEYWORD_INDEX_FILE_NAME,
+    KeywordIndex,
+    LazyKeywordIndex,
+    reciprocal_rank_fusion,
+)
+import metrics
+from sqlite_docstore import DOCSTORE_FILE_NAME, SQLiteDocstore, write_sqlite_docstore
+
+
+# Per-source manifest written next to the saved index
+MANIFEST_FILE_NAME = "manifest.json"
+
+# Index type and build parameters written next to the saved index
+DB_METADATA_FILE_NAME = "db_metadata.json"
+
+
+def _file_hash(uploaded_file):
+    """Compute the SHA-256 content hash of an uploaded file."""
+    return hashlib.sha256(uploaded_file.getvalue()).hexdigest()
+
+
+def _load_documents(source: str, data: bytes, spill_root: str):
+    """
+    Parse an uploaded file from its in-memory content.
+    
+    Text and PDF files are parsed straight from the bytes. Word documents
+    need a real path for the unstructured loader, so they are spilled to a
+    unique directory under spill_root that is removed right after loading.
+    
+    Returns:
+        list: Loaded documents (empty for unsupported file types)
+    """
+    file_extension = Path(source).suffix.lower()
+    
+    if file_extension == ".txt":
+        return [Document(page_content=data.decode("utf-8"), metadata={"source": source})]
+    
+    elif file_extension == ".pdf":
+        return list(PyPDFParser().lazy_parse(Blob.from_data(data, path=source)))
+    
+    elif file_extension == ".docx":
+        os.makedirs(spill_root, exist_ok=True)
+        spill_dir = tempfile.mkdtemp(prefix="spill_", dir=spill_root)
+        try:
+            file_path = os.path.join(spill_dir, Path(source).name)
+            with open(file_path, "wb") as f:
+                f.write(data)
+            return UnstructuredWordDocumentLoader(file_path).load()
+        finally:
+            shutil.rmtree(spill_dir, ignore_errors=True)
+    
+    return []
+
+
+def _make_text_splitter(chunk_size: int, chunk_overlap: int):
+    """Create the text splitter selected by TEXT_SPLITTER."""
+    if TEXT_SPLITTER == "recursive":
+        return RecursiveCharacterTextSplitter(
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap,
+            separators=["\n\n", "\n", " ", ""]
+        )
+    return CJKTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+
+
+def _load_and_split_file(source: str, data: bytes, file_hash: str,
+                         chunk_size: int, chunk_overlap: int, spill_root: str):
+    """
+    Load a single file from memory and split it into chunks.
+    
+    Runs inside a worker process, so it only takes picklable arguments.
+    Every chunk is tagged with the uploaded file name as its "source" and
+    the file's content hash as "file_hash".
+    
+    Returns:
+        list: Split documents (empty for unsupported file types)
+    """
+    documents = _load_documents(source, data, spill_root)
+    for document in documents:
+        document.metadata["source"] = source
+        document.metadata["file_hash"] = file_hash
+    
+    return _make_text_splitter(chunk_size, chunk_overlap).split_documents(documents)
 
 
-def create_vector_store(uploaded_files, hf_token: str, temp_dir: str = "uploaded_docs"):
+def _iter_split_files(uploaded_files, temp_dir: str, max_workers: int, errors: list,
+                      progress=None):
+    """
+    Load and split uploaded files in a process pool.
+    
+    Files are parsed from their in-memory content (UploadedFile.getvalue()
+    shares the upload's bytes instead of copying them); only formats whose
+    loader needs a real path are spilled to disk, each in its own unique
+    directory under temp_dir, so concurrent sessions never collide.
+    
+    Results are yielded in upload order as soon as each file (and every file
+    before it) is ready, so embedding can start while later files are still
+    being parsed. Files that fail to load are recorded in errors.
+    
+    Args:
+        uploaded_files (list): List of uploaded file objects from Streamlit
+        temp_dir (str): Parent directory for spilled files
+        max_workers (int): Number of worker processes (1 runs inline)
+        errors (list): Receives (file name, error message) tuples
+        progress (callable): Optional progress(stage, count) callback, called
+            with "parsed" once per file and "split" with its chunk count
+        
+    Yields:
+        tuple: (file name, list of split documents)
+    """
+    jobs = [
+        (uploaded_file.name, uploaded_file.getvalue(), _file_hash(uploaded_file))
+        for uploaded_file in uploaded_files
+    ]
+    
+    if max_workers > 1 and len(jobs) > 1:
+        executor = ProcessPoolExecutor(max_workers=min(max_workers, len(jobs)))
+    else:
+        executor = None
+    
+    try:
+        # Keep only a bounded number of files in flight so parsed results
+        # do not pile up in memory while earlier files are being embedded
+        pending = deque()
+        next_job = 0
+        
+        for source, data, file_hash in jobs:
+            if executor is not None:
+                while next_job < len(jobs) and len(pending) < 2 * max_workers:
+                    pending.append(executor.submit(
+                        _load_and_split_file, *jobs[next_job],
+                        CHUNK_SIZE, CHUNK_OVERLAP, temp_dir
+                    ))
+                    next_job += 1
+            
+            try:
+                if executor is not None:
+                    split_documents = pending.popleft().result()
+                else:
+                    split_documents = _load_and_split_file(
+                        source, data, file_hash, CHUNK_SIZE, CHUNK_OVERLAP, temp_dir
+                    )
+            except Exception as e:
+                errors.append((source, str(e)))
+                if progress is not None:
+                    progress("parsed", 1)
+                continue
+            
+            if progress is not None:
+                progress("parsed", 1)
+                progress("split", len(split_documents))
+            yield source, split_documents
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+
+def _iter_batches(iterable, batch_size: int):
+    """Group an iterable into lists of at most batch_size items."""
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _add_chunks(vectorstore, texts, vectors, metadatas):
+    """Add embedded chunks to the FAISS index and the keyword index."""
+    doc_ids = vectorstore.add_embeddings(zip(texts, vectors), metadatas=metadatas)
+    vectorstore.keyword_index.add(doc_ids, texts)
+    mark_store_changed(vectorstore)
+
+
+def _delete_chunks(vectorstore, doc_ids):
+    """Delete chunks from the FAISS index and the keyword index."""
+    vectorstore.delete(doc_ids)
+    keyword_index = getattr(vectorstore, "keyword_index", None)
+    if keyword_index is not None:
+        keyword_index.remove(doc_ids)
+
+
+def _release_source(vectorstore, source: str, chunk_ids):
+    """
+    Detach a source from its chunks and delete the chunks left without one.
+    
+    Chunks that deduplication shared with other sources (see
+    chunk_dedup.py) stay in the store; the source is only removed from
+    their "sources" metadata, and another source becomes their primary
+    "source" if needed.
+    
+    Returns:
+        int: Number of chunks deleted
+    """
+    deleted = []
+    for doc_id in chunk_ids:
+        metadata = vectorstore.docstore.search(doc_id).metadata
+        sources = metadata.get("sources") or {}
+        if len(sources) > 1 and source in sources:
+            del sources[source]
+            if metadata.get("source") == source:
+                metadata["source"], metadata["file_hash"] = next(iter(sources.items()))
+        else:
+            deleted.append(doc_id)
+    if deleted:
+        _delete_chunks(vectorstore, deleted)
+    # Even without deletions, cited sources changed
+    mark_store_changed(vectorstore)
+    return len(deleted)
+
+
+def _index_files(vectorstore, uploaded_files, temp_dir: str, errors: list,
+                 replaced=None, progress=None):
+    """
+    Stream uploaded files into a vector store in fixed-size batches.
+    
+    Chunks flow through load → split → embed → index one batch of
+    EMBED_BATCH_SIZE chunks at a time, so peak memory is bounded by the
+    batch size (plus the FAISS and keyword indexes and the docstore
+    themselves) rather than by the corpus size.
+    A new index of a type that needs training (see FAISS_INDEX_TYPE) is
+    trained on the first FAISS_TRAIN_SIZE chunks before they are added.
+    Every chunk is also added to the store's BM25 keyword index, which is
+    built from the docstore first if an existing store has none yet.
+    With CHUNK_DEDUP_ENABLED, exact and near-duplicate chunks of this
+    ingest are dropped before embedding (see chunk_dedup.py); the filter
+    remembers at most CHUNK_DEDUP_WINDOW chunks. The exact and near
+    duplicates dropped per ingest are recorded as the "dedup_exact_removed"
+    and "dedup_near_removed" metrics.
+    
+    Args:
+        vectorstore (FAISS): Vector store to extend, or None to create one
+        uploaded_files (list): List of uploaded file objects from Streamlit
+        temp_dir (str): Parent directory for files spilled to disk
+        errors (list): Receives (file name, error message) tuples
+        replaced (dict): Manifest entries whose chunks are deleted right
+            before the new chunks of the same source are added
+        progress (callable): Optional progress(stage, count) callback for the
+            "parsed", "split", "deduplicated" (chunks dropped), "embedded"
+            and "indexed" stages
+        
+    Returns:
+        tuple: (vectorstore, list of indexed source names)
+    """
+    # Get the shared embeddings model (loaded once per process)
+    embeddings = get_embeddings()
+    replaced = dict(replaced or {})
+    indexed_sources = []
+    
+    if vectorstore is not None and getattr(vectorstore, "keyword_index", None) is None:
+        vectorstore.keyword_index = KeywordIndex.from_vectorstore(vectorstore)
+    
+    deduplicator = ChunkDeduplicator() if CHUNK_DEDUP_ENABLED else None
+    
+    def iter_chunks():
+        for source, split_documents in _iter_split_files(
+            uploaded_files, temp_dir, INGEST_WORKERS, errors, progress
+        ):
+            if split_documents:
+                indexed_sources.append(source)
+            if deduplicator is not None:
+                count = len(split_documents)
+                split_documents = deduplicator.filter(split_documents)
+                if progress is not None:
+                    progress("deduplicated", count - len(split_documents))
+            yield from split_documents
+    
+    # Vectors buffered until there are enough to train a new index
+    pending = []
+    
+    def flush_pending(vectorstore):
+        if vectorstore is None:
+            index, _ = build_index(
+                [vector for _, vectors, _ in pending for vector in vectors]
+            )
+            set_search_params(index)
+            vectorstore = FAISS(embeddings, index, InMemoryDocstore(), {})
+            vectorstore.keyword_index = KeywordIndex()
+        for texts, vectors, metadatas in pending:
+            _add_chunks(vectorstore, texts, vectors, metadatas)
+            if progress is not None:
+                progress("indexed", len(texts))
+        pending.clear()
+        return vectorstore
+    
+    for batch in _iter_batches(iter_chunks(), EMBED_BATCH_SIZE):
+        texts = [document.page_content for document in batch]
+        metadatas = [document.metadata for document in batch]
+        vectors = embeddings.embed_documents(texts)
+        if progress is not None:
+            progress("embedded", len(texts))
+        
+        if vectorstore is None:
+            pending.append((texts, vectors, metadatas))
+            if sum(len(item[0]) for item in pending) >= training_size():
+                vectorstore = flush_pending(vectorstore)
+            continue
+        
+        # Drop the old chunks of a changed file just before its new ones go in
+        for source in dict.fromkeys(metadata["source"] for metadata in metadatas):
+            entry = replaced.pop(source, None)
+            if entry is not None:
+                _release_source(vectorstore, source, entry["chunk_ids"])
+        
+        _add_chunks(vectorstore, texts, vectors, metadatas)
+        if progress is not None:
+            progress("indexed", len(texts))
+    
+    # Corpus smaller than the training sample: train on everything
+    if pending:
+        vectorstore = flush_pending(vectorstore)
+    
+    # Changed files whose new chunks were all duplicates of other files
+    for source in indexed_sources:
+        entry = replaced.pop(source, None)
+        if entry is not None:
+            _release_source(vectorstore, source, entry["chunk_ids"])
+    
+    # Duplicates may have added sources to chunks already in the store
+    if vectorstore is not None:
+        mark_store_changed(vectorstore)
+    
+    # Totals reach callers through progress("deduplicated", ...)
+    if deduplicator is not None:
+        metrics.record("dedup_exact_removed", deduplicator.exact_removed)
+        metrics.record("dedup_near_removed", deduplicator.near_removed)
+    
+    return vectorstore, indexed_sources
+
+
+def create_vector_store(uploaded_files, hf_token: str, temp_dir: str = TEMP_UPLOAD_DIR,
+                        errors: list = None, progress=None):
     """
     Create a FAISS vector store from uploaded documents.
     
-    Supports .txt, .pdf, and .docx file formats. Documents are split into
-    chunks using RecursiveCharacterTextSplitter and then embedded using
-    EmbeddingGemma with Google's embedding model.
+    Supports .txt, .pdf, and .docx file formats. Files are loaded and split
+    into chunks (see TEXT_SPLITTER) in a process pool
+    (INGEST_WORKERS), and the chunks are streamed through EmbeddingGemma into
+    the index in batches of EMBED_BATCH_SIZE as soon as they are ready.
     
     Args:
         uploaded_files (list): List of uploaded file objects from Streamlit
         hf_token (str): HuggingFace token for model access
-        temp_dir (str): Temporary directory for storing uploaded files
+        temp_dir (str): Parent directory for files spilled to disk
+        errors (list): Optional list that receives (file name, error message)
+            for every file that could not be loaded
+        progress (callable): Optional progress(stage, count) callback; see
+            _index_files()
         
     Returns:
-        FAISS: Vector store object, or None if no documents were processed
+        FAISS: Vector store object
         
     Raises:
         ValueError: If no documents can be loaded from the uploaded files
     """
+    errors = errors if errors is not None else []
     
-    # Create temporary directory for uploaded files
-    os.makedirs(temp_dir, exist_ok=True)
+    vectorstore, _ = _index_files(None, uploaded_files, temp_dir, errors, progress=progress)
     
-    try:
-        # Save uploaded files to temporary directory
-        file_paths = []
-        for uploaded_file in uploaded_files:
-            file_path = os.path.join(temp_dir, uploaded_file.name)
-            with open(file_path, "wb") as f:
-                f.write(uploaded_file.getbuffer())
-            file_paths.append(file_path)
+    for source, message in errors:
+        print(f"Error loading {source}: {message}")
+    
+    if vectorstore is None:
+        raise ValueError("未能從上傳的文件中提取任何文本。請確保文件格式正確。")
+    
+    return vectorstore
+
+
+def _iter_chunks(vectorstore):
+    """
+    Iterate over every chunk of a vector store in FAISS position order.
+    
+    Read-only docstores (SQLite, columnar) read all chunks in one pass
+    instead of one lookup per chunk.
+    
+    Yields:
+        tuple: (position, docstore ID, Document)
+    """
+    docstore = vectorstore.docstore
+    if hasattr(docstore, "iter_chunks"):
+        yield from docstore.iter_chunks()
+        return
+    for position, doc_id in sorted(vectorstore.index_to_docstore_id.items()):
+        yield position, doc_id, docstore.search(doc_id)
+
+
+def copy_to_memory(vectorstore):
+    """
+    Get a writable, in-memory copy of a memory-mapped vector store.
+    
+    Stores loaded memory-mapped (see load_vectorstore) are read-only:
+    their docstores cannot take new chunks or be pickled, and their
+    indexes cannot be modified. The copy has an owned FAISS index, an
+    InMemoryDocstore and its own keyword index, so changing it never
+    affects stores that share the mapped files.
+    
+    Args:
+        vectorstore (FAISS): Vector store to copy
         
-        # Load documents from files
-        documents = []
+    Returns:
+        FAISS: The store itself if it is already in memory, else a copy
+    """
+    if isinstance(vectorstore.docstore, InMemoryDocstore):
+        return vectorstore
+    
+    documents = {}
+    index_to_docstore_id = {}
+    for position, doc_id, document in _iter_chunks(vectorstore):
+        documents[doc_id] = document
+        index_to_docstore_id[position] = doc_id
+    
+    in_memory = FAISS(
+        vectorstore.embedding_function,
+        copy_index(vectorstore.index),
+        InMemoryDocstore(documents),
+        index_to_docstore_id
+    )
+    keyword_index = getattr(vectorstore, "keyword_index", None)
+    if keyword_index is not None:
+        in_memory.keyword_index = copy.deepcopy(keyword_index)
+    return in_memory
+
+
+def get_manifest(vectorstore):
+    """
+    Build the per-source manifest of a vector store.
+    
+    Args:
+        vectorstore (FAISS): Vector store to describe
         
-        for file_path in file_paths:
-            file_extension = Path(file_path).suffix.lower()
-            
-            try:
-                if file_extension == ".pdf":
-                    loader = PyPDFLoader(file_path)
-                    documents.extend(loader.load())
-                    
-                elif file_extension == ".docx":
-                    loader = UnstructuredWordDocumentLoader(file_path)
-                    documents.extend(loader.load())
-                    
-                elif file_extension == ".txt":
-                    loader = TextLoader(file_path, encoding="utf-8")
-                    documents.extend(loader.load())
-                    
-            except Exception as e:
-                print(f"Error loading {file_path}: {str(e)}")
-                continue
+    Returns:
+        dict: Mapping of source name to {"file_hash": str, "chunk_ids": list};
+            a deduplicated chunk is listed under every source it came from
+    """
+    manifest = {}
+    for _, doc_id, document in _iter_chunks(vectorstore):
+        metadata = getattr(document, "metadata", {})
+        sources = metadata.get("sources") or {
+            metadata.get("source", ""): metadata.get("file_hash")
+        }
+        for source, file_hash in sources.items():
+            entry = manifest.setdefault(source, {"file_hash": file_hash, "chunk_ids": []})
+            entry["chunk_ids"].append(doc_id)
+    return manifest
+
+
+def add_documents_to_vectorstore(vectorstore, uploaded_files, temp_dir: str = TEMP_UPLOAD_DIR,
+                                 errors: list = None, progress=None):
+    """
+    Add uploaded documents to an existing FAISS vector store.
+    
+    Files whose content hash matches the one already indexed for the same
+    source are skipped. Changed files have their old chunks removed before
+    the new ones are added, so only new or changed files are embedded.
+    Indexes without removal support (HNSW) only accept new sources; a
+    changed file is refused before anything is added.
+    
+    Args:
+        vectorstore (FAISS): Vector store to update in place
+        uploaded_files (list): List of uploaded file objects from Streamlit
+        temp_dir (str): Parent directory for files spilled to disk
+        errors (list): Optional list that receives (file name, error message)
+            for every file that could not be loaded
+        progress (callable): Optional progress(stage, count) callback; see
+            _index_files()
         
-        if not documents:
-            raise ValueError("未能從上傳的文件中提取任何文本。請確保文件格式正確。")
+    Returns:
+        tuple: (added_sources, skipped_sources)
         
-        # Split documents into chunks
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=500,
-            chunk_overlap=100,
-            separators=["\n\n", "\n", " ", ""]
+    Raises:
+        ValueError: If a changed file would need its old chunks removed
+            from an index that does not support removal
+    """
+    manifest = get_manifest(vectorstore)
+    
+    changed_files = []
+    skipped_sources = []
+    for uploaded_file in uploaded_files:
+        entry = manifest.get(uploaded_file.name)
+        if entry is not None and entry["file_hash"] == _file_hash(uploaded_file):
+            skipped_sources.append(uploaded_file.name)
+        else:
+            changed_files.append(uploaded_file)
+    
+    if not changed_files:
+        return [], skipped_sources
+    
+    replaced_sources = [
+        uploaded_file.name for uploaded_file in changed_files
+        if uploaded_file.name in manifest
+    ]
+    if replaced_sources and not supports_removal(vectorstore.index):
+        raise ValueError(
+            f"HNSW 索引不支援移除片段，無法更新已索引的文件："
+            f"{'、'.join(replaced_sources)}。請重新建立資料庫。"
         )
+    
+    errors = errors if errors is not None else []
+    _, added_sources = _index_files(
+        vectorstore, changed_files, temp_dir, errors, replaced=manifest, progress=progress
+    )
+    return added_sources, skipped_sources
+
+
+def remove_source_from_vectorstore(vectorstore, source: str):
+    """
+    Delete every chunk that belongs to a source file.
+    
+    Chunks shared with other sources by deduplication are kept for them.
+    
+    Args:
+        vectorstore (FAISS): Vector store to update in place
+        source (str): Source file name as listed in the manifest
         
-        split_documents = text_splitter.split_documents(documents)
+    Returns:
+        int: Number of chunks removed
         
-        if not split_documents:
-            raise ValueError("文本分割後沒有生成有效的文檔塊。")
+    Raises:
+        ValueError: If the index does not support removal (HNSW)
+    """
+    if not supports_removal(vectorstore.index):
+        raise ValueError("HNSW 索引不支援移除文件。請重新建立資料庫。")
+    
+    entry = get_manifest(vectorstore).get(source)
+    if entry is None:
+        return 0
+    
+    return _release_source(vectorstore, source, entry["chunk_ids"])
+
+
+def embed_queries(embeddings, queries):
+    """
+    Embed several queries, in a single batch when the embeddings support it.
+    
+    Args:
+        embeddings: Embeddings instance (EmbeddingGemmaEmbeddings or any LangChain embeddings)
+        queries (list): Query texts
         
-        # Initialize embeddings model
-        embeddings = EmbeddingGemmaEmbeddings(
-            model_kwargs={"device": "cpu"},
-            show_progress=True
-        )
+    Returns:
+        list: One embedding vector per query
+    """
+    batch_embed = getattr(embeddings, "embed_queries", None)
+    if batch_embed is not None:
+        return batch_embed(list(queries))
+    return [embeddings.embed_query(query) for query in queries]
+
+
+def _search_ids_by_vector(vectorstore, query_embeddings, k: int):
+    """Run one index search for N query embeddings; return (doc_id, score) lists."""
+    matrix = np.asarray(query_embeddings, dtype=np.float32)
+    if matrix.size == 0:
+        return []
+    if getattr(vectorstore, "_normalize_L2", False):
+        matrix = matrix / np.linalg.norm(matrix, axis=1, keepdims=True)
+    scores, positions = vectorstore.index.search(matrix, k)
+    
+    results = []
+    for row_scores, row_positions in zip(scores, positions):
+        results.append([
+            (vectorstore.index_to_docstore_id[int(position)], float(score))
+            for score, position in zip(row_scores, row_positions)
+            if position != -1
+        ])
+    return results
+
+
+def similarity_search_batch_by_vector(vectorstore, query_embeddings, k: int = 4):
+    """
+    Search the index once for a whole (N, d) matrix of query embeddings.
+    
+    Args:
+        vectorstore: FAISS vector store
+        query_embeddings: N query embedding vectors
+        k (int): Number of documents to return per query
         
-        # Create FAISS vector store
-        vectorstore = FAISS.from_documents(
-            documents=split_documents,
-            embedding=embeddings
-        )
+    Returns:
+        list: Per query, a list of (Document, score) tuples ordered by score.
+            Scores are raw FAISS distances, as in `similarity_search_with_score`.
+    """
+    return [
+        [(vectorstore.docstore.search(doc_id), score) for doc_id, score in hits]
+        for hits in _search_ids_by_vector(vectorstore, query_embeddings, k)
+    ]
+
+
+def similarity_search_batch(vectorstore, queries, k: int = 4):
+    """
+    Retrieve documents for many queries with one embedding batch and one index search.
+    
+    Args:
+        vectorstore: FAISS vector store
+        queries (list): Query texts
+        k (int): Number of documents to return per query
         
-        return vectorstore
+    Returns:
+        list: Per query, a list of (Document, score) tuples in input order
+    """
+    if not queries:
+        return []
+    query_embeddings = embed_queries(vectorstore.embedding_function, queries)
+    return similarity_search_batch_by_vector(vectorstore, query_embeddings, k)
+
+
+def hybrid_search_batch_by_vector(vectorstore, queries, query_embeddings, k: int = 4,
+                                  fetch_k: int = HYBRID_FETCH_K):
+    """
+    Hybrid BM25 + dense retrieval for several queries.
+    
+    The top fetch_k chunks of the FAISS search (one batched call) and of
+    the BM25 keyword index are fused with reciprocal rank fusion. Stores
+    without a keyword index fall back to dense ranking only.
+    
+    Args:
+        vectorstore: FAISS vector store
+        queries (list): Query texts
+        query_embeddings: Query embedding vectors, aligned with queries
+        k (int): Number of documents to return per query
+        fetch_k (int): Candidates taken from each ranking before fusion
         
-    finally:
-        # Clean up temporary directory
-        if os.path.exists(temp_dir):
-            shutil.rmtree(temp_dir)
+    Returns:
+        list: Per query, a list of (Document, fused score) tuples, best first
+    """
+    keyword_index = getattr(vectorstore, "keyword_index", None)
+    dense_hits = _search_ids_by_vector(vectorstore, query_embeddings, max(k, fetch_k))
+    
+    results = []
+    for query, hits in zip(queries, dense_hits):
+        rankings = [[doc_id for doc_id, _ in hits]]
+        if keyword_index is not None:
+            rankings.append([doc_id for doc_id, _ in keyword_index.search(query, fetch_k)])
+        results.append([
+            (vectorstore.docstore.search(doc_id), score)
+            for doc_id, score in reciprocal_rank_fusion(rankings, RRF_K)[:k]
+        ])
+    return results
+
+
+def retrieve_documents(vectorstore, queries, query_embeddings, k: int = 4):
+    """
+    Retrieve documents for several queries with the configured strategy.
+    
+    Uses hybrid BM25 + dense retrieval when HYBRID_SEARCH_ENABLED is set
+    and the store has a keyword index, and dense search otherwise.
+    
+    Args:
+        vectorstore: FAISS vector store
+        queries (list): Query texts
+        query_embeddings: Query embedding vectors, aligned with queries
+        k (int): Number of documents to return per query
+        
+    Returns:
+        list: Per query, a list of Documents
+    """
+    if HYBRID_SEARCH_ENABLED and getattr(vectorstore, "keyword_index", None) is not None:
+        results = hybrid_search_batch_by_vector(vectorstore, queries, query_embeddings, k)
+    else:
+        results = similarity_search_batch_by_vector(vectorstore, query_embeddings, k)
+    return [[doc for doc, _ in hits] for hits in results]
 
 
-def save_vectorstore(vectorstore, save_path: str = "faiss_db"):
+def save_vectorstore(vectorstore, save_path: str = "faiss_db", db_format: str = DB_FORMAT):
     """
     Save the FAISS vector store to disk.
     
+    With db_format="faiss" the index is saved with FAISS.save_local plus a
+    docstore.sqlite3 for memory-mapped loading; with "columnar" it is saved
+    in the pickle-free columnar format (see columnar_store.py). Either way
+    the per-source manifest is written as manifest.json, the index type,
+    build parameters, embedding dimension and vector footprint as
+    db_metadata.json and the BM25 keyword index as
+    keyword_index.npz.
+    
+    The whole database is written to a sibling staging directory that
+    replaces save_path only once complete (see
+    columnar_store.staged_directory), so loaders never see a half-written
+    database and stores that memory-map the old files keep working.
+    Memory-mapped stores are copied into memory first (see
+    copy_to_memory), since their docstores cannot be pickled.
+    
     Args:
         vectorstore (FAISS): Vector store to save
         save_path (str): Path where to save the vector store
+        db_format (str): "faiss" or "columnar"
     """
-    vectorstore.save_local(save_path)
+    vectorstore = copy_to_memory(vectorstore)
+    
+    with staged_directory(save_path) as staging_path:
+        if db_format == "columnar":
+            # Already staged: write in place rather than staging again
+            write_columnar(vectorstore, staging_path, dtype=DB_VECTOR_DTYPE)
+        else:
+            vectorstore.save_local(staging_path)
+            write_sqlite_docstore(
+                os.path.join(staging_path, DOCSTORE_FILE_NAME),
+                vectorstore.docstore,
+                vectorstore.index_to_docstore_id
+            )
+        keyword_index = getattr(vectorstore, "keyword_index", None)
+        if keyword_index is not None:
+            keyword_index.save(os.path.join(staging_path, KEYWORD_INDEX_FILE_NAME))
+        with open(os.path.join(staging_path, MANIFEST_FILE_NAME), "w", encoding="utf-8") as f:
+            json.dump(get_manifest(vectorstore), f, ensure_ascii=False, indent=2)
+        with open(os.path.join(staging_path, DB_METADATA_FILE_NAME), "w", encoding="utf-8") as f:
+            json.dump({
+                **describe_index(vectorstore.index),
+                "embedding_dim": vectorstore.index.d,
+                "footprint": index_footprint(vectorstore.index),
+            }, f, indent=2)
     print(f"向量資料庫已保存到: {save_path}")
 
 
-def load_vectorstore(load_path: str = "faiss_db"):
+def get_db_version(load_path: str = "faiss_db"):
+    """
+    Identify the saved state of a database directory.
+    
+    The version changes whenever save_vectorstore() rewrites the database,
+    so it can key process-wide caches of the loaded store and trigger a
+    hot reload.
+    
+    Args:
+        load_path (str): Path to the saved vector store
+        
+    Returns:
+        tuple: (file name, size, mtime in ns) of every file, or None if the
+            directory does not exist or is being swapped by a save
+    """
+    if not os.path.isdir(load_path):
+        return None
+    version = []
+    try:
+        for entry in sorted(os.scandir(load_path), key=lambda entry: entry.name):
+            if entry.is_file():
+                stat = entry.stat()
+                version.append((entry.name, stat.st_size, stat.st_mtime_ns))
+    except FileNotFoundError:
+        # save_vectorstore() renamed the directory away mid-scan
+        return None
+    return tuple(version)
+
+
+def load_manifest(load_path: str = "faiss_db"):
+    """
+    Read the per-source manifest of a saved vector store.
+    
+    Args:
+        load_path (str): Path to the saved vector store
+        
+    Returns:
+        dict: Manifest, or an empty dict if none was saved
+    """
+    manifest_path = os.path.join(load_path, MANIFEST_FILE_NAME)
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def load_db_metadata(load_path: str = "faiss_db"):
+    """
+    Read the index metadata of a saved vector store.
+    
+    Args:
+        load_path (str): Path to the saved vector store
+        
+    Returns:
+        dict: Index type, build parameters, "embedding_dim" and "footprint"
+            ({"index_type": "flat"} for
+            databases saved before this file existed)
+    """
+    metadata_path = os.path.join(load_path, DB_METADATA_FILE_NAME)
+    if not os.path.exists(metadata_path):
+        return {"index_type": "flat"}
+    with open(metadata_path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _check_embedding_dim(embeddings, db_dim: int, load_path: str):
+    """Refuse a database whose vectors do not match the embedding dimension."""
+    expected = getattr(embeddings, "output_dim", None)
+    if expected is not None and db_dim is not None and db_dim != expected:
+        raise ValueError(
+            f"{load_path} 的向量維度為 {db_dim}，但目前設定的嵌入維度為 {expected}。"
+            f"請將 EMBEDDING_DIMENSION 設為 {db_dim}，或重新建立資料庫。"
+        )
+
+
+def load_vectorstore(load_path: str = "faiss_db", mmap: bool = FAISS_LOAD_MMAP):
     """
     Load a FAISS vector store from disk.
     
+    Databases in the columnar format are always opened memory-mapped and
+    read-only, without unpickling anything. For the "faiss" format, with
+    mmap=True the index file is memory-mapped and chunks are read on
+    demand from docstore.sqlite3 instead of unpickling index.pkl, so cold
+    start is near-instant and processes on one host share pages. Stores
+    loaded this way are read-only; copy_to_memory() makes a writable copy.
+    
+    The query-time search parameters (FAISS_NPROBE, FAISS_EF_SEARCH) are
+    applied to the loaded index; call faiss_index.set_search_params() to
+    change them afterwards. The BM25 keyword index is attached when the
+    database has one and read on its first use (databases saved before it
+    existed use dense search).
+    
     Args:
         load_path (str): Path to the saved vector store
+        mmap (bool): Memory-map the index and use the SQLite docstore
         
     Returns:
         FAISS: Loaded vector store
+        
+    Raises:
+        ValueError: If the database was built with a different embedding
+            dimension than EMBEDDING_DIMENSION
     """
-    embeddings = EmbeddingGemmaEmbeddings(
-        model_kwargs={"device": "cpu"},
-        show_progress=False
-    )
-    vectorstore = FAISS.load_local(
-        load_path,
-        embeddings,
-        allow_dangerous_deserialization=True
+    embeddings = get_embeddings()
+    _check_embedding_dim(
+        embeddings, load_db_metadata(load_path).get("embedding_dim"), load_path
     )
+    docstore_path = os.path.join(load_path, DOCSTORE_FILE_NAME)
+    
+    if is_columnar(load_path):
+        vectorstore = load_columnar(load_path, embeddings)
+    elif mmap and os.path.exists(docstore_path):
+        index = read_index_mmap(
+            os.path.join(load_path, "index.faiss"),
+            load_db_metadata(load_path)["index_type"]
+        )
+        docstore = SQLiteDocstore(docstore_path)
+        vectorstore = FAISS(embeddings, index, docstore, docstore.index_mapping())
+    else:
+        if mmap:
+            print(f"{load_path} 沒有 {DOCSTORE_FILE_NAME}，改用一般載入")
+        vectorstore = FAISS.load_local(
+            load_path,
+            embeddings,
+            allow_dangerous_deserialization=True
+        )
+    
+    # Databases saved before the dimension was recorded
+    _check_embedding_dim(embeddings, vectorstore.index.d, load_path)
+    
+    keyword_index_path = os.path.join(load_path, KEYWORD_INDEX_FILE_NAME)
+    if os.path.exists(keyword_index_path):
+        # Read on first hybrid search, so loading stays independent of corpus size
+        vectorstore.keyword_index = LazyKeywordIndex(keyword_index_path)
+    
+    set_search_params(vectorstore.index)
     return vectorstore